@@ -1,56 +1,43 @@
-from typing import Dict
-from src.vertex import Vertex
 import sys
 
-import src.file_parse as file_parse
+import src.frame_cache as frame_cache
+import src.output as output
+import src.profiler as profiler
+import src.render as render
 import src.utils as utils
-import src.variables as var
-import src.objects as obj
 def main():
     # get the file name
     args = sys.argv
     cmnd_line_args = utils.parse_args(args)
+    if cmnd_line_args.profile:
+        profiler.active = profiler.Profiler()
+    cache = None
+    if cmnd_line_args.cache:
+        cache = frame_cache.FrameCache(cmnd_line_args.cache, cmnd_line_args.cache_size * 2**20)
+    stream = None
+    # anything printed goes to stderr when the frames go to stdout
+    log = sys.stdout
+    if cmnd_line_args.output != "png":
+        image_info = render.read_image_info(cmnd_line_args.file)
+        out = cmnd_line_args.out
+        if out is None:
+            out = image_info.filename.rstrip("-_") + ".png" if cmnd_line_args.output == "apng" else "-"
+        if out == "-":
+            log = sys.stderr
+        stream = output.open_stream(cmnd_line_args.output, out, image_info.width, image_info.height,
+            image_info.number_of_images, cmnd_line_args.fps)
 
-    # open the file
-    with open(cmnd_line_args.file, "r") as file:
-        lines = file.readlines()
-        # Read the first line to determine meta info about the file
-        first_line: str
-        if lines:
-            first_line = lines[0]
-        else:
-            print("not enough lines")
-            raise
-        
-        # Get the image info from the first line
-        image_info = file_parse.get_image_info(first_line)
-        # Make array of images
-        images = utils.make_images(image_info)
-        image_filenames = utils.make_filename_list(image_info)
-        # Initialize the structures needed to render the scene
-        draw_data = utils.SceneData(
-            vertex_list=[],
-            height=image_info.height,
-            width=image_info.width
-        )
-        variables = var.Variables(image_info.number_of_images)
-        objects: Dict[str, obj.Object] = {}
-        if len(lines) <= 1:
-            raise Exception("Nothing to draw")
-        for image in images:
-            for i in range(1, len(lines)):
-                line = utils.line_to_list(lines[i])
-                if line:
-                    file_parse.parse_line(line, image, draw_data, variables, objects)
-            # Whipe the data of variables and objects
-            objects.clear()
-            variables.new_frame()
-            draw_data.clear()
-        assert(len(image_filenames) == len(images))
-        # Save each of the files
-        for i in range(len(image_filenames)):
-            print(f"saving file {image_filenames[i]}")
-            images[i].save(image_filenames[i])
+    if cmnd_line_args.jobs > 1:
+        render.render_parallel(cmnd_line_args.file, cmnd_line_args.jobs,
+            cmnd_line_args.depth_dtype, cmnd_line_args.tile_size, cmnd_line_args.threads, cache, stream)
+    else:
+        render.render_all(render.load(cmnd_line_args.file,
+            cmnd_line_args.depth_dtype, cmnd_line_args.tile_size, cmnd_line_args.threads), cache, stream)
+
+    if cmnd_line_args.profile:
+        print(profiler.active.summary(), file=log)
+        if cmnd_line_args.trace:
+            profiler.active.write_trace(cmnd_line_args.trace)
 
 # Main method
 if __name__ == "__main__":
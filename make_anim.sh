@@ -1,19 +1,12 @@
 #!/bin/zsh
 TEST_FILE=$1
-if [ ! -f "$TEST_FILE"]; then
+if [ ! -f "$TEST_FILE" ]; then
     echo "$TEST_FILE does not exist."
+    exit 1
 fi
 echo -n "Whate Frame Rate do you want?: "
 read FRAME
-make run file=$TEST_FILE
 filename="$(basename "${TEST_FILE%.*}")"
-# make directory
-if [ ! -d "test/created_files/$filename"]; then
-    echo "making directory"
-    mkdir test/created_files/$filename
-fi
-mkdir test/created_files/$filename
-mv $filename* test/created_files/$filename
-ffmpeg -r $FRAME -i test/created_files/$filename/$filename-%03d.png -f apng -plays 0 test/created_files/$filename.png
-rm test/created_files/$filename/$filename-*
-rmdir test/created_files/$filename
\ No newline at end of file
+mkdir -p test/created_files
+# the frames go straight into the animated png, without a png per frame
+make run file=$TEST_FILE flags="--output apng --fps $FRAME --out test/created_files/$filename.png"
@@ -1,11 +1,4 @@
 #!/bin/zsh
-shopt -s nullglob
-for file in test/test_files/*.txt
-do
-    make run file=$file
-    filename="$(basename "${file%.*}")"
-    make comp file=$filename.png
-    rm $filename.png
-     
-done
-shopt -u nullglob
+# renders every file in test/test_files in parallel and compares the frames with
+# test/correct_files, see python -m src.regression --help for the options
+make regress flags="$*"
@@ -0,0 +1,372 @@
+"""Times each stage of the renderer on synthetic scenes.
+
+Every scene is written out as the lines of a file, so the same generated scene goes
+through parsing, transforms, rasterization and saving. Each stage is timed on its own,
+best of `repeat` runs, and the results can be written as JSON and compared against a
+baseline saved from an earlier run:
+
+    python -m src.benchmark --size small --baseline test/benchmark_baseline.json
+    python -m src.benchmark --baseline test/benchmark_baseline.json --save-baseline
+"""
+import argparse
+import dataclasses
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.framebuffer import Framebuffer
+import src.file_parse as file_parse
+import src.lines as lines
+import src.objects as obj
+import src.raster as raster
+import src.render as render
+import src.three_d as three_d
+import src.utils as utils
+import src.variables as var
+import src.vertex as vertex
+
+# a 90 degree field of view with the near plane at 0.1 and the far plane at 10
+LOADP = "loadp 1 0 0 0  0 1 0 0  0 0 -1.02020202020202 -0.20202020202020202  0 0 -1 0"
+# how much bigger each size makes the scenes, and the size of their images
+SIZES = {
+    "small": (1, 96, 72),
+    "medium": (2, 240, 180),
+    "large": (4, 480, 360),
+}
+# differences smaller than this are noise, not slowdowns
+MIN_REGRESSION_SECONDS = 0.002
+
+
+@dataclasses.dataclass
+class Scene():
+    """A generated file
+    \b name: used as the key of the scene in the results
+    \b lines: the lines of the file, the first one included
+    """
+    name: str
+    lines: "list[str]"
+
+
+def _header(width: int, height: int, name: str, frames: int = 1) -> "list[str]":
+    return [f"pngs {width} {height} {name}- {frames}", LOADP]
+
+def _grid(n: int, z: float, keyword: str) -> "list[str]":
+    """n by n squares, each split in two triangles, filling the view at depth z
+    """
+    out = []
+    coords = np.linspace(-z * 0.9, z * 0.9, n + 1)
+    for j in range(n + 1):
+        for i in range(n + 1):
+            # xyz takes its color from the color line before it
+            out.append(f"color {i / n:.3f} {j / n:.3f} 0.5")
+            out.append(f"xyz {coords[i]:.4f} {coords[j]:.4f} {-z}")
+    for j in range(n):
+        for i in range(n):
+            a = j * (n + 1) + i + 1
+            out.append(f"{keyword} {a} {a + 1} {a + n + 1}")
+            out.append(f"{keyword} {a + 1} {a + n + 2} {a + n + 1}")
+    return out
+
+def small_triangles(scale: int, width: int, height: int, keyword: str) -> Scene:
+    n = 12 * scale
+    return Scene(f"small_triangles_{keyword}",
+        _header(width, height, "small") + ["object grid world"] + _grid(n, 3, keyword))
+
+def huge_triangles(scale: int, width: int, height: int, keyword: str) -> Scene:
+    out = _header(width, height, "huge") + ["object big world"]
+    for i in range(4 * scale):
+        z = -2 - 0.5 * i
+        out += [
+            "color 1 0 0",
+            f"xyz {-3 * -z} {-3 * -z} {z}",
+            "color 0 1 0",
+            f"xyz {3 * -z} {-2 * -z} {z}",
+            "color 0 0 1",
+            f"xyz {i % 2 - 0.5} {3 * -z} {z}",
+            f"color {i % 3 / 2} 0.5 {1 - i % 2}",
+            f"{keyword} -3 -2 -1",
+        ]
+    return Scene(f"huge_triangles_{keyword}", out)
+
+def parent_chain(scale: int, width: int, height: int) -> Scene:
+    """Each object is the child of the one before it, with a small triangle of its own
+    """
+    out = _header(width, height, "chain")
+    parent = "world"
+    for i in range(24 * scale):
+        name = f"link{i}"
+        out += [
+            f"object {name} {parent}",
+            "position 0.05 0.02 -0.1" if i else "position 0 0 -4",
+            f"euler xyz 1 2 {i % 5}",
+            "scale 0.99 0.99 0.99",
+            "xyz -0.2 -0.2 0",
+            "xyz 0.2 -0.2 0",
+            "xyz 0 0.2 0",
+            "trif 1 2 3",
+        ]
+        parent = name
+    return Scene("parent_chain", out)
+
+def variable_chain(scale: int, width: int, height: int) -> Scene:
+    """A long run of arithmetic feeding the position of one object
+    """
+    out = _header(width, height, "vars", frames=2) + ["div v0 f l"]
+    ops = ("add", "mul", "sub", "div")
+    for i in range(1, 200 * scale):
+        out.append(f"{ops[i % 4]} v{i} v{i - 1} {1 + (i % 7) / 10}")
+    last = f"v{200 * scale - 1}"
+    out += [
+        "sin x " + last,
+        "object o world",
+        "position x 0 -4",
+        "xyz -1 -1 0",
+        "xyz 1 -1 0",
+        "xyz 0 1 0",
+        "trif 1 2 3",
+    ]
+    return Scene("variable_chain", out)
+
+def many_frames(scale: int, width: int, height: int) -> Scene:
+    frames = 12 * scale
+    out = _header(width, height, "frames", frames=frames) + [
+        "div t f l",
+        "mul a t 6.283",
+        "sin s a",
+        "cos c a",
+        "object still world",
+        "position 0 0 -5",
+    ] + _grid(4 * scale, 5, "trig") + [
+        "object spinning world",
+        "position s c -4",
+        "quaternion c 0 0 s",
+        "color 1 0 0",
+        "xyz -1 -1 0",
+        "color 0 1 0",
+        "xyz 1 -1 0",
+        "color 0 0 1",
+        "xyz 0 1 0",
+        "trig 1 2 3",
+    ]
+    return Scene("many_frames", out)
+
+def make_scenes(size: str) -> "list[Scene]":
+    scale, width, height = SIZES[size]
+    return [
+        small_triangles(scale, width, height, "trif"),
+        small_triangles(scale, width, height, "trig"),
+        huge_triangles(scale, width, height, "trif"),
+        huge_triangles(scale, width, height, "trig"),
+        parent_chain(scale, width, height),
+        variable_chain(scale, width, height),
+        many_frames(scale, width, height),
+    ]
+
+
+def _best_of(repeat: int, run: Callable[[], None]) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _load(scene: Scene) -> render.Renderer:
+    image_info = file_parse.get_image_info(scene.lines[0])
+    variables = var.Variables(image_info.number_of_images)
+    program = file_parse.compile_file(scene.lines[1:], variables)
+    draw_data = utils.SceneData([], image_info.height, image_info.width)
+    return render.Renderer(image_info, utils.make_filename_list(image_info), program, variables, draw_data)
+
+def _trace_first_frame(renderer: render.Renderer) -> "tuple[list, list, dict, utils.SceneData]":
+    """Runs the first frame one instruction at a time, keeping the vertices each object
+    was given and the screen coordinates of every triangle drawn. Returns those with the
+    objects and the draw data the frame ended with.
+    """
+    program, objects = renderer.program, renderer.objects
+    draw_data = utils.SceneData([], renderer.image_info.height, renderer.image_info.width)
+    renderer.variables.set_frame(0)
+    image = Framebuffer(renderer.image_info.width, renderer.image_info.height)
+    meshes, triangles = [], []
+    i = 0
+    while i < len(program.instructions):
+        instruction = program.instructions[i]
+        if instruction.keyword in ("object", "camera") and draw_data.curent_object is not None:
+            meshes.append((draw_data.curent_object, list(draw_data.vertex_list)))
+        if instruction.fragments is not None:
+            screen = three_d.transform_vertices(draw_data, objects)
+            triangles.append([screen[file_parse.vert_index(index)] for index in instruction.args[:3]])
+        target = instruction.run(image, draw_data, objects)
+        i = i + 1 if target is None else target
+    if draw_data.curent_object is not None:
+        meshes.append((draw_data.curent_object, list(draw_data.vertex_list)))
+    traced = dict(objects)
+    objects.clear()
+    return meshes, triangles, traced, draw_data
+
+def benchmark_scene(scene: Scene, repeat: int) -> dict:
+    """Times every stage on one scene. Transforms and rasterization are timed on the
+    objects and triangles of the scene's first frame.
+    """
+    seconds: Dict[str, float] = {}
+    image_info = file_parse.get_image_info(scene.lines[0])
+    width, height = image_info.width, image_info.height
+
+    seconds["parse"] = _best_of(repeat, lambda: file_parse.compile_file(
+        scene.lines[1:], var.Variables(image_info.number_of_images)))
+
+    renderer = _load(scene)
+    meshes, triangles, objects, draw_data = _trace_first_frame(renderer)
+
+    def position_matrices():
+        # new objects with the same inputs, so nothing is kept from an earlier run
+        fresh = {name: obj.Object(o.parent, o.origin, o.scale, o.position, o.orient)
+            for name, o in objects.items()}
+        for o in fresh.values():
+            o.make_position_matrix(fresh)
+    seconds["position_matrix"] = _best_of(repeat, position_matrices)
+
+    def transform_vertex():
+        for name, verts in meshes:
+            draw_data.curent_object = name
+            for v in verts:
+                three_d.transform_vertex(v, draw_data, objects)
+    def transform_vertices():
+        for name, verts in meshes:
+            draw_data.curent_object = name
+            draw_data.vertex_list = verts
+            draw_data.reset_screen_vertices()
+            three_d.transform_vertices(draw_data, objects)
+    seconds["transform_vertex"] = _best_of(repeat, transform_vertex)
+    seconds["transform_vertices"] = _best_of(repeat, transform_vertices)
+
+    def triangle_fill():
+        for p1, p2, p3 in triangles:
+            lines.triangle_fill(*(vertex.ndarray_to_vertex(p, is_rounded=False) for p in (p1, p2, p3)),
+                width=width, height=height)
+    def dda():
+        for p1, p2, p3 in triangles:
+            lines.dda(p1, p2)
+            lines.dda(p2, p3)
+            lines.dda(p3, p1)
+    def triangle_fragments():
+        for p1, p2, p3 in triangles:
+            raster.triangle_fragments(p1, p2, p3, width, height)
+    seconds["triangle_fill"] = _best_of(repeat, triangle_fill)
+    seconds["dda"] = _best_of(repeat, dda)
+    seconds["triangle_fragments"] = _best_of(repeat, triangle_fragments)
+
+    image = Framebuffer(width, height)
+    def frames():
+        renderer.program.frames_run = 0
+        for frame in range(image_info.number_of_images):
+            image.clear()
+            render.render_frame(renderer, frame, image)
+    seconds["frames"] = _best_of(repeat, frames)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "frame.png")
+        seconds["save"] = _best_of(repeat, lambda: image.save(filename))
+
+    return {
+        "frames": image_info.number_of_images,
+        "vertices": sum(len(verts) for _, verts in meshes),
+        "triangles": len(triangles),
+        "seconds": seconds,
+    }
+
+def run(size: str = "small", repeat: int = 3, scenes: Optional["list[str]"] = None) -> dict:
+    """Benchmarks the scenes of a size, or only the ones named in `scenes`
+    """
+    results = {}
+    for scene in make_scenes(size):
+        if scenes and scene.name not in scenes:
+            continue
+        results[scene.name] = benchmark_scene(scene, repeat)
+    return {
+        "size": size,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scenes": results,
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.25) -> "list[str]":
+    """The stages that got slower than the baseline by more than `tolerance`, as a
+    fraction of the baseline time. Scenes and stages missing from either are skipped.
+    """
+    slower = []
+    for name, scene in results["scenes"].items():
+        old = baseline.get("scenes", {}).get(name, {}).get("seconds", {})
+        for stage, seconds in scene["seconds"].items():
+            if stage not in old:
+                continue
+            if seconds > old[stage] * (1 + tolerance) and seconds - old[stage] > MIN_REGRESSION_SECONDS:
+                slower.append(f"{name} {stage}: {old[stage]:.4f}s -> {seconds:.4f}s")
+    return slower
+
+def format_table(results: dict, baseline: Optional[dict] = None) -> str:
+    rows = [("scene", "stage", "seconds", "baseline", "ratio")]
+    for name, scene in results["scenes"].items():
+        old = (baseline or {}).get("scenes", {}).get(name, {}).get("seconds", {})
+        for stage, seconds in scene["seconds"].items():
+            if stage in old:
+                ratio = f"{seconds / old[stage]:.2f}" if old[stage] else "-"
+                rows.append((name, stage, f"{seconds:.4f}", f"{old[stage]:.4f}", ratio))
+            else:
+                rows.append((name, stage, f"{seconds:.4f}", "-", "-"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows)
+
+def main(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.benchmark",
+        description="Times each stage of the renderer on synthetic scenes")
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--scene", action="append", help="only run this scene, can be given more than once")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+        help="how much slower than the baseline a stage can get, as a fraction")
+    parsed = parser.parse_args(args)
+
+    results = run(parsed.size, parsed.repeat, parsed.scene)
+    if parsed.output:
+        with open(parsed.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    baseline = None
+    if parsed.baseline and not parsed.save_baseline:
+        if os.path.exists(parsed.baseline):
+            with open(parsed.baseline) as file:
+                baseline = json.load(file)
+        else:
+            print(f"no baseline at {parsed.baseline}, run with --save-baseline to make one")
+    print(format_table(results, baseline))
+
+    if parsed.save_baseline:
+        if not parsed.baseline:
+            parser.error("--save-baseline needs --baseline")
+        with open(parsed.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"saved baseline to {parsed.baseline}")
+    elif baseline is not None:
+        if baseline.get("size") != results["size"]:
+            print(f"baseline is for size {baseline.get('size')}, not {results['size']}")
+        slower = compare(results, baseline, parsed.tolerance)
+        if slower:
+            print("slower than the baseline:")
+            print("\n".join("  " + line for line in slower))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,23 +1,34 @@
+import functools
+import math
+from typing import Optional
 
+import numpy as np
+
+from src.framebuffer import Framebuffer
 from src.utils import RGB
 from src.vertex import Vertex
-
 import src.vertex as vertex
-import src.lines as lines
-from src.utils import RGB
+
+# how many radii circle_offsets keeps the offsets of
+CIRCLE_CACHE_SIZE = 256
 
 def make_permutations(x_initial, x, y_initial, y, color: RGB):
-    v1 = Vertex(x_initial + x, y_initial + y, color.r, color.g, color.b, color.a)
-    v2 = Vertex(x_initial + x, y_initial - y, color.r, color.g, color.b, color.a)
-    v3 = Vertex(x_initial - x, y_initial + y, color.r, color.g, color.b, color.a)
-    v4 = Vertex(x_initial - x, y_initial - y, color.r, color.g, color.b, color.a)
-    v5 = Vertex(x_initial + y, y_initial + x, color.r, color.g, color.b, color.a)
-    v6 = Vertex(x_initial + y, y_initial - x, color.r, color.g, color.b, color.a)
-    v7 = Vertex(x_initial - y, y_initial + x, color.r, color.g, color.b, color.a)
-    v8 = Vertex(x_initial - y, y_initial - x, color.r, color.g, color.b, color.a)
+    v1 = Vertex(x_initial + x, y_initial + y, r=color.r, g=color.g, b=color.b, a=color.a)
+    v2 = Vertex(x_initial + x, y_initial - y, r=color.r, g=color.g, b=color.b, a=color.a)
+    v3 = Vertex(x_initial - x, y_initial + y, r=color.r, g=color.g, b=color.b, a=color.a)
+    v4 = Vertex(x_initial - x, y_initial - y, r=color.r, g=color.g, b=color.b, a=color.a)
+    v5 = Vertex(x_initial + y, y_initial + x, r=color.r, g=color.g, b=color.b, a=color.a)
+    v6 = Vertex(x_initial + y, y_initial - x, r=color.r, g=color.g, b=color.b, a=color.a)
+    v7 = Vertex(x_initial - y, y_initial + x, r=color.r, g=color.g, b=color.b, a=color.a)
+    v8 = Vertex(x_initial - y, y_initial - x, r=color.r, g=color.g, b=color.b, a=color.a)
     
     return [v1, v2, v3, v4, v5, v6, v7, v8]
-def draw_circle(x_initial: int, y_initial: int, radius: int, color: RGB) -> "list[vertex.Vertex]":
+
+@functools.lru_cache(maxsize=CIRCLE_CACHE_SIZE)
+def _circle_points(radius: int) -> np.ndarray:
+    """The midpoint algorithm's points around a circle at (0, 0), as an (N, 2) array in
+    the order of make_permutations, eight for every step, repeating where octants meet
+    """
     x = -1 * radius
     y = 0
     p = -1 * radius - 1
@@ -25,9 +36,9 @@ def draw_circle(x_initial: int, y_initial: int, radius: int, color: RGB) -> "lis
     py = 4
     pxx = 8
     pyy = 8
-    output = []
+    steps = []
     while y <= -x:
-        output += make_permutations(x_initial, x, y_initial, y, color)
+        steps.append((x, y))
         y += 1
         p += py
         py += pyy
@@ -35,25 +46,117 @@ def draw_circle(x_initial: int, y_initial: int, radius: int, color: RGB) -> "lis
             x += 1
             p += px
             px += pxx
-    return output
+    x, y = np.array(steps).reshape(-1, 2).T
+    points = np.stack([(x, y), (x, -y), (-x, y), (-x, -y), (y, x), (y, -x), (-y, x), (-y, -x)], axis=1)
+    return points.transpose(2, 1, 0).reshape(-1, 2)
+
+@functools.lru_cache(maxsize=CIRCLE_CACHE_SIZE)
+def circle_offsets(radius: int, filled: bool = False) -> np.ndarray:
+    """The pixels of a circle at (0, 0) as an (N, 2) integer array of x, y offsets, each
+    pixel once. A filled circle has every pixel on each row between the outline's
+    leftmost and rightmost ones. Kept for the last CIRCLE_CACHE_SIZE radii.
+    """
+    outline = np.unique(np.round(_circle_points(radius)).astype(int), axis=0)
+    if not filled:
+        offsets = outline
+    else:
+        rows, row_of = np.unique(outline[:, 1], return_inverse=True)
+        half = np.zeros(len(rows), dtype=int)
+        np.maximum.at(half, row_of, np.abs(outline[:, 0]))
+        widths = 2 * half + 1
+        starts = np.cumsum(widths) - widths
+        x = np.arange(widths.sum()) - np.repeat(starts + half, widths)
+        offsets = np.column_stack([x, np.repeat(rows, widths)])
+    offsets.flags.writeable = False
+    return offsets
+
+def draw_circle(x_initial: int, y_initial: int, radius: int, color: RGB) -> "list[vertex.Vertex]":
+    points = _circle_points(radius)
+    buffer = np.empty((len(points), len(vertex.ATTRIBUTES)))
+    buffer[:] = [0, 0, 1, 1, color.r, color.g, color.b, color.a]
+    buffer[:, :2] = points + (x_initial, y_initial)
+    return vertex.buffer_vertices(buffer)
+
+def write_circle(image: Framebuffer, x_initial: int, y_initial: int, radius: int, color: RGB, filled: bool = False) -> None:
+    """Draws a circle straight into the image, without a depth test, see circle_offsets
+    """
+    offsets = circle_offsets(radius, filled)
+    image.write_pixels(offsets[:, 0] + round(x_initial), offsets[:, 1] + round(y_initial),
+        (color.r, color.g, color.b, color.a))
+
+# how far, in pixels, the segments drawn for a curve may stray from it
+FLATNESS = 0.5
+# the most segments a curve is drawn with
+MAX_SEGMENTS = 1000
+
+def bernstein(degree: int, u: np.ndarray) -> np.ndarray:
+    """The Bernstein polynomials of `degree` at each of the parameters u, as a
+    (len(u), degree + 1) matrix. Multiplying it by the control points gives the points
+    on the curve.
+    """
+    u = np.asarray(u, dtype=float)[:, None]
+    i = np.arange(degree + 1)
+    binomials = np.array([math.factorial(degree) // (math.factorial(k) * math.factorial(degree - k)) for k in i], dtype=float)
+    return binomials * u**i * (1 - u)**(degree - i)
+
+@functools.lru_cache(maxsize=64)
+def bernstein_basis(degree: int, samples: int) -> np.ndarray:
+    """bernstein at `samples` evenly spaced parameters from 0 to 1, kept for reuse
+    """
+    basis = bernstein(degree, np.linspace(0, 1, samples))
+    basis.flags.writeable = False
+    return basis
+
+def bezier_segments(control: np.ndarray) -> int:
+    """How many segments of equal parameter length a curve needs for none of them to be
+    more than FLATNESS pixels from it. The distance is at most n (n - 1) / 8 m^2 times
+    the largest second difference of the control points, for a degree n curve drawn with
+    m segments. A straight line only needs one.
+    """
+    degree = len(control) - 1
+    if degree < 2:
+        return 1
+    second = control[2:, :2] - 2 * control[1:-1, :2] + control[:-2, :2]
+    bound = degree * (degree - 1) * np.hypot(second[:, 0], second[:, 1]).max() / 8
+    return int(min(MAX_SEGMENTS, max(1, math.ceil(math.sqrt(bound / FLATNESS)))))
+
+def polyline_pixels(points: np.ndarray) -> np.ndarray:
+    """lines.dda between each point and the next, for every segment at once. Each segment
+    steps along the axis it changes most in, from the first integer at or after its lower
+    end up to, but not including, its higher end.
+    """
+    start, end = points[:-1], points[1:]
+    delta = end - start
+    step = (np.abs(delta[:, 0]) < np.abs(delta[:, 1])).astype(int)
+    rows = np.arange(len(delta))
+    # go from the lower end to the higher end in the step direction
+    flip = delta[rows, step] < 0
+    start, end = np.where(flip[:, None], end, start), np.where(flip[:, None], start, end)
+    delta = np.where(flip[:, None], -delta, delta)
+    low, high, change = start[rows, step], end[rows, step], delta[rows, step]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dp = np.where(change[:, None] != 0, delta / change[:, None], 0)
+    first = np.ceil(low)
+    counts = np.maximum(0, np.ceil(high - first)).astype(int)
+    segment = np.repeat(rows, counts)
+    # how many steps each pixel is along its segment
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return start[segment] + ((first - low)[segment] + steps)[:, None] * dp[segment]
+
+def bezier_curve_pixels(control: np.ndarray, divisions: Optional[int] = None) -> np.ndarray:
+    """The pixels of a Bezier curve, as rows of attributes like its (N, k) control points.
+    The curve is sampled at `divisions` points, or at enough for bezier_segments, and
+    the points joined with polyline_pixels.
+    """
+    samples = divisions if divisions is not None else bezier_segments(control) + 1
+    return polyline_pixels(bernstein_basis(len(control) - 1, samples) @ control)
 
 def draw_bezier_point(points: "list[Vertex]", u: float):
-    copy_points = list(map(lambda c: c.as_ndarray(), points))
-    for k in range(1, len(points)):
-        for i in range(0, len(points) - k):
-            copy_points[i] = (1-u) * copy_points[i] + u * copy_points[i+1]
-    bezier_point = vertex.ndarray_to_vertex(copy_points[0], is_rounded=False)
-    return bezier_point
-
-def draw_bezier_curve(points: "list[Vertex]", divisions: int = 1000) -> "list[Vertex]":
-    curve_points = []
-    for i in range(divisions):
-        u = i/float(divisions-1)
-        curve_points.append(draw_bezier_point(points, u))
-    # draw lines between each of points on the curve
-    verts = []
-    for i in range(len(curve_points)-1):
-        v1 = curve_points[i]
-        v2 = curve_points[i+1]
-        verts += lines.dda_on_vertex(v1, v2)
-    return verts
\ No newline at end of file
+    point = bernstein(len(points) - 1, [u]) @ vertex.vertex_buffer(points)
+    return vertex.ndarray_to_vertex(point[0], is_rounded=False)
+
+def draw_bezier_curve(points: "list[Vertex]", divisions: Optional[int] = None) -> "list[Vertex]":
+    """The vertices of the pixels of the Bezier curve with control `points`, see
+    bezier_curve_pixels
+    """
+    return vertex.buffer_vertices(bezier_curve_pixels(vertex.vertex_buffer(points), divisions))
@@ -0,0 +1,148 @@
+"""Works out which parts of a compiled file give the same result on every frame.
+
+Everything starts out frame invariant except the variable `f`. A line varies when it
+reads something that varies, or when it sits between an iflt whose condition varies and
+the fi (or next iflt) that ends it. State that lines leave behind for later lines, such
+as the color, the projection, the camera, culling and the current object's vertices,
+varies from the last varying line that set it; inside an iflt it can only become
+varying, since the other branch may not have set it.
+"""
+import dataclasses
+from typing import Dict, List, Optional, Set
+
+from src.variables import Variables
+
+TRANSFORM_KEYWORDS = ("position", "origin", "scale", "quaternion", "euler")
+TRIANGLE_KEYWORDS = ("trif", "trig")
+
+
+@dataclasses.dataclass
+class Dependencies():
+    """The result of analyze
+    \b invariant: for every instruction, true if it does the same thing every frame
+    \b varying_slots: the variable slots whose value changes between frames
+    \b varying_objects: the objects whose position matrix changes between frames
+    \b static_triangles: triangles whose fragments are the same every frame
+    \b static_layer: the last of the triangles drawn before any varying triangle, the
+    image and depth buffer are the same every frame up to and including it
+    \b skippable: xyz lines whose vertices are only used by static triangles
+    """
+    invariant: List[bool]
+    varying_slots: Set[int]
+    varying_objects: Set[str]
+    static_triangles: List[int]
+    static_layer: Optional[int]
+    skippable: List[int]
+
+
+def analyze(instructions: list, variables: Variables) -> Dependencies:
+    """Marks the variables, object transforms and triangles of a program as frame
+    invariant or frame dependent
+
+    Args:
+        instructions (list[file_parse.Instruction]): the compiled lines
+        variables (Variables): the variables the lines were compiled with
+    """
+    invariant = [True] * len(instructions)
+    varying_slots = {variables.slot("f")}
+    # the objects whose own transform lines vary, and the parent of each object
+    own_varying: Dict[str, bool] = {}
+    parents: Dict[str, str] = {}
+    # the triangles, with the objects that might be current and the objects that might be
+    # the camera when they are drawn
+    triangles: "list[tuple[int, Set[str], Set[str], bool]]" = []
+    # lines after an unguarded object line, up to the next one
+    blocks: "list[list[int]]" = []
+
+    in_branch = False
+    branch_varies = False
+    color_varies = False
+    projection_varies = False
+    cull_varies = False
+    vertices_vary = False
+    current_objects: Set[str] = set()
+    current_object_varies = False
+    cameras: Set[str] = set()
+
+    def update(state: bool, varies: bool) -> bool:
+        return state or varies if in_branch else varies
+
+    for i, instruction in enumerate(instructions):
+        keyword = instruction.keyword
+        if keyword == "iflt":
+            in_branch = True
+            branch_varies = any(slot in varying_slots for slot in instruction.reads)
+            invariant[i] = not branch_varies
+            continue
+        if keyword == "fi":
+            in_branch = False
+            branch_varies = False
+            continue
+        varies = branch_varies or any(slot in varying_slots for slot in instruction.reads)
+        if keyword == "xyz":
+            varies = varies or color_varies
+            vertices_vary = vertices_vary or varies
+        elif keyword == "color":
+            color_varies = update(color_varies, varies)
+        elif keyword == "loadp":
+            projection_varies = update(projection_varies, varies)
+        elif keyword == "cull":
+            cull_varies = update(cull_varies, varies)
+        elif keyword in ("object", "camera"):
+            name, parent = instruction.args
+            if keyword == "camera":
+                projection_varies = update(projection_varies, varies)
+                cameras = cameras | {name} if in_branch else {name}
+            parents[name] = parent
+            own_varying[name] = own_varying.get(name, False) or varies
+            vertices_vary = update(vertices_vary, varies)
+            current_object_varies = update(current_object_varies, varies)
+            if in_branch:
+                current_objects.add(name)
+            else:
+                current_objects = {name}
+                blocks.append([])
+        elif keyword in TRANSFORM_KEYWORDS:
+            for name in current_objects:
+                own_varying[name] = own_varying.get(name, False) or varies
+        elif keyword in TRIANGLE_KEYWORDS:
+            varies = varies or vertices_vary or projection_varies or cull_varies or current_object_varies \
+                or (keyword == "trif" and color_varies)
+            triangles.append((i, set(current_objects), set(cameras), varies))
+        if instruction.writes is not None and varies:
+            varying_slots.add(instruction.writes)
+        if blocks:
+            blocks[-1].append(i)
+        invariant[i] = not varies
+
+    # an object moves whenever its parent does
+    varying_objects = {name for name, varies in own_varying.items() if varies}
+    changed = True
+    while changed:
+        changed = False
+        for name, parent in parents.items():
+            if name not in varying_objects and (parent in varying_objects or
+                    (parent != "world" and parent not in parents)):
+                varying_objects.add(name)
+                changed = True
+
+    static_triangles = []
+    for i, objects, seen_from, varies in triangles:
+        if varies or objects & varying_objects or seen_from & varying_objects or not objects:
+            invariant[i] = False
+        else:
+            static_triangles.append(i)
+
+    static_layer = None
+    for i, *_ in triangles:
+        if not invariant[i]:
+            break
+        static_layer = i
+
+    skippable = []
+    for block in blocks:
+        drawn = [i for i in block if instructions[i].keyword in TRIANGLE_KEYWORDS]
+        if all(invariant[i] for i in drawn):
+            skippable += [i for i in block if instructions[i].keyword == "xyz"]
+
+    return Dependencies(invariant, varying_slots, varying_objects, static_triangles, static_layer, skippable)
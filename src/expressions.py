@@ -0,0 +1,142 @@
+"""Works out the variables of a compiled file for every frame at once.
+
+Each line that defines a variable is evaluated once, on an array holding its operands
+on every frame, instead of once per frame. Lines only ever jump forward, so which frames
+reach each line is found in the same pass: a mask of frames flows from line to line, an
+iflt splits it between the next line and its target, and else and fi pass it on to
+theirs. The results are kept as tables indexed by f, which runs from 0 to l - 1.
+
+Adding, subtracting, multiplying and dividing arrays of floats rounds exactly like doing
+it to python floats, so those work on whole arrays. NumPy's sin, cos and power can round
+differently from math.sin, math.cos and the ** operator, depending on the NumPy version,
+so those lines are evaluated one frame at a time with the same functions, see
+elementwise. Either way the tables are bit-identical to running the lines one frame at a
+time. When a frame would read a variable before it is defined, or an operation fails (a
+division by zero, a negative number to a fractional power, an overflow), no tables are
+made. The lines then run one frame at a time and fail, or don't, the way they always have.
+"""
+import dataclasses
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from src.variables import Variables
+
+# with fewer frames than this, working the lines out one frame at a time is quicker
+MIN_FRAMES = 32
+
+@dataclasses.dataclass
+class Tables():
+    """What tabulate worked out, indexed by frame number
+    \b values: for each line that defines a variable, the value it defines on the frames
+    that reach it
+    \b branches: for each iflt, whether its condition holds
+    \b everywhere: the lines that are reached on every frame
+    \b operands: for the other lines reached on every frame, the values they read, when
+    those are defined on every frame
+    """
+    values: Dict[int, np.ndarray]
+    branches: Dict[int, list]
+    everywhere: Set[int]
+    operands: Dict[int, List[np.ndarray]]
+
+
+def elementwise(op: Callable[..., float], inputs: int) -> Callable[..., np.ndarray]:
+    """Applies a function of floats to arrays, one element at a time, for the functions
+    whose NumPy versions don't round the same way
+    """
+    ufunc = np.frompyfunc(op, inputs, 1)
+    def apply(*args: np.ndarray) -> np.ndarray:
+        # a complex result, from a negative number to a fractional power, raises TypeError
+        return np.asarray(ufunc(*args), dtype=float)
+    return apply
+
+
+def tabulate(instructions: list, targets: "list[Optional[int]]", variables: Variables,
+        lines: Optional[List[int]] = None) -> Optional[Tables]:
+    """Evaluates the lines of a program for every frame, see the module docstring
+
+    Args:
+        instructions (list[file_parse.Instruction]): the compiled lines
+        targets (list[Optional[int]]): where each iflt, else and fi jumps to
+        variables (Variables): the variables the lines were compiled with
+        lines (list[int]): the lines to keep tables for, all of them if None
+
+    Returns:
+        the tables, or None when the lines have to be run one frame at a time
+    """
+    frames = int(variables.get_var("l"))
+    if frames < MIN_FRAMES:
+        return None
+    # the values of every slot on every frame, and the frames each one is defined on
+    env: Dict[int, np.ndarray] = {slot: np.full(frames, value, dtype=float) for slot, value in variables.literals.items()}
+    env[variables.slot("l")] = np.full(frames, frames, dtype=float)
+    env[variables.slot("f")] = np.arange(frames, dtype=float)
+    defined: Dict[int, np.ndarray] = {slot: np.ones(frames, dtype=bool) for slot in env}
+    # the frames that reach each line, added to as jumps to it are found
+    reach = [np.zeros(frames, dtype=bool) for _ in range(len(instructions) + 1)]
+    reach[0][:] = True
+    kept = set(range(len(instructions)) if lines is None else lines)
+    tables = Tables({}, {}, set(), {})
+
+    def operands(instruction, frames_in: np.ndarray, everywhere: bool) -> Optional[list]:
+        if everywhere:
+            if not all(slot in defined and defined[slot].all() for slot in instruction.reads):
+                return None
+            return [env[slot] for slot in instruction.reads]
+        if not all(slot in defined and defined[slot][frames_in].all() for slot in instruction.reads):
+            return None
+        return [env[slot][frames_in] for slot in instruction.reads]
+
+    for i, instruction in enumerate(instructions):
+        here = reach[i]
+        # lines outside of any iflt are reached on every frame
+        everywhere = bool(here.all())
+        if everywhere:
+            tables.everywhere.add(i)
+        keyword = instruction.keyword
+        if keyword == "iflt":
+            args = operands(instruction, here, everywhere)
+            if args is None:
+                return None
+            holds = np.zeros(frames, dtype=bool)
+            holds[here] = args[0] < args[1]
+            reach[i + 1] |= holds
+            reach[targets[i]] |= here & ~holds
+            if i in kept:
+                tables.branches[i] = holds.tolist()
+            continue
+        if targets[i] is not None:
+            reach[targets[i]] |= here
+            continue
+        reach[i + 1] |= here
+        if instruction.expression is None:
+            if everywhere and instruction.reads:
+                args = operands(instruction, here, everywhere)
+                if args is not None:
+                    tables.operands[i] = args
+            continue
+        if not here.any():
+            continue
+        args = operands(instruction, here, everywhere)
+        if args is None:
+            return None
+        try:
+            # underflow is left alone, like it is in python
+            with np.errstate(all="raise", under="ignore"):
+                result = instruction.expression(*args)
+        except (FloatingPointError, ZeroDivisionError, OverflowError, ValueError, TypeError):
+            return None
+        dest = instruction.writes
+        if everywhere:
+            env[dest] = np.asarray(result, dtype=float)
+            defined[dest] = here.copy()
+        else:
+            if dest not in env:
+                env[dest] = np.zeros(frames)
+                defined[dest] = np.zeros(frames, dtype=bool)
+            env[dest][here] = result
+            defined[dest] |= here
+        if i in kept:
+            tables.values[i] = env[dest].copy()
+    return tables
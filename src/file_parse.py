@@ -1,10 +1,16 @@
 
+import collections
+import dataclasses
 import math
-from typing import Dict
+import operator
+from typing import Callable, Dict, Optional
 
 import numpy as np
-from PIL import Image
 
+from src.framebuffer import Framebuffer
+import src.dependency as dependency
+import src.expressions as expressions
+import src.profiler as profiler
 import src.three_d as three_d
 import src.utils as utils
 from src.variables import Variables
@@ -39,26 +45,476 @@ def is_number(s: str) -> bool:
         return True
     except ValueError:
         return False
-def get_vert(verts, index: str) -> vertex.Vertex:
+def vert_index(index: str) -> int:
+    """Turns a vertex index from a file, which counts from 1 or from the end when
+    negative, into a list index
+    """
     if (index.strip("-")).isnumeric():
         index = int(index)
     else:
         raise Exception("The index of a vertex must be a number", index)
     # if its a negative index just use that idex
-    vert = None
     if index < 0:
-        vert = verts[index]
-    else:
-        vert = verts[index - 1]
-    return vert
+        return index
+    return index - 1
+def get_vert(verts, index: str) -> vertex.Vertex:
+    return verts[vert_index(index)]
 def var_val(var: str, variables: Variables) -> float:
     if is_number(var):
         return float(var)
     return variables.get_var(var)
 
-def parse_line(line: "list[str]", image: Image, draw_data: utils.SceneData, variables: Variables, objects: Dict[str, obj.Object]) -> None:
+### COMPILING LINES ###
+@dataclasses.dataclass
+class Instruction():
+    """A line of the file compiled into a function. Operands are resolved to slots in
+    `Variables.values` (or to constants) once, when the line is compiled.
+    \b keyword: the keyword the line starts with
+    \b run: takes (image, draw_data, objects), returns the index of the next instruction
+    to run if it jumps, None otherwise
+    \b reads: the slots of the variables and literals the line reads
+    \b writes: the slot of the variable the line defines, if any
+    \b args: the rest of the line
+    \b fragments: for triangles, takes (draw_data, objects) and returns the fragments
+    the triangle would draw, see three_d.shade_triangle
+    \b expression: for lines that define a variable, works out its value from arrays of
+    the values read, for every frame at once, see expressions.tabulate
+    \b node: for object and camera lines, the object they put in the scene
+    """
+    keyword: str
+    run: Callable[[Framebuffer, utils.SceneData, Dict[str, obj.Object]], Optional[int]]
+    reads: "tuple[int, ...]" = ()
+    writes: Optional[int] = None
+    args: "tuple[str, ...]" = ()
+    fragments: Optional[Callable[[utils.SceneData, Dict[str, obj.Object]], "tuple[np.ndarray, ...]"]] = None
+    expression: Optional[Callable[..., np.ndarray]] = None
+    node: Optional[obj.Object] = None
+
+@dataclasses.dataclass
+class Program():
+    """All of the lines of a file after the first one, compiled
+    \b first_frame: what each instruction runs on the first frame
+    \b later_frames: what each instruction runs on every other frame. Work that is the
+    same on every frame is done on the first one and reused, see dependency.analyze
+    \b table_slots, table_rows: the variables worked out ahead by expressions.tabulate
+    that run_frame sets before running a frame, and their values on every frame
+    """
+    instructions: "list[Instruction]"
+    variables: Variables
+    dependencies: dependency.Dependencies
+    table_slots: "list[int]" = dataclasses.field(default_factory=list)
+    table_rows: "list[list[float]]" = dataclasses.field(default_factory=list)
+    first_frame: "list[Callable]" = dataclasses.field(default_factory=list)
+    later_frames: "list[Callable]" = dataclasses.field(default_factory=list)
+    frames_run: int = 0
+
+def _compile_xyz(args: "list[str]", variables: Variables) -> Instruction:
+    x, y, z = (variables.slot(a) for a in args[:3])
+    values = variables.values
+    def run(image, draw_data, objects):
+        color = draw_data.color
+        new_vertex: vertex.Vertex = vertex.Vertex(
+            x=values[x],
+            y=values[y],
+            z=values[z],
+            r=color.r,
+            g=color.g,
+            b=color.b,
+            a=color.a,
+        )
+        draw_data.vertex_list.append(new_vertex)
+    return Instruction("xyz", run, reads=(x, y, z))
+
+def _compile_color(args: "list[str]", variables: Variables) -> Instruction:
+    # an alpha can follow red, green and blue, triangles that aren't opaque are blended
+    channels = tuple(variables.slot(a) for a in args[:4])
+    values = variables.values
+    def run(image, draw_data, objects):
+        draw_data.color = utils.RGBFloat(*[values[c] for c in channels])
+        if draw_data.color.a < 1:
+            draw_data.blending = True
+    return Instruction("color", run, reads=channels)
+
+def _compile_loadp(args: "list[str]", variables: Variables) -> Instruction:
+    # Take the 1x16 list and turn it into a 4x4 ndarray
+    projection = np.asarray(args, float).reshape(4,4)
+    def run(image, draw_data, objects):
+        draw_data.projection = projection
+        draw_data.view_projection = None
+        # vertices transformed with the old projection have to be redone
+        draw_data.reset_screen_vertices()
+    return Instruction("loadp", run)
+
+def _compile_triangle(keyword: str, gouraud: bool):
+    def compile_triangle(args: "list[str]", variables: Variables) -> Instruction:
+        i1, i2, i3 = (vert_index(i) for i in args[:3])
+        def fragments(draw_data, objects):
+            screen_vertices = three_d.transform_vertices(draw_data, objects)
+            p1 = screen_vertices[i1]
+            p2 = screen_vertices[i2]
+            p3 = screen_vertices[i3]
+            if three_d.cull_triangle(draw_data, p1, p2, p3):
+                return three_d.no_fragments()
+            return three_d.shade_triangle(draw_data, p1, p2, p3, gouraud=gouraud)
+        def run(image, draw_data, objects):
+            screen_vertices = three_d.transform_vertices(draw_data, objects)
+            three_d.draw_3d_triangle(image, draw_data, screen_vertices[i1], screen_vertices[i2],
+                screen_vertices[i3], gouraud=gouraud)
+        return Instruction(keyword, run, fragments=fragments)
+    return compile_triangle
+
+def _compile_object(args: "list[str]", variables: Variables, keyword: str = "object") -> Instruction:
+    if len(args) != 2:
+        raise Exception(f"{keyword} call expects 2 keywords, name and parent")
+    name, parent = args
+    # the same node is used every frame so it can keep its matrices
+    node = obj.Object(parent)
+    is_camera = keyword == "camera"
+    values = variables.values
+    frame = variables.slot("f")
+    def run(image, draw_data, objects):
+        node.reset(parent)
+        node.frame = values[frame]
+        objects[name] = node
+        # reset the vertex_list
+        draw_data.vertex_list.clear()
+        draw_data.reset_screen_vertices()
+        # set the current_object
+        draw_data.curent_object = name
+        if is_camera:
+            draw_data.camera = name
+            draw_data.view_projection = None
+    return Instruction(keyword, run, node=node)
+
+def _compile_camera(args: "list[str]", variables: Variables) -> Instruction:
+    # a camera is an object that the scene is drawn as seen from
+    return _compile_object(args, variables, keyword="camera")
+
+def _compile_vec3(keyword: str):
+    # position, origin and scale all set a Vec3 attribute of the current object
+    def compile_vec3(args: "list[str]", variables: Variables) -> Instruction:
+        x, y, z = (variables.slot(a) for a in args[:3])
+        values = variables.values
+        def run(image, draw_data, objects):
+            setattr(objects[draw_data.curent_object], keyword, utils.Vec3(values[x], values[y], values[z]))
+        return Instruction(keyword, run, reads=(x, y, z))
+    return compile_vec3
+
+def _compile_quaternion(args: "list[str]", variables: Variables) -> Instruction:
+    w, x, y, z = (variables.slot(a) for a in args[:4])
+    values = variables.values
+    def run(image, draw_data, objects):
+        quat = utils.Quaternion(values[w], values[x], values[y], values[z])
+        objects[draw_data.curent_object].orient = quat
+    return Instruction("quaternion", run, reads=(w, x, y, z))
+
+def _compile_euler(args: "list[str]", variables: Variables) -> Instruction:
+    xyz = args[0]
+    r1, r2, r3 = (variables.slot(a) for a in args[1:4])
+    values = variables.values
+    def run(image, draw_data, objects):
+        euler = utils.Euler(xyz, values[r1], values[r2], values[r3])
+        objects[draw_data.curent_object].orient = euler
+    return Instruction("euler", run, reads=(r1, r2, r3))
+
+def _compile_cull(args: "list[str]", variables: Variables) -> Instruction:
+    def run(image, draw_data, objects):
+        draw_data.cull = True
+    return Instruction("cull", run)
+
+def _compile_binary(keyword: str, op: Callable[[float, float], float], on_arrays: bool = True):
+    """With on_arrays, op works on whole arrays and rounds like it does on floats
+    """
+    expression = op if on_arrays else expressions.elementwise(op, 2)
+    def compile_binary(args: "list[str]", variables: Variables) -> Instruction:
+        dest, a, b = (variables.slot(a) for a in args[:3])
+        values = variables.values
+        def run(image, draw_data, objects):
+            values[dest] = op(values[a], values[b])
+        return Instruction(keyword, run, reads=(a, b), writes=dest, expression=expression)
+    return compile_binary
+
+def _compile_unary(keyword: str, op: Callable[[float], float]):
+    def in_degrees(a: float) -> float:
+        return op(math.radians(a))
+    expression = expressions.elementwise(in_degrees, 1)
+    def compile_unary(args: "list[str]", variables: Variables) -> Instruction:
+        dest, a = (variables.slot(a) for a in args[:2])
+        values = variables.values
+        def run(image, draw_data, objects):
+            values[dest] = in_degrees(values[a])
+        return Instruction(keyword, run, reads=(a,), writes=dest, expression=expression)
+    return compile_unary
+
+# every keyword that does something, other than the iflt, else and fi control flow
+COMPILERS: "Dict[str, Callable[[list[str], Variables], Instruction]]" = {
+    "xyz": _compile_xyz,
+    "color": _compile_color,
+    "loadp": _compile_loadp,
+    "cull": _compile_cull,
+    "trif": _compile_triangle("trif", gouraud=False),
+    "trig": _compile_triangle("trig", gouraud=True),
+    "object": _compile_object,
+    "camera": _compile_camera,
+    "position": _compile_vec3("position"),
+    "origin": _compile_vec3("origin"),
+    "scale": _compile_vec3("scale"),
+    "quaternion": _compile_quaternion,
+    "euler": _compile_euler,
+    "add": _compile_binary("add", operator.add),
+    "sub": _compile_binary("sub", operator.sub),
+    "mul": _compile_binary("mul", operator.mul),
+    "div": _compile_binary("div", operator.truediv),
+    "pow": _compile_binary("pow", operator.pow, on_arrays=False),
+    "sin": _compile_unary("sin", math.sin),
+    "cos": _compile_unary("cos", math.cos),
+}
+CONTROL_FLOW = ("iflt", "else", "fi")
+
+def _compile_iflt(args: "list[str]", variables: Variables, target: int) -> Instruction:
+    x, y = (variables.slot(a) for a in args[:2])
+    values = variables.values
+    def run(image, draw_data, objects):
+        if not values[x] < values[y]:
+            return target
+    return Instruction("iflt", run, reads=(x, y))
+
+def _compile_jump(keyword: str, target: Optional[int]) -> Instruction:
+    def run(image, draw_data, objects):
+        return target
+    return Instruction(keyword, run)
+
+def _branch_targets(keywords: "list[str]") -> "list[Optional[int]]":
+    """Where each iflt and else jumps to, matching the if_state rules of parse_line.
+    A false iflt skips to just after the next else, or to the next fi or iflt. Reaching
+    the first else after an iflt means the iflt was true, so it skips to the next fi or
+    iflt. Any other else does nothing.
+    """
+    targets: "list[Optional[int]]" = [None] * len(keywords)
+    for i, keyword in enumerate(keywords):
+        if keyword not in ("iflt", "else"):
+            continue
+        if keyword == "else":
+            # only the first else after an iflt jumps
+            opened = next((k for k in reversed(keywords[:i]) if k in CONTROL_FLOW), None)
+            if opened != "iflt":
+                continue
+        target = len(keywords)
+        for j in range(i + 1, len(keywords)):
+            if keyword == "iflt" and keywords[j] == "else":
+                target = j + 1
+                break
+            if keywords[j] in ("fi", "iflt"):
+                target = j
+                break
+        targets[i] = target
+    return targets
+
+def compile_lines(lines: "list[list[str]]", variables: Variables) -> Program:
+    """Compiles tokenized lines. Lines with unknown keywords (comments, fps, ...) are dropped.
+    """
+    lines = [line for line in lines if line and (line[0] in COMPILERS or line[0] in CONTROL_FLOW)]
+    targets = _branch_targets([line[0] for line in lines])
+    instructions = []
+    for line, target in zip(lines, targets):
+        keyword = line[0]
+        if keyword == "iflt":
+            instruction = _compile_iflt(line[1:], variables, target)
+        elif keyword in CONTROL_FLOW:
+            instruction = _compile_jump(keyword, target)
+        else:
+            instruction = COMPILERS[keyword](line[1:], variables)
+        instruction.args = tuple(line[1:])
+        instructions.append(instruction)
+    program = Program(instructions, variables, dependency.analyze(instructions, variables))
+    # lines that are the same every frame only run on the first one, so they aren't worth a table
+    varying = [i for i, invariant in enumerate(program.dependencies.invariant) if not invariant]
+    tables = expressions.tabulate(instructions, targets, variables, varying)
+    if tables is not None:
+        _look_up(program, tables, targets)
+        _tabulate_objects(program, tables)
+    _hoist(program)
+    return program
+
+def _look_up(program: Program, tables: expressions.Tables, targets: "list[Optional[int]]") -> None:
+    """Replaces the lines expressions.tabulate worked out. A variable defined by a single
+    line that every frame reaches is set by run_frame from program.table_rows, and its
+    line does nothing. Other lines, and iflt, look up their result for the current frame.
+    """
+    values = program.variables.values
+    frame = program.variables.slot("f")
+    definitions = collections.Counter(instruction.writes for instruction in program.instructions)
+    def lookup(dest: int, column: list) -> Callable:
+        def run_lookup(image, draw_data, objects):
+            values[dest] = column[values[frame]]
+        return run_lookup
+    def branch(column: list, target: int) -> Callable:
+        def run_branch(image, draw_data, objects):
+            if not column[values[frame]]:
+                return target
+        return run_branch
+    ahead = []
+    for i, column in tables.values.items():
+        instruction = program.instructions[i]
+        if i in tables.everywhere and definitions[instruction.writes] == 1:
+            ahead.append(i)
+            instruction.run = _skip
+        else:
+            instruction.run = lookup(instruction.writes, column.tolist())
+    for i, column in tables.branches.items():
+        program.instructions[i].run = branch(column, targets[i])
+    if ahead:
+        program.table_slots = [program.instructions[i].writes for i in ahead]
+        program.table_rows = np.column_stack([tables.values[i] for i in ahead]).tolist()
+
+def _tabulate_objects(program: Program, tables: expressions.Tables) -> None:
+    """Works out the local matrix of every moving object on every frame at once, see
+    objects.local_matrices. Only done when every object line and transform line is reached
+    on every frame, so which object each transform line sets is the same on every frame.
+    """
+    instructions = program.instructions
+    object_keywords = ("object", "camera")
+    if any(instruction.keyword in object_keywords + dependency.TRANSFORM_KEYWORDS and i not in tables.everywhere
+            for i, instruction in enumerate(instructions)):
+        return
+    # the lines after each object line, up to the next one
+    blocks: "list[tuple[Instruction, list[int]]]" = []
+    for i, instruction in enumerate(instructions):
+        if instruction.keyword in object_keywords:
+            blocks.append((instruction, []))
+        elif instruction.keyword in dependency.TRANSFORM_KEYWORDS and blocks:
+            blocks[-1][1].append(i)
+    names = collections.Counter(instruction.args[0] for instruction, _ in blocks)
+    frames = int(program.variables.get_var("l"))
+    for instruction, lines in blocks:
+        # objects named twice, or that don't move, keep building their matrices as needed
+        if names[instruction.args[0]] > 1 or all(program.dependencies.invariant[i] for i in lines):
+            continue
+        if not all(i in tables.operands for i in lines):
+            continue
+        inputs = {
+            "origin": np.zeros((frames, 3)),
+            "scale": np.ones((frames, 3)),
+            "position": np.zeros((frames, 3)),
+            "orient": np.broadcast_to(np.identity(4), (frames, 4, 4)),
+        }
+        # like the lines themselves, a later line overrides an earlier one
+        for i in lines:
+            keyword = instructions[i].keyword
+            operands = np.column_stack(tables.operands[i])
+            if keyword == "quaternion":
+                inputs["orient"] = utils.quaternion_rotations(operands)
+            elif keyword == "euler":
+                inputs["orient"] = utils.euler_rotations(instructions[i].args[0], operands)
+            else:
+                inputs[keyword] = operands
+        local = obj.local_matrices(inputs["origin"], inputs["scale"], inputs["position"], inputs["orient"])
+        # the version only changes when the matrix does, so what was built from it is kept
+        changed = np.any(local[1:] != local[:-1], axis=(1, 2))
+        instruction.node.local_table = local
+        instruction.node.table_versions = np.concatenate(([1], 1 + np.cumsum(changed))).tolist()
+
+def _skip(image, draw_data, objects):
+    return None
+
+def _cache_fragments(instruction: Instruction) -> "tuple[Callable, Callable]":
+    """Runs for a triangle that draws the same fragments every frame. The first frame
+    rasterizes it, the others draw the saved fragments unless they are hidden.
+    """
+    saved = []
+    def first(image, draw_data, objects):
+        fragments = instruction.fragments(draw_data, objects)
+        saved[:] = (fragments, three_d.fragment_bounds(fragments))
+        three_d.draw_fragments(image, draw_data, *saved)
+    def later(image, draw_data, objects):
+        three_d.draw_fragments(image, draw_data, *saved)
+    return first, later
+
+def _cache_layer(run: Callable) -> "tuple[Callable, Callable]":
+    """Runs for the last triangle of the static layer. The first frame saves the image
+    and depth buffer after it is drawn, the others copy them back.
     """
-    parse keywords:
+    saved = []
+    def first(image, draw_data, objects):
+        run(image, draw_data, objects)
+        three_d.flush(image, draw_data)
+        saved[:] = (image.color.copy(), draw_data.save_depth())
+    def later(image, draw_data, objects):
+        three_d.flush(image, draw_data)
+        image.color[...] = saved[0]
+        draw_data.restore_depth(saved[1])
+    return first, later
+
+def _hoist(program: Program) -> None:
+    """Fills in program.first_frame and program.later_frames
+    """
+    deps = program.dependencies
+    program.first_frame = [instruction.run for instruction in program.instructions]
+    program.later_frames = list(program.first_frame)
+    for i, instruction in enumerate(program.instructions):
+        # invariant variables keep the value they got on the first frame, unless a varying
+        # line also writes them
+        if instruction.writes is not None and deps.invariant[i] and instruction.writes not in deps.varying_slots:
+            program.variables.keep(instruction.writes)
+            program.later_frames[i] = _skip
+    for i in deps.skippable:
+        program.later_frames[i] = _skip
+    for i in deps.static_triangles:
+        if deps.static_layer is not None and i <= deps.static_layer:
+            program.later_frames[i] = _skip
+        else:
+            program.first_frame[i], program.later_frames[i] = _cache_fragments(program.instructions[i])
+    if deps.static_layer is not None:
+        layer = deps.static_layer
+        program.first_frame[layer], program.later_frames[layer] = _cache_layer(program.first_frame[layer])
+
+@profiler.timed("parse")
+def compile_file(lines: "list[str]", variables: Variables) -> Program:
+    """Compiles the lines of a file, not including the first one
+    """
+    return compile_lines([utils.line_to_list(line) for line in lines], variables)
+
+def run_frame(program: Program, image: Framebuffer, draw_data: utils.SceneData, objects: Dict[str, obj.Object]) -> None:
+    """Runs every instruction of the program for the current frame
+    """
+    runs = program.first_frame if program.frames_run == 0 else program.later_frames
+    _set_tabulated(program)
+    i = 0
+    while i < len(runs):
+        target = runs[i](image, draw_data, objects)
+        i = i + 1 if target is None else target
+    three_d.flush(image, draw_data)
+    program.frames_run += 1
+
+def _set_tabulated(program: Program) -> None:
+    if program.table_rows:
+        values = program.variables.values
+        for slot, value in zip(program.table_slots, program.table_rows[values[program.variables.slot("f")]]):
+            values[slot] = value
+
+def frame_inputs(program: Program) -> "list[tuple]":
+    """What the current frame is drawn from, without drawing it: the keyword, the rest of
+    the line and the values read of each line that runs once iflt has picked the branches.
+    Lines defining variables are left out, their values show up in the lines reading them.
+    Two frames with the same inputs draw the same image.
+    """
+    _set_tabulated(program)
+    values = program.variables.values
+    inputs = []
+    i = 0
+    while i < len(program.instructions):
+        instruction = program.instructions[i]
+        if instruction.writes is None and instruction.keyword not in CONTROL_FLOW:
+            inputs.append((instruction.keyword, instruction.args, tuple(values[slot] for slot in instruction.reads)))
+            i += 1
+            continue
+        target = instruction.run(None, None, None)
+        i = i + 1 if target is None else target
+    return inputs
+
+def parse_line(line: "list[str]", image: Framebuffer, draw_data: utils.SceneData, variables: Variables, objects: Dict[str, obj.Object]) -> None:
+    """Runs a single line. Used when lines are run one at a time rather than as a
+    compiled Program, so iflt, else and fi are tracked through draw_data.if_state.
     """
     keyword: str = line[0]
     ### IF ELSE FI ###
@@ -80,126 +536,6 @@ def parse_line(line: "list[str]", image: Image, draw_data: utils.SceneData, vari
     
     if draw_data.if_state is utils.IfState.FII or draw_data.if_state is utils.IfState.TIE:
         return
-        
-    ### DRAW DATA UPDATES ###
-    if keyword == "xyz":
-        new_vertex: vertex.Vertex = vertex.Vertex(
-            x = var_val(line[1], variables),
-            y = var_val(line[2], variables),
-            z = var_val(line[3], variables),
-            r=draw_data.color.r,
-            g=draw_data.color.g,
-            b=draw_data.color.b,
-            a=draw_data.color.a,
-        )
-        draw_data.vertex_list.append(new_vertex)
-
-    elif keyword == "color":
-        r = var_val(line[1], variables)
-        g = var_val(line[2], variables)
-        b = var_val(line[3], variables)
-        draw_data.color = utils.RGBFloat(r, g, b)
-
-    elif keyword == "loadp":
-        # Take the 1x16 list and turn it into a 4x4 ndarray
-        draw_data.projection = np.asarray(line[1:], float).reshape(4,4)
-    
-    ### DRAWING TRIANGLES ###
-    elif keyword == "trif":
-        i1, i2, i3 = line[1:4]
-        p1 = get_vert(draw_data.vertex_list, i1)
-        p2 = get_vert(draw_data.vertex_list, i2)
-        p3 = get_vert(draw_data.vertex_list, i3)
-        three_d.draw_3d_triangle(image, draw_data, objects, p1, p2, p3)
-    
-    elif keyword == "trig":
-        i1, i2, i3 = line[1:4]
-        p1 = get_vert(draw_data.vertex_list, i1)
-        p2 = get_vert(draw_data.vertex_list, i2)
-        p3 = get_vert(draw_data.vertex_list, i3)
-        three_d.draw_3d_triangle(image, draw_data, objects, p1, p2, p3, gouraud=True)
-    
-    elif keyword == "object":
-        if len(line) != 3:
-            raise Exception("Object call expects 2 keywords, name and parent")
-        name, parent = line[1:3]
-
-        objects[name] = obj.Object(parent)
-        # reset the vertex_list
-        draw_data.vertex_list.clear()
-        # set the current_object
-        draw_data.curent_object = name
-
-    elif keyword == "position":
-        x = var_val(line[1], variables)
-        y = var_val(line[2], variables)
-        z = var_val(line[3], variables)
-        position = utils.Vec3(x, y, z)
-        objects[draw_data.curent_object].position = position
-    
-    elif keyword == "origin":
-        x = var_val(line[1], variables)
-        y = var_val(line[2], variables)
-        z = var_val(line[3], variables)
-        origin = utils.Vec3(x, y, z)
-        objects[draw_data.curent_object].origin = origin
-
-    elif keyword == "scale":
-        x = var_val(line[1], variables)
-        y = var_val(line[2], variables)
-        z = var_val(line[3], variables)
-        scale = utils.Vec3(x, y, z)
-        objects[draw_data.curent_object].scale = scale
-
-    elif keyword == "quaternion":
-        w = var_val(line[1], variables)
-        x = var_val(line[2], variables)
-        y = var_val(line[3], variables)
-        z = var_val(line[4], variables)
-        quat = utils.Quaternion(w, x, y, z)
-        objects[draw_data.curent_object].orient = quat
-    
-    elif keyword == "euler":
-        xyz = line[1]
-        r1 = var_val(line[2], variables)
-        r2 = var_val(line[3], variables)
-        r3 = var_val(line[4], variables)
-        quat = utils.Euler(xyz, r1, r2, r3)
-        objects[draw_data.curent_object].orient = quat
-
-    elif keyword == "add":
-        dest, a, b = line[1:4]
-        a_val = var_val(a, variables)
-        b_val = var_val(b, variables)
-        variables.add_var(dest, a_val + b_val)
-    elif keyword == "sub":
-        dest, a, b = line[1:4]
-        a_val = var_val(a, variables)
-        b_val = var_val(b, variables)
-        variables.add_var(dest, a_val - b_val)
-    elif keyword == "mul":
-        dest, a, b = line[1:4]
-        a_val = var_val(a, variables)
-        b_val = var_val(b, variables)
-        variables.add_var(dest, a_val * b_val)
-    elif keyword == "div":
-        dest, a, b = line[1:4]
-        a_val = var_val(a, variables)
-        b_val = var_val(b, variables)
-        variables.add_var(dest, a_val / b_val)
-    elif keyword == "pow":
-        dest, a, b = line[1:4]
-        a_val = var_val(a, variables)
-        b_val = var_val(b, variables)
-        variables.add_var(dest, a_val ** b_val)
-    elif keyword == "sin":
-        dest, a= line[1:3]
-        a_val = var_val(a, variables)
-        variables.add_var(dest, math.sin(math.radians(a_val)))
-    elif keyword == "cos":
-        dest, a= line[1:3]
-        a_val = var_val(a, variables)
-        variables.add_var(dest, math.cos(math.radians(a_val)))
-    elif keyword == "object":
-        name, parent = line[1:3]
 
+    if keyword in COMPILERS:
+        COMPILERS[keyword](line[1:], variables).run(image, draw_data, objects)
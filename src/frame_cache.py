@@ -0,0 +1,91 @@
+import dataclasses
+import functools
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+
+# how much the cache keeps when no size is given, in bytes
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """The hash of the renderer's source, so that changing it drops what it rendered
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+def key(*inputs) -> str:
+    """The hash of what a frame is drawn from, see render.frame_key. Floats are hashed by
+    their repr, which tells every float apart.
+    """
+    return hashlib.sha256(repr((code_version(), inputs)).encode()).hexdigest()
+
+
+@dataclasses.dataclass
+class FrameCache():
+    """PNGs of frames already rendered, in a directory, named by the hash of what they
+    were drawn from. When the directory grows past max_bytes the frames used longest ago
+    are removed, going by their modification time, which is updated when they are used.
+    Entries are written to a temporary file and renamed, so processes rendering frames at
+    the same time can share a directory.
+    \b directory: where the frames are kept, made if it doesn't exist
+    \b max_bytes: how much trim leaves in the directory
+    """
+    directory: str
+    max_bytes: int = DEFAULT_MAX_BYTES
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, frame_key: str) -> str:
+        return os.path.join(self.directory, frame_key + ".png")
+
+    def fetch(self, frame_key: str, filename: str) -> bool:
+        """Copies the frame with this key to filename, if the cache has it
+        """
+        path = self.path(frame_key)
+        try:
+            shutil.copyfile(path, filename)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, frame_key: str, filename: str) -> None:
+        """Keeps a copy of a frame that was just saved to filename
+        """
+        descriptor, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(descriptor)
+        try:
+            shutil.copyfile(filename, temporary)
+            os.replace(temporary, self.path(frame_key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def trim(self) -> None:
+        """Removes the frames used longest ago until the rest fit in max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
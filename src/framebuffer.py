@@ -0,0 +1,124 @@
+import dataclasses
+
+import numpy as np
+from PIL import Image
+
+import src.profiler as profiler
+import src.utils as utils
+
+
+@dataclasses.dataclass
+class Framebuffer():
+    """The color values of one image, stored as a (height, width, 4) RGBA array.
+    It is only converted into a PIL Image when it is saved. A premultiplied framebuffer
+    keeps red, green and blue multiplied by alpha, so blending never divides by alpha,
+    and only divides once per pixel when it is saved.
+    """
+    width: int
+    height: int
+    premultiplied: bool = False
+    color: np.ndarray = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        self.color = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+
+    def clear(self) -> None:
+        self.color.fill(0)
+
+    @profiler.timed("depth")
+    def write_fragments(self, depth_buffer: np.ndarray, near: float, far: float,
+            x: np.ndarray, y: np.ndarray, z: np.ndarray, color: np.ndarray) -> None:
+        """Depth tests a batch of fragments and writes the ones that pass.
+
+        Fragments off the screen, or with z outside [near, far], are dropped. The rest
+        are drawn where they are no further away than the value in the depth buffer,
+        which is updated with their z. The fragments of a single triangle never share
+        a pixel, so the whole batch can be tested against the depth buffer at once.
+
+        Args:
+            depth_buffer (np.ndarray): (height, width) depth values, updated in place
+            near (float): the closest z value that is drawn
+            far (float): the furthest z value that is drawn
+            x, y, z (np.ndarray): the fragment positions
+            color (np.ndarray): RGBA values from 0 to 255, either one for every fragment
+                or a single color for all of them. Colors that are already uint8 are
+                written as they are
+        """
+        px, py, z, color = self._depth_test(depth_buffer, near, far, x, y, z, color)
+        depth_buffer[py, px] = z
+        if self.premultiplied:
+            color = self._premultiply(color)
+        if color.dtype != np.uint8:
+            color = np.clip(color, 0, 255).astype(np.uint8)
+        self.color[py, px] = color
+
+    @profiler.timed("depth")
+    def blend_fragments(self, depth_buffer: np.ndarray, near: float, far: float,
+            x: np.ndarray, y: np.ndarray, z: np.ndarray, color: np.ndarray) -> None:
+        """Like write_fragments, for fragments that are not opaque. The ones that pass the
+        depth test are composited over what is already drawn with utils.over, and the
+        depth buffer is left as it is, so translucent triangles are blended in the order
+        they are drawn. Draw them after the opaque triangles they cover, furthest first.
+        """
+        px, py, z, color = self._depth_test(depth_buffer, near, far, x, y, z, color)
+        color = np.asarray(color, dtype=float)
+        if self.premultiplied:
+            color = self._premultiply(color)
+        blended = utils.over(color, self.color[py, px], self.premultiplied)
+        self.color[py, px] = np.clip(blended, 0, 255).astype(np.uint8)
+
+    def _depth_test(self, depth_buffer: np.ndarray, near: float, far: float,
+            x: np.ndarray, y: np.ndarray, z: np.ndarray, color: np.ndarray) -> "tuple[np.ndarray, ...]":
+        """The rounded positions, z and colors of the fragments that are on the screen,
+        between near and far, and pass the depth test
+        """
+        visible = (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height) \
+            & (near <= z) & (z <= far)
+        x, y, z = x[visible], y[visible], z[visible]
+        # compared and stored at the precision of the depth buffer, so a fragment redrawn at
+        # the depth already there passes, like it does with float64
+        z = z.astype(depth_buffer.dtype, copy=False)
+        if color.ndim == 2:
+            color = color[visible]
+        # the depth buffer is read at the truncated position and written at the rounded one
+        passed = ~(depth_buffer[y.astype(int), x.astype(int)] < z)
+        if profiler.active is not None:
+            # np.count_nonzero gives a numpy integer on numpy 2, which json can't write
+            profiler.active.count_fragments(len(visible), len(visible) - len(z), len(z) - int(np.count_nonzero(passed)))
+        px = np.round(x[passed]).astype(int)
+        py = np.round(y[passed]).astype(int)
+        if color.ndim == 2:
+            color = color[passed]
+        return px, py, z[passed], color
+
+    @staticmethod
+    def _premultiply(color: np.ndarray) -> np.ndarray:
+        color = np.asarray(color, dtype=float)
+        return np.concatenate((np.round(color[..., :3] * color[..., 3:] / 255), color[..., 3:]), axis=-1)
+
+    def write_pixels(self, x: np.ndarray, y: np.ndarray, color) -> None:
+        """Writes a single RGBA color to integer pixel positions, dropping the ones off
+        the screen. Nothing is depth tested.
+        """
+        visible = (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height)
+        if self.premultiplied:
+            color = self._premultiply(color).astype(np.uint8)
+        self.color[y[visible], x[visible]] = color
+
+    def pixels(self) -> np.ndarray:
+        """The (height, width, 4) RGBA values of the image, which are not premultiplied.
+        Unless the framebuffer is premultiplied this is the color array itself.
+        """
+        color = self.color
+        if self.premultiplied:
+            alpha = color[..., 3:].astype(float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rgb = np.where(alpha > 0, np.round(color[..., :3] * 255.0 / alpha), 0)
+            color = np.concatenate((np.clip(rgb, 0, 255).astype(np.uint8), color[..., 3:]), axis=-1)
+        return color
+
+    def as_image(self) -> Image.Image:
+        return Image.fromarray(self.pixels(), "RGBA")
+
+    def save(self, filename: str) -> None:
+        self.as_image().save(filename)
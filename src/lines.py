@@ -73,6 +73,12 @@ def dda(p1: np.ndarray, p2: np.ndarray, step_in_y: bool = False) -> "list[np.nda
         q = q + dp
     return output_list
 
+def below_screen(y: float, height: float) -> bool:
+    """Whether a scanline at y is under a screen `height` tall. Scanlines are on integer
+    rows, so the half pixel of slack keeps the bottom row of the screen despite rounding.
+    """
+    return math.isfinite(height) and y < -0.5
+
 def triangle_fill(p1: vertex.Vertex, p2: vertex.Vertex, p3: vertex.Vertex, width: float = math.inf, height: float = math.inf) -> "list[vertex.Vertex]":
     # The first step is to order to 3 vertexes by their y coordinate.
     a = [p1, p2, p3]
@@ -86,14 +92,17 @@ def triangle_fill(p1: vertex.Vertex, p2: vertex.Vertex, p3: vertex.Vertex, width
     # Find d~p and initial ~q for (~pb, ~pt); call them d~qc and ~qc
     dqc, qc = change_and_starting_position(pb, pt, True, width, height)
     output = []
+    # scanlines under the screen are walked, but not filled
     while qa[1] < pm[1] and qa[1] < height:
-        output += dda(qa, qc)
+        if not below_screen(max(qa[1], qc[1]), height):
+            output += dda(qa, qc)
         qa = qa + dqa
         qc = qc + dqc
     # Find d~p and initial ~q for (~pm, ~pt); call them d~qe and ~qe
     dqe, qe = change_and_starting_position(pm, pt, True, width, height)
     while qe[1] < pt[1] and qe[1] < height:
-        output += dda(qe, qc)
+        if not below_screen(max(qe[1], qc[1]), height):
+            output += dda(qe, qc)
         qe = qe + dqe
         qc = qc + dqc
     output = list(map(lambda x: vertex.ndarray_to_vertex(x, is_rounded=False), output))
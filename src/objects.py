@@ -1,6 +1,6 @@
 
 import dataclasses
-from typing import Dict, Union
+from typing import Dict, Optional, Union
 from PIL.Image import init
 import numpy as np
 import src.utils as utils
@@ -8,6 +8,10 @@ from src.vertex import Vertex
 
 @dataclasses.dataclass
 class Object():
+    """A node of the scene graph. The `object` line of a file keeps using the same Object
+    on every frame, which lets it keep the matrices it built on earlier frames and only
+    rebuild them when its inputs, or its parent's matrix, have changed.
+    """
     parent: str = "world"
     origin: utils.Vec3 = utils.Vec3()
     scale: utils.Vec3 = utils.Vec3(1,1,1)
@@ -15,36 +19,114 @@ class Object():
     orient: Union[utils.Quaternion, utils.Euler] = utils.Quaternion()
     geometry: list = dataclasses.field(init=False)
     position_matrix: np.ndarray = None
+    # the matrix built from this object's own inputs, the inputs it was built from and
+    # how many times it has been rebuilt
+    local_matrix: np.ndarray = dataclasses.field(default=None, repr=False, compare=False)
+    _local_inputs: tuple = dataclasses.field(default=None, repr=False, compare=False)
+    local_version: int = dataclasses.field(default=0, repr=False, compare=False)
+    # the same for the matrix combined with the parent's, what it was built from is the
+    # local version, the parent object and the parent's world version
+    _world_matrix: np.ndarray = dataclasses.field(default=None, repr=False, compare=False)
+    _world_inputs: tuple = dataclasses.field(default=(None, None, None), repr=False, compare=False)
+    world_version: int = dataclasses.field(default=0, repr=False, compare=False)
+    # the inverse of position_matrix, and the world version it is the inverse of
+    _inverse_matrix: np.ndarray = dataclasses.field(default=None, repr=False, compare=False)
+    _inverse_version: int = dataclasses.field(default=None, repr=False, compare=False)
+    # the local matrix on every frame when file_parse worked them out ahead, see
+    # local_matrices, the local version on every frame, and the frame being drawn
+    local_table: Optional[np.ndarray] = dataclasses.field(default=None, repr=False, compare=False)
+    table_versions: list = dataclasses.field(default=None, repr=False, compare=False)
+    frame: int = dataclasses.field(default=0, repr=False, compare=False)
+
+    def reset(self, parent: str = "world"):
+        """Puts the inputs back to their defaults for a new frame, keeping the matrices
+        """
+        self.parent = parent
+        self.origin = Object.origin
+        self.scale = Object.scale
+        self.position = Object.position
+        self.orient = Object.orient
+        self.position_matrix = None
+
+    def _inputs(self) -> tuple:
+        return (
+            dataclasses.astuple(self.origin),
+            dataclasses.astuple(self.scale),
+            dataclasses.astuple(self.position),
+            type(self.orient),
+            dataclasses.astuple(self.orient),
+        )
+
+    def make_local_matrix(self) -> np.ndarray:
+        """The matrix moving the origin to (0,0,0), scaling, rotating, moving to the
+        position and moving back by the origin, multiplied out:
+        [R S | o + p - R S o]
+        """
+        return local_matrices(
+            np.asarray(self.origin, dtype=float)[None],
+            np.asarray(self.scale, dtype=float)[None],
+            np.asarray(self.position, dtype=float)[None],
+            self.orient.make_rotation()[None],
+        )[0]
+
+    def make_local_inverse(self) -> np.ndarray:
+        """The inverse of make_local_matrix, without a generic matrix inversion: the
+        inverse of a rotation is its transpose and the inverse of a scale is its reciprocal
+        [S^-1 R^T | -S^-1 R^T t]
+        """
+        scale = np.asarray(self.scale, dtype=float)
+        rot = self.orient.make_rotation()[:3, :3]
+        local = self.make_local_matrix() if self.local_matrix is None else self.local_matrix
+        inverse_rot_scale = rot.T / scale[:, None]
+        inverse = np.identity(4)
+        inverse[:3, :3] = inverse_rot_scale
+        inverse[:3, 3] = -np.matmul(inverse_rot_scale, local[:3, 3])
+        return inverse
+
+    def make_inverse_matrix(self, objs: Dict[str, "Object"]) -> np.ndarray:
+        """The inverse of position_matrix, (P L)^-1 = L^-1 P^-1, rebuilt only when
+        position_matrix changed
+        """
+        if self.position_matrix is None:
+            self.make_position_matrix(objs)
+        if self._inverse_version != self.world_version:
+            inverse = self.make_local_inverse()
+            if self.parent != "world":
+                inverse = np.matmul(inverse, objs[self.parent].make_inverse_matrix(objs))
+            self._inverse_matrix = inverse
+            self._inverse_version = self.world_version
+        return self._inverse_matrix
 
     def make_position_matrix(self, objs: Dict[str, "Object"]):
-        # translation matrix moving (0,0,0) to the objects origin
-        to_origin = np.identity(4)
-        to_origin[:3,3] = np.asarray(self.origin)
-        # translation matrix moving (0,0,0) to the object’s position
-        to_position = np.identity(4)
-        to_position[:3,3] = np.asarray(self.position)
-        # a scaling matrix
-        scaling = np.identity(4)
-        scaling[0,0] = self.scale.x
-        scaling[1,1] = self.scale.y
-        scaling[2,2] = self.scale.z
-        # R is a rotation matrix defined by the object’s orientation
-        rot = self.orient.make_rotation()
-        # inverse
-        # translation matrix moving (0,0,0) to the objects origin
-        to_origin_inverse = np.identity(4)
-        to_origin_inverse[:3,3] = np.asarray([-self.origin.x, -self.origin.y, -self.origin.z])
-        self.position_matrix = np.matmul(scaling, to_origin_inverse)
-        self.position_matrix = np.matmul(rot,self.position_matrix)
-        self.position_matrix = np.matmul(to_position, self.position_matrix)
-        self.position_matrix = np.matmul(to_origin, self.position_matrix)
+        if self.local_table is not None:
+            version = self.table_versions[self.frame]
+            if version != self.local_version:
+                self.local_matrix = self.local_table[self.frame]
+                self.local_version = version
+        else:
+            inputs = self._inputs()
+            if inputs != self._local_inputs:
+                self.local_matrix = self.make_local_matrix()
+                self._local_inputs = inputs
+                self.local_version += 1
         # get the parent objects position_matrix
+        parent_obj = None
         if self.parent != "world":
             parent_obj = objs[self.parent]
             # Recursively make parent matrices
             if parent_obj.position_matrix is None:
                 parent_obj.make_position_matrix(objs)
-            self.position_matrix = np.matmul(parent_obj.position_matrix, self.position_matrix)
+        # only rebuilt when the local matrix, or the parent's matrix, changed
+        local_version, last_parent, parent_version = self._world_inputs
+        if local_version != self.local_version or last_parent is not parent_obj \
+                or (parent_obj is not None and parent_version != parent_obj.world_version):
+            if parent_obj is None:
+                self._world_matrix = self.local_matrix
+            else:
+                self._world_matrix = np.matmul(parent_obj.position_matrix, self.local_matrix)
+            self._world_inputs = (self.local_version, parent_obj, None if parent_obj is None else parent_obj.world_version)
+            self.world_version += 1
+        self.position_matrix = self._world_matrix
         
     def transform_vertex(self, v: Vertex, objs: Dict[str, "Object"]) -> Vertex:
         nv = v
@@ -58,4 +140,23 @@ class Object():
         nv.z = new_pos[2]
         nv.w = new_pos[3]
         return nv
-        
+
+
+def local_matrices(origin: np.ndarray, scale: np.ndarray, position: np.ndarray, rotation: np.ndarray) -> np.ndarray:
+    """Object.make_local_matrix for every frame at once
+
+    Args:
+        origin, scale, position (np.ndarray): (F, 3) arrays of the inputs on each frame
+        rotation (np.ndarray): (F, 4, 4) rotations, see utils.quaternion_rotations and
+            utils.euler_rotations
+
+    Returns:
+        np.ndarray: the (F, 4, 4) local matrices
+    """
+    # R is a rotation matrix defined by the object’s orientation
+    rot_scale = rotation[:, :3, :3] * scale[:, None, :]
+    local = np.zeros((len(rotation), 4, 4))
+    local[:, :3, :3] = rot_scale
+    local[:, :3, 3] = origin + position - np.matmul(rot_scale, origin[:, :, None])[:, :, 0]
+    local[:, 3, 3] = 1
+    return local
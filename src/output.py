@@ -0,0 +1,272 @@
+import fractions
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import BinaryIO, Optional
+
+import numpy as np
+
+from src.framebuffer import Framebuffer
+import src.profiler as profiler
+
+
+class PngWriter():
+    """Saves frames on a background thread while the next ones are rendered.
+
+    Only `buffers` framebuffers are ever allocated. get_framebuffer hands out a cleared
+    one, blocking while all of them are still waiting to be saved, and write queues it
+    to be saved and handed out again. Use as a context manager so close is always called.
+    Subclasses change how a frame is saved by overriding _save.
+    """
+    def __init__(self, width: int, height: int, buffers: int = 2) -> None:
+        self._free: "queue.Queue[Framebuffer]" = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(Framebuffer(width, height))
+        self._pending: "queue.Queue[Optional[tuple[Framebuffer, str, Optional[profiler.FrameProfile]]]]" = queue.Queue(maxsize=buffers)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._save_frames, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "PngWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _save_frames(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            image, filename, profile = item
+            try:
+                if self._error is None:
+                    start = time.perf_counter()
+                    self._save(image, filename)
+                    if profile is not None:
+                        profile.add("save", time.perf_counter() - start)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._free.put(image)
+
+    def _save(self, image: Framebuffer, filename: str) -> None:
+        print(f"saving file {filename}")
+        image.save(filename)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def get_framebuffer(self) -> Framebuffer:
+        self._raise_error()
+        image = self._free.get()
+        image.clear()
+        return image
+
+    def write(self, image: Framebuffer, filename: str) -> None:
+        self._raise_error()
+        # the save is timed on the writer thread, but belongs to the frame just rendered
+        profile = profiler.active.current if profiler.active is not None else None
+        self._pending.put((image, filename, profile))
+
+    def close(self) -> None:
+        """Waits for every queued frame to be saved
+        """
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        self._raise_error()
+
+
+class StreamWriter(PngWriter):
+    """A PngWriter that adds the frames to a stream, in the order they are written,
+    instead of saving each one to a file. Closing it closes the stream.
+    """
+    def __init__(self, stream: "FrameStream", buffers: int = 2) -> None:
+        self.stream = stream
+        super().__init__(stream.width, stream.height, buffers)
+
+    def _save(self, image: Framebuffer, filename: Optional[str]) -> None:
+        # the stream may be stdout, so progress goes to stderr
+        print(f"writing frame {self.stream.frames_written} to {self.stream.name}", file=sys.stderr)
+        self.stream.write_frame(image.pixels())
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(complete=exc_type is None)
+
+    def close(self, complete: bool = True) -> None:
+        """Waits for every queued frame to be written, then closes the stream. complete is
+        False when rendering stopped early, so the stream doesn't complain about the
+        frames that are missing and hide why it stopped
+        """
+        try:
+            super().close()
+        except BaseException:
+            self.stream.close(complete=False)
+            raise
+        self.stream.close(complete)
+
+
+class FrameStream():
+    """Frames written one after another to a single file, or to stdout when the path
+    is "-". Subclasses write the header and each frame.
+    """
+    def __init__(self, path: str, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        if path == "-":
+            self.name = "stdout"
+            self.file: BinaryIO = sys.stdout.buffer
+        else:
+            self.name = path
+            self.file = open(path, "wb")
+
+    def write_frame(self, pixels: np.ndarray) -> None:
+        """Adds a (height, width, 4) array of RGBA values to the stream
+        """
+        self._write_frame(pixels)
+        self.frames_written += 1
+
+    def _write_frame(self, pixels: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def close(self, complete: bool = True) -> None:
+        """complete is False when the frames stopped early
+        """
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+
+
+class RawStream(FrameStream):
+    """The RGBA bytes of every frame and nothing else, what ffmpeg reads with
+    -f rawvideo -pix_fmt rgba -s WIDTHxHEIGHT
+    """
+    def _write_frame(self, pixels: np.ndarray) -> None:
+        self.file.write(np.ascontiguousarray(pixels, dtype=np.uint8).tobytes())
+
+
+class Y4mStream(FrameStream):
+    """A YUV4MPEG2 stream with a full resolution alpha plane (C444alpha). Colors are
+    converted with the BT.601 studio range matrix, the alpha plane is kept as it is.
+    """
+    # rows turn R, G, B from 0 to 255 into Y, Cb, Cr
+    TO_YCBCR = np.asarray([
+        [65.481, 128.553, 24.966],
+        [-37.797, -74.203, 112.0],
+        [112.0, -93.786, -18.214],
+    ]) / 255
+    OFFSET = np.asarray([16.0, 128.0, 128.0])
+
+    def __init__(self, path: str, width: int, height: int, fps: float) -> None:
+        super().__init__(path, width, height)
+        rate = fractions.Fraction(fps).limit_denominator(1001)
+        self.file.write(f"YUV4MPEG2 W{width} H{height} F{rate.numerator}:{rate.denominator} Ip A1:1 C444alpha\n".encode())
+
+    def _write_frame(self, pixels: np.ndarray) -> None:
+        planes = np.empty((4, self.height, self.width), dtype=np.uint8)
+        ycbcr = np.tensordot(self.TO_YCBCR, pixels[..., :3].astype(float), axes=([1], [2]))
+        planes[:3] = np.clip(np.round(ycbcr + self.OFFSET[:, None, None]), 0, 255)
+        planes[3] = pixels[..., 3]
+        self.file.write(b"FRAME\n")
+        self.file.write(planes.tobytes())
+
+
+class ApngStream(FrameStream):
+    """An animated PNG that loops `plays` times, forever when 0. After the first frame,
+    only the rectangle holding the pixels that changed since the frame before it is
+    stored, which replaces those pixels when the animation is shown.
+    """
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+    def __init__(self, path: str, width: int, height: int, frames: int, fps: float,
+            plays: int = 0, level: int = 6) -> None:
+        super().__init__(path, width, height)
+        self.frames = frames
+        self.level = level
+        # each frame lasts delay_num / delay_den seconds
+        delay = 1 / fractions.Fraction(fps).limit_denominator(1000)
+        self.delay = (delay.numerator, delay.denominator)
+        self.sequence = 0
+        self.previous: Optional[np.ndarray] = None
+        self.file.write(self.SIGNATURE)
+        # 8 bits per channel RGBA, not interlaced
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        self._chunk(b"acTL", struct.pack(">II", frames, plays))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def _next_sequence(self) -> bytes:
+        sequence = struct.pack(">I", self.sequence)
+        self.sequence += 1
+        return sequence
+
+    def _compress(self, pixels: np.ndarray) -> bytes:
+        """The image data of a rectangle of pixels, with every row using the Sub filter,
+        which stores each byte as its difference from the same channel of the pixel
+        to its left
+        """
+        height, width = pixels.shape[:2]
+        rows = np.empty((height, 1 + width * 4), dtype=np.uint8)
+        rows[:, 0] = 1
+        flat = pixels.reshape(height, width * 4)
+        rows[:, 1:5] = flat[:, :4]
+        # uint8 arithmetic wraps around, which is the modulo 256 the filter wants
+        np.subtract(flat[:, 4:], flat[:, :-4], out=rows[:, 5:])
+        return zlib.compress(rows.tobytes(), self.level)
+
+    def _write_frame(self, pixels: np.ndarray) -> None:
+        if self.frames_written >= self.frames:
+            raise ValueError(f"{self.name} was made for {self.frames} frames")
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        if self.previous is None:
+            top, left, bottom, right = 0, 0, self.height, self.width
+        else:
+            changed = (pixels != self.previous).any(axis=-1)
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+            if len(rows):
+                top, bottom = rows[0], rows[-1] + 1
+                left, right = columns[0], columns[-1] + 1
+            else:
+                # frames can't be empty, an unchanged pixel keeps the timing
+                top, left, bottom, right = 0, 0, 1, 1
+        # dispose_op none leaves the frame as it is, blend_op source replaces the rectangle
+        self._chunk(b"fcTL", self._next_sequence() + struct.pack(">IIIIHHBB",
+            right - left, bottom - top, left, top, *self.delay, 0, 0))
+        data = self._compress(pixels[top:bottom, left:right])
+        if self.previous is None:
+            self._chunk(b"IDAT", data)
+        else:
+            self._chunk(b"fdAT", self._next_sequence() + data)
+        self.previous = pixels.copy()
+
+    def close(self, complete: bool = True) -> None:
+        try:
+            if complete and self.frames_written != self.frames:
+                raise ValueError(f"{self.name} was made for {self.frames} frames, but {self.frames_written} were written")
+            self._chunk(b"IEND", b"")
+        finally:
+            super().close(complete)
+
+
+def open_stream(kind: str, path: str, width: int, height: int, frames: int, fps: float) -> FrameStream:
+    """Opens an apng, y4m or raw stream, see the classes of each
+    """
+    if kind == "apng":
+        return ApngStream(path, width, height, frames, fps)
+    if kind == "y4m":
+        return Y4mStream(path, width, height, fps)
+    if kind == "raw":
+        return RawStream(path, width, height)
+    raise ValueError(f"unknown output format {kind}")
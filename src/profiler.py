@@ -0,0 +1,177 @@
+"""Timers and counters for the stages of rendering, turned on with main.py --profile.
+
+The functions doing each stage are decorated with `timed`. While no Profiler is active
+the decorator only checks one global before calling through, so the hooks are always in
+place. Stages don't nest, except that every other frame stage runs inside "frame", so
+the time in a frame that isn't in any other stage is reported as "other". When a
+tiles.Tiler draws on several threads, stages overlap and can add up to more than the
+frame.
+"""
+import csv
+import dataclasses
+import functools
+import json
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+# the stages timed inside a frame
+FRAME_STAGES = ("transform", "raster", "depth")
+COUNTERS = ("fragments", "off_screen", "depth_rejected", "culled", "occluded")
+
+F = TypeVar("F", bound=Callable)
+
+
+@dataclasses.dataclass
+class FrameProfile():
+    """What happened while rendering one frame
+    \b frame: the frame number, None for work done before the first frame
+    \b seconds: time spent in each stage, "frame" is the whole frame
+    \b calls: how many times each stage ran
+    \b fragments: fragments sent to the depth test
+    \b off_screen: fragments dropped for being outside the image or the near and far planes
+    \b depth_rejected: fragments dropped for being behind what was already drawn
+    \b culled: triangles skipped before they were rasterized, see three_d.is_culled
+    \b occluded: triangles skipped for being behind what was already drawn, see
+    three_d.is_occluded
+    """
+    frame: Optional[int] = None
+    seconds: Dict[str, float] = dataclasses.field(default_factory=dict)
+    calls: Dict[str, int] = dataclasses.field(default_factory=dict)
+    fragments: int = 0
+    off_screen: int = 0
+    depth_rejected: int = 0
+    culled: int = 0
+    occluded: int = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def other(self) -> float:
+        return self.seconds.get("frame", 0.0) - sum(self.seconds.get(s, 0.0) for s in FRAME_STAGES)
+
+    def merge(self, other: "FrameProfile") -> None:
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        for stage, calls in other.calls.items():
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+        for counter in COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+
+
+class Profiler():
+    """Collects a FrameProfile for every frame. Whatever is timed before the first
+    frame starts, such as parsing, goes in `setup`.
+    """
+    def __init__(self) -> None:
+        self.setup = FrameProfile()
+        self.frames: Dict[int, FrameProfile] = {}
+        self.current = self.setup
+        # stages can be timed on more than one thread at once
+        self._lock = threading.Lock()
+
+    def start_frame(self, frame: int) -> FrameProfile:
+        self.current = self.frames.setdefault(frame, FrameProfile(frame))
+        return self.current
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.current.add(stage, seconds)
+
+    def count_fragments(self, fragments: int, off_screen: int, depth_rejected: int) -> None:
+        with self._lock:
+            self.current.fragments += int(fragments)
+            self.current.off_screen += int(off_screen)
+            self.current.depth_rejected += int(depth_rejected)
+
+    def count_triangle(self, counter: str) -> None:
+        """Counts a triangle that was skipped, counter is "culled" or "occluded"
+        """
+        with self._lock:
+            setattr(self.current, counter, getattr(self.current, counter) + 1)
+
+    def total(self) -> FrameProfile:
+        total = FrameProfile()
+        for profile in self.frames.values():
+            total.merge(profile)
+        return total
+
+    def summary(self) -> str:
+        """A table of the time spent in each stage over every frame
+        """
+        total = self.total()
+        frames = max(len(self.frames), 1)
+        frame_seconds = total.seconds.get("frame", 0.0)
+        rows = [("stage", "seconds", "per frame", "calls", "% of frames")]
+        def row(stage: str, seconds: float, calls: Optional[int], share: bool = True):
+            rows.append((
+                stage,
+                f"{seconds:.4f}",
+                f"{seconds / frames:.4f}",
+                "" if calls is None else str(calls),
+                f"{100 * seconds / frame_seconds:.1f}" if share and frame_seconds else "",
+            ))
+        for stage, seconds in self.setup.seconds.items():
+            row(stage, seconds, self.setup.calls[stage], share=False)
+        row("frame", frame_seconds, total.calls.get("frame", 0))
+        for stage in FRAME_STAGES:
+            row("  " + stage, total.seconds.get(stage, 0.0), total.calls.get(stage, 0))
+        row("  other", total.other(), None)
+        if "save" in total.seconds:
+            row("save", total.seconds["save"], total.calls["save"], share=False)
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(cell.ljust(w) for cell, w in zip(r, widths)).rstrip() for r in rows]
+        written = total.fragments - total.off_screen - total.depth_rejected
+        lines.append(f"fragments {total.fragments}, off screen {total.off_screen}, "
+            f"depth rejected {total.depth_rejected}, written {written}, "
+            f"triangles culled {total.culled}, occluded {total.occluded}")
+        return "\n".join(lines)
+
+    def _rows(self) -> "list[dict]":
+        stages = ("frame",) + FRAME_STAGES + ("save",)
+        rows = []
+        for frame in sorted(self.frames):
+            profile = self.frames[frame]
+            row = {"frame": frame}
+            for stage in stages:
+                row[f"{stage}_seconds"] = profile.seconds.get(stage, 0.0)
+                row[f"{stage}_calls"] = profile.calls.get(stage, 0)
+            row["other_seconds"] = profile.other()
+            for counter in COUNTERS:
+                row[counter] = getattr(profile, counter)
+            rows.append(row)
+        return rows
+
+    def write_trace(self, filename: str) -> None:
+        """Writes a row for every frame, as JSON if the filename ends in .json and as
+        CSV otherwise
+        """
+        rows = self._rows()
+        with open(filename, "w", newline="") as file:
+            if filename.endswith(".json"):
+                json.dump({"setup": dataclasses.asdict(self.setup), "frames": rows}, file, indent=2)
+            elif rows:
+                writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+# the profiler the timed functions report to, None when profiling is off
+active: Optional[Profiler] = None
+
+def timed(stage: str) -> Callable[[F], F]:
+    """Adds the time spent in the decorated function to `stage` of the current frame
+    """
+    def decorate(func: F) -> F:
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            if active is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                active.add(stage, time.perf_counter() - start)
+        return timed_func
+    return decorate
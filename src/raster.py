@@ -0,0 +1,171 @@
+"""Array based triangle rasterization.
+
+The fill rule is the one used by lines.triangle_fill: scanlines are walked from the
+lowest vertex up, and each span is stepped in x starting from the first integer column.
+Every edge and span is advanced with np.add.accumulate, which adds sequentially, so
+the fragments produced here are bit-identical to the ones produced by the python loops.
+The one exception is a span that starts more than a screen width left of the screen.
+Walking it sample by sample would take time in proportion to how far off the screen it
+starts, so it jumps to its first sample on the screen with a single multiply. That
+can round the attributes of its fragments differently in the last bits.
+Each attribute is stepped on its own, so the ones a caller doesn't need can be left out
+without changing the rest.
+"""
+import math
+
+import numpy as np
+
+import src.lines as lines
+import src.profiler as profiler
+from src.vertex import ATTRIBUTES, VERTEX_DTYPE
+
+# every fragment carries the same eight attributes as a vertex.Vertex
+FRAGMENT_DTYPE = VERTEX_DTYPE
+
+# upper bound on the number of floats held in one block of span samples
+_BLOCK_SIZE = 1 << 21
+
+
+def as_point(p) -> np.ndarray:
+    """Converts a vertex.Vertex (or anything array like) to a float ndarray of its attributes
+    """
+    if isinstance(p, np.ndarray):
+        return p.astype(np.float64)
+    return np.asarray(p.as_ndarray(), dtype=np.float64)
+
+def _walk(start: np.ndarray, step: np.ndarray, count: int) -> np.ndarray:
+    """The first `count` values of `q = start; q = q + step; ...` as rows
+    """
+    steps = np.empty((count, start.shape[0]))
+    if count == 0:
+        return steps
+    steps[0] = start
+    steps[1:] = step
+    return np.add.accumulate(steps, axis=0)
+
+def _walk_edge(start: np.ndarray, step: np.ndarray, stop_y: float, height: float) -> np.ndarray:
+    """Rows visited by `while q[1] < stop_y and q[1] < height` in lines.triangle_fill
+    """
+    limit = min(stop_y, height)
+    if not start[1] < limit or not step[1] > 0 or not math.isfinite(limit - start[1]):
+        return np.empty((0, start.shape[0]))
+    count = int(math.ceil((limit - start[1]) / step[1])) + 1
+    rows = _walk(start, step, count)
+    inside = np.logical_and.accumulate((rows[:, 1] < stop_y) & (rows[:, 1] < height))
+    return rows[:np.count_nonzero(inside)]
+
+def _fill_spans(left: np.ndarray, right: np.ndarray, width: float) -> "tuple[np.ndarray, np.ndarray]":
+    """Samples the span between `left[i]` and `right[i]` the way lines.dda does when
+    it steps in x. Samples outside of [0, width) are not returned. A span that starts
+    more than `width` columns left of the screen jumps straight to its first sample at
+    x >= 0, see the module docstring, the others are walked from their left end.
+
+    Returns:
+        the samples as a (n, 8) array, and the scanline each sample belongs to
+    """
+    delta = right - left
+    flip = delta[:, 0] < 0
+    start = np.where(flip[:, None], right, left)
+    stop_x = np.where(flip, left[:, 0], right[:, 0])
+    delta = np.where(flip[:, None], delta * -1, delta)
+    dx = delta[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dp = np.where((dx != 0)[:, None], delta / dx[:, None], 0.0)
+        q = start + (np.ceil(start[:, 0]) - start[:, 0])[:, None] * dp
+    if math.isfinite(width):
+        # x steps by exactly 1, so the jump lands on the first column at or right of 0
+        skip = np.where(q[:, 0] < -width, np.ceil(-q[:, 0]), 0)
+        jumped = skip > 0
+        if jumped.any():
+            q[jumped] += skip[jumped, None] * dp[jumped]
+    # a span is walked until it passes its right end, or the right side of the screen
+    limit = np.minimum(stop_x, width)
+    active = q[:, 0] < limit
+    rows, attrs = q.shape
+    if not active.any():
+        return np.empty((0, attrs)), np.empty(0, dtype=np.intp)
+    # x advances by one per sample, so the longest span bounds the block width
+    longest = np.max(limit[active] - q[active, 0])
+    cols = max(1, min(_BLOCK_SIZE // (rows * attrs), int(math.ceil(longest)) + 1))
+    samples = []
+    row_index = []
+    carry = None
+    while active.any():
+        # the first column of the block is the starting sample, or the last sample of
+        # the previous block which is then dropped
+        block = np.empty((rows, cols + 1, attrs))
+        block[:, 0] = q if carry is None else carry
+        block[:, 1:] = dp[:, None, :]
+        block = np.add.accumulate(block, axis=1)
+        chunk = block[:, :-1] if carry is None else block[:, 1:]
+        carry = block[:, -1] if carry is not None else block[:, -2]
+        inside = np.logical_and.accumulate(chunk[:, :, 0] < limit[:, None], axis=1) & active[:, None]
+        active = inside[:, -1]
+        keep = inside & (chunk[:, :, 0] >= 0) if math.isfinite(width) else inside
+        samples.append(chunk[keep])
+        row_index.append(np.nonzero(keep)[0])
+    row_index = np.concatenate(row_index)
+    order = np.argsort(row_index, kind="stable")
+    return np.concatenate(samples)[order], row_index[order]
+
+def fragment_dtype(attributes: "tuple[str, ...]") -> np.dtype:
+    """The structured dtype of fragments carrying only `attributes`
+    """
+    if attributes == ATTRIBUTES:
+        return FRAGMENT_DTYPE
+    return np.dtype([(name, np.float64) for name in attributes])
+
+@profiler.timed("raster")
+def triangle_fragments(p1, p2, p3, width: float = math.inf, height: float = math.inf,
+        attributes: "tuple[str, ...]" = ATTRIBUTES) -> np.ndarray:
+    """Rasterizes a triangle into fragments using the fill rule of lines.triangle_fill.
+
+    Args:
+        p1, p2, p3: the corners, as vertex.Vertex or arrays in the order of ATTRIBUTES
+        width (float): fragments outside of [0, width) in x are not produced
+        height (float): the height of the screen, scanlines at or above it are not walked
+            and the ones under 0 are not filled
+        attributes (tuple[str, ...]): the attributes to interpolate, starting with x and y
+
+    Returns:
+        np.ndarray: a structured array of fragment_dtype(attributes), in scanline order
+    """
+    if attributes[:2] != ("x", "y"):
+        raise Exception("fragments need x and y as their first attributes", attributes)
+    points = [as_point(p) for p in (p1, p2, p3)]
+    if attributes != ATTRIBUTES:
+        columns = [ATTRIBUTES.index(name) for name in attributes]
+        points = [p[columns] for p in points]
+    dtype = fragment_dtype(attributes)
+    empty = np.empty(0, dtype=dtype)
+    if not all(np.isfinite(p[:2]).all() for p in points):
+        return empty
+    # bottom, middle, top
+    pb, pm, pt = sorted(points, key=lambda p: p[1])
+    dqa, qa = lines.change_and_starting_position(pb, pm, True)
+    dqc, qc = lines.change_and_starting_position(pb, pt, True)
+    dqe, qe = lines.change_and_starting_position(pm, pt, True)
+    # the left edges of the lower and upper half, the right edge runs the whole height
+    left = np.concatenate((_walk_edge(qa, dqa, pm[1], height), _walk_edge(qe, dqe, pt[1], height)))
+    right = _walk(qc, dqc, left.shape[0])
+    if math.isfinite(height):
+        # the scanlines lines.below_screen finds under the screen
+        filled = ~((left[:, 1] < -0.5) & (right[:, 1] < -0.5))
+        if not filled.all():
+            left, right = left[filled], right[filled]
+    if left.shape[0] == 0:
+        return empty
+    # lines.dda steps in y when a span is taller than it is wide; that only happens
+    # through rounding error, those spans are sampled by lines.dda itself
+    delta = right - left
+    steep = np.abs(delta[:, 0]) < np.abs(delta[:, 1])
+    samples, row_index = _fill_spans(left, np.where(steep[:, None], left, right), width)
+    for row in np.nonzero(steep)[0]:
+        extra = np.asarray(lines.dda(left[row], right[row])).reshape(-1, left.shape[1])
+        if math.isfinite(width):
+            extra = extra[(extra[:, 0] >= 0) & (extra[:, 0] < width)]
+        at = np.searchsorted(row_index, row)
+        samples = np.insert(samples, at, extra, axis=0)
+        row_index = np.insert(row_index, at, np.full(extra.shape[0], row))
+    # each row of samples is one fragment's attributes in order, so it can be viewed as one
+    return np.ascontiguousarray(samples).view(dtype).reshape(-1)
@@ -0,0 +1,215 @@
+"""Renders scene files and compares every frame with a reference image.
+
+Each file is rendered on its own worker process, and its frames are compared with the
+references as arrays as soon as they are drawn, without saving them. A pixel counts
+towards the AE, the number of pixels that differ, when its distance from the reference
+is more than the fuzz, like ImageMagick's compare -fuzz. A frame fails when its AE is
+more than max_ae, and only then is a diff image written:
+
+    python -m src.regression --reference test/correct_files
+    python -m src.regression --reference test/correct_files --save-reference
+
+References are looked for as one png per frame, named like the frames the file saves,
+or as a single png named after the file, which can be animated, like the ones
+make_anim.sh makes.
+"""
+import argparse
+import concurrent.futures
+import dataclasses
+import functools
+import glob
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from src.framebuffer import Framebuffer
+import src.render as render
+
+DEFAULT_FILES = "test/test_files/*.txt"
+# what run_all.sh passed to compare
+DEFAULT_FUZZ = 2.0
+# the last panel of a diff image maps differences from 0 to this to 0 to 255, like
+# convert -level 0%,8%
+DIFF_LEVEL = 0.08 * 255
+
+
+@dataclasses.dataclass
+class FileResult():
+    """How the frames of one file compared with their references
+    \b name: the file, without its directory or extension
+    \b frames: the number of frames rendered
+    \b render_seconds: the time spent rendering them
+    \b compare_seconds: the time spent loading the references and comparing
+    \b ae: the number of differing pixels in each frame, None for frames without a reference
+    \b failed: the frames whose AE is more than max_ae
+    \b diffs: the diff images written
+    \b error: what went wrong, if the file couldn't be rendered
+    """
+    name: str
+    frames: int = 0
+    render_seconds: float = 0
+    compare_seconds: float = 0
+    ae: "list[Optional[int]]" = dataclasses.field(default_factory=list)
+    failed: "list[int]" = dataclasses.field(default_factory=list)
+    diffs: "list[str]" = dataclasses.field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def passed(self) -> bool:
+        return self.error is None and not self.failed and None not in self.ae
+
+
+def differing_pixels(pixels: np.ndarray, reference: np.ndarray, fuzz: float) -> np.ndarray:
+    """Which pixels of two RGBA images differ by more than fuzz, a percentage. The
+    distance between two pixels is the root mean square of the differences of their
+    channels, so it runs from 0 to 100% of 255.
+    """
+    difference = pixels.astype(float) - reference
+    distance = np.sqrt(np.mean(difference * difference, axis=-1))
+    return distance > fuzz / 100 * 255
+
+def diff_image(pixels: np.ndarray, reference: np.ndarray, differ: np.ndarray) -> np.ndarray:
+    """The rendered frame, the reference, the differing pixels in red over a faded
+    reference, their difference, and their difference brightened, side by side
+    """
+    opaque = np.full(pixels.shape[:2] + (1,), 255, dtype=np.uint8)
+    faded = np.concatenate((reference[..., :3] // 4 + 191, opaque), axis=-1)
+    faded[differ] = [255, 0, 0, 255]
+    difference = np.abs(pixels.astype(int) - reference)[..., :3]
+    level = np.clip(np.round(difference * (255 / DIFF_LEVEL)), 0, 255)
+    panels = [pixels, reference, faded,
+        np.concatenate((difference.astype(np.uint8), opaque), axis=-1),
+        np.concatenate((level.astype(np.uint8), opaque), axis=-1)]
+    return np.concatenate(panels, axis=1)
+
+def load_references(directory: str, name: str, filenames: "list[str]") -> "list[Optional[np.ndarray]]":
+    """The reference of each frame, see the module docstring, None where there isn't one
+    """
+    references: "list[Optional[np.ndarray]]" = [None] * len(filenames)
+    for frame, filename in enumerate(filenames):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            with Image.open(path) as image:
+                references[frame] = np.asarray(image.convert("RGBA"))
+    path = os.path.join(directory, name + ".png")
+    if any(still is None for still in references) and os.path.exists(path):
+        with Image.open(path) as image:
+            for frame, still in enumerate(ImageSequence.Iterator(image)):
+                if frame < len(references) and references[frame] is None:
+                    references[frame] = np.asarray(still.convert("RGBA"))
+    return references
+
+def check_file(path: str, reference: str, fuzz: float = DEFAULT_FUZZ, max_ae: int = 0,
+        diff_directory: Optional[str] = None, save_reference: bool = False) -> FileResult:
+    """Renders the frames of a file and compares them with the ones in reference. With
+    save_reference, the frames are written to reference instead.
+    """
+    result = FileResult(os.path.splitext(os.path.basename(path))[0])
+    try:
+        renderer = render.load(path)
+        start = time.perf_counter()
+        references = [] if save_reference else load_references(reference, result.name, renderer.filenames)
+        result.compare_seconds += time.perf_counter() - start
+        image = Framebuffer(renderer.image_info.width, renderer.image_info.height)
+        for frame, filename in enumerate(renderer.filenames):
+            image.clear()
+            start = time.perf_counter()
+            render.render_frame(renderer, frame, image)
+            result.render_seconds += time.perf_counter() - start
+            result.frames += 1
+            pixels = image.pixels()
+            if save_reference:
+                os.makedirs(reference, exist_ok=True)
+                image.save(os.path.join(reference, filename))
+                continue
+            start = time.perf_counter()
+            expected = references[frame]
+            if expected is None:
+                result.ae.append(None)
+            elif expected.shape != pixels.shape:
+                result.ae.append(pixels.shape[0] * pixels.shape[1])
+                result.failed.append(frame)
+            else:
+                differ = differing_pixels(pixels, expected, fuzz)
+                result.ae.append(int(np.count_nonzero(differ)))
+                if result.ae[-1] > max_ae:
+                    result.failed.append(frame)
+                    if diff_directory is not None:
+                        os.makedirs(diff_directory, exist_ok=True)
+                        diff = os.path.join(diff_directory, "diff-" + filename)
+                        Image.fromarray(diff_image(pixels, expected, differ), "RGBA").save(diff)
+                        result.diffs.append(diff)
+            result.compare_seconds += time.perf_counter() - start
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+def run(paths: "list[str]", reference: str, jobs: int = 1, fuzz: float = DEFAULT_FUZZ, max_ae: int = 0,
+        diff_directory: Optional[str] = None, save_reference: bool = False) -> "list[FileResult]":
+    """Checks every file, on `jobs` worker processes, see check_file. The results are in
+    the order of paths.
+    """
+    check = functools.partial(check_file, reference=reference, fuzz=fuzz, max_ae=max_ae,
+        diff_directory=diff_directory, save_reference=save_reference)
+    if jobs <= 1:
+        return [check(path) for path in paths]
+    with concurrent.futures.ProcessPoolExecutor(min(jobs, len(paths))) as pool:
+        return list(pool.map(check, paths))
+
+def format_table(results: "list[FileResult]") -> str:
+    rows = [("file", "frames", "render", "compare", "max AE", "result")]
+    for result in results:
+        if result.error is not None:
+            status = result.error
+        elif result.failed:
+            status = f"FAIL frames {', '.join(str(frame) for frame in result.failed)}"
+        elif None in result.ae:
+            status = f"no reference for {result.ae.count(None)} frames"
+        else:
+            status = "ok"
+        known = [ae for ae in result.ae if ae is not None]
+        rows.append((result.name, str(result.frames), f"{result.render_seconds:.3f}s",
+            f"{result.compare_seconds:.3f}s", str(max(known)) if known else "-", status))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows)
+
+def main(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.regression",
+        description="Renders scene files and compares their frames with reference images")
+    parser.add_argument("files", nargs="*", help=f"the files to render, {DEFAULT_FILES} if none are given")
+    parser.add_argument("--reference", default="test/correct_files", help="the directory of reference images")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="the number of files rendered at once")
+    parser.add_argument("--fuzz", type=float, default=DEFAULT_FUZZ,
+        help="how far apart, in percent, two pixels can be and still be the same")
+    parser.add_argument("--max-ae", type=int, default=0,
+        help="how many pixels of a frame can differ before it fails")
+    parser.add_argument("--diffs", default="test/created_files", metavar="DIR",
+        help="where the diff images of frames that fail are written")
+    parser.add_argument("--save-reference", action="store_true",
+        help="write the frames to --reference instead of comparing them")
+    parsed = parser.parse_args(args)
+
+    paths = parsed.files or sorted(glob.glob(DEFAULT_FILES))
+    if not paths:
+        parser.error(f"no files match {DEFAULT_FILES}")
+    start = time.perf_counter()
+    results = run(paths, parsed.reference, parsed.jobs, parsed.fuzz, parsed.max_ae,
+        parsed.diffs, parsed.save_reference)
+    print(format_table(results))
+    print(f"{len(paths)} files in {time.perf_counter() - start:.2f}s")
+    if parsed.save_reference:
+        print(f"saved references to {parsed.reference}")
+        return 0 if all(result.error is None for result in results) else 1
+    diffs = [diff for result in results for diff in result.diffs]
+    if diffs:
+        print("diff images:")
+        print("\n".join("  " + diff for diff in diffs))
+    return 0 if all(result.passed for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,224 @@
+import collections
+import concurrent.futures
+import dataclasses
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+
+from src.framebuffer import Framebuffer
+import src.file_parse as file_parse
+import src.frame_cache as frame_cache
+import src.objects as obj
+import src.output as output
+import src.profiler as profiler
+import src.tiles as tiles
+import src.utils as utils
+import src.variables as var
+
+
+@dataclasses.dataclass
+class Renderer():
+    """Everything needed to render the frames of one file
+    \b image_info: the metadata from the first line of the file
+    \b filenames: the name of the png written for each frame
+    \b program: the rest of the file, compiled
+    """
+    image_info: utils.ImageInfo
+    filenames: "list[str]"
+    program: file_parse.Program
+    variables: var.Variables
+    draw_data: utils.SceneData
+    objects: Dict[str, obj.Object] = dataclasses.field(default_factory=dict)
+
+def load(filename: str, depth_dtype: type = np.float64, tile_size: Optional[int] = None,
+        threads: Optional[int] = None) -> Renderer:
+    """Parses a file. With threads, the triangles of each frame are drawn by a
+    tiles.Tiler using that many threads, on tiles of tile_size.
+    """
+    with open(filename, "r") as file:
+        lines = file.readlines()
+    # Read the first line to determine meta info about the file
+    if not lines:
+        raise Exception("not enough lines")
+    if len(lines) <= 1:
+        raise Exception("Nothing to draw")
+    # Get the image info from the first line
+    image_info = file_parse.get_image_info(lines[0])
+    # Initialize the structures needed to render the scene
+    draw_data = utils.SceneData(
+        vertex_list=[],
+        height=image_info.height,
+        width=image_info.width,
+        depth_dtype=depth_dtype,
+        tile_size=tile_size,
+        tiler=tiles.Tiler(threads, tile_size or tiles.DEFAULT_TILE_SIZE) if threads else None,
+    )
+    variables = var.Variables(image_info.number_of_images)
+    # Parse the file once, each frame only runs the compiled lines
+    program = file_parse.compile_file(lines[1:], variables)
+    return Renderer(image_info, utils.make_filename_list(image_info), program, variables, draw_data)
+
+def render_frame(renderer: Renderer, frame: int, image: Framebuffer) -> None:
+    """Draws one frame of the animation into image. Frames can be rendered in any order.
+    """
+    if profiler.active is not None:
+        profiler.active.start_frame(frame)
+    _draw_frame(renderer, frame, image)
+
+def frame_key(renderer: Renderer, frame: int) -> str:
+    """The hash of everything a frame is drawn from, see file_parse.frame_inputs. Frames
+    with the same key draw the same image.
+    """
+    renderer.variables.set_frame(frame)
+    info = renderer.image_info
+    return frame_cache.key(info.width, info.height, renderer.draw_data.depth_buffer.dtype.str,
+        file_parse.frame_inputs(renderer.program))
+
+@profiler.timed("frame")
+def _draw_frame(renderer: Renderer, frame: int, image: Framebuffer) -> None:
+    renderer.variables.set_frame(frame)
+    file_parse.run_frame(renderer.program, image, renderer.draw_data, renderer.objects)
+    # Whipe the data of variables and objects
+    renderer.objects.clear()
+    renderer.draw_data.clear()
+
+def render_all(renderer: Renderer, cache: Optional[frame_cache.FrameCache] = None,
+        stream: Optional[output.FrameStream] = None) -> None:
+    """Renders every frame in order. Each frame is saved on a background thread as soon
+    as it is done, while the next one is rendered. Frames found in the cache are copied
+    from it instead. With a stream, the frames are added to it instead of being saved
+    to their own files, and the cache isn't used.
+    """
+    if stream is not None:
+        with output.StreamWriter(stream) as writer:
+            for frame in range(len(renderer.filenames)):
+                image = writer.get_framebuffer()
+                render_frame(renderer, frame, image)
+                writer.write(image, None)
+        return
+    rendered = []
+    with output.PngWriter(renderer.image_info.width, renderer.image_info.height) as writer:
+        for frame, filename in enumerate(renderer.filenames):
+            if cache is not None:
+                key = frame_key(renderer, frame)
+                if cache.fetch(key, filename):
+                    print(f"reusing file {filename}")
+                    continue
+                rendered.append((key, filename))
+            image = writer.get_framebuffer()
+            render_frame(renderer, frame, image)
+            writer.write(image, filename)
+    if cache is not None:
+        for key, filename in rendered:
+            cache.store(key, filename)
+        cache.trim()
+
+### RENDERING IN PARALLEL ###
+# each worker process loads the file once and keeps its own Renderer and framebuffer
+_worker_renderer: Optional[Renderer] = None
+_worker_image: Optional[Framebuffer] = None
+_worker_cache: Optional[frame_cache.FrameCache] = None
+
+def _start_worker(filename: str, profile: bool, depth_dtype: type, tile_size: Optional[int], threads: Optional[int],
+        cache: Optional[frame_cache.FrameCache]) -> None:
+    global _worker_renderer, _worker_image, _worker_cache
+    _worker_cache = cache
+    if profile:
+        profiler.active = profiler.Profiler()
+    _worker_renderer = load(filename, depth_dtype, tile_size, threads)
+    _worker_image = Framebuffer(_worker_renderer.image_info.width, _worker_renderer.image_info.height)
+
+def _render_and_save(frame: int) -> "tuple[str, bool, Optional[profiler.FrameProfile], Optional[profiler.FrameProfile]]":
+    """Returns the name of the file saved, whether it was copied from the cache, and when
+    profiling, the profile of the frame and of the worker's setup, which is only sent once
+    """
+    filename = _worker_renderer.filenames[frame]
+    key = None if _worker_cache is None else frame_key(_worker_renderer, frame)
+    reused = key is not None and _worker_cache.fetch(key, filename)
+    if reused:
+        if profiler.active is not None:
+            profiler.active.start_frame(frame)
+    else:
+        image = _worker_image
+        image.clear()
+        render_frame(_worker_renderer, frame, image)
+        start = time.perf_counter()
+        image.save(filename)
+        if profiler.active is not None:
+            profiler.active.add("save", time.perf_counter() - start)
+        if key is not None:
+            _worker_cache.store(key, filename)
+    if profiler.active is None:
+        return filename, reused, None, None
+    setup, profiler.active.setup = profiler.active.setup, profiler.FrameProfile()
+    return filename, reused, profiler.active.frames.pop(frame), setup
+
+def _render_pixels(frame: int) -> "tuple[np.ndarray, Optional[profiler.FrameProfile], Optional[profiler.FrameProfile]]":
+    """Returns the pixels of a frame, and the profiles like _render_and_save
+    """
+    image = _worker_image
+    image.clear()
+    render_frame(_worker_renderer, frame, image)
+    pixels = image.pixels().copy()
+    if profiler.active is None:
+        return pixels, None, None
+    setup, profiler.active.setup = profiler.active.setup, profiler.FrameProfile()
+    return pixels, profiler.active.frames.pop(frame), setup
+
+def bounded_map(pool: concurrent.futures.Executor, function: Callable, items: Iterable, window: int) -> Iterator:
+    """Like pool.map, but only submits `window` calls ahead of the result being read, so
+    the results waiting to be read don't pile up
+    """
+    pending: "collections.deque[concurrent.futures.Future]" = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+def read_image_info(filename: str) -> utils.ImageInfo:
+    """The image info of a file, without parsing the rest of it
+    """
+    with open(filename, "r") as file:
+        return file_parse.get_image_info(file.readline())
+
+def render_parallel(filename: str, jobs: int, depth_dtype: type = np.float64, tile_size: Optional[int] = None,
+        threads: Optional[int] = None, cache: Optional[frame_cache.FrameCache] = None,
+        stream: Optional[output.FrameStream] = None) -> None:
+    """Renders the frames of a file on `jobs` worker processes, each of which saves the
+    frames it renders. Consecutive frames are handed out together, so a worker can reuse
+    the frame invariant work of its first frame for the rest. When profiling, the
+    profiles made by the workers are collected in profiler.active. Workers copy frames
+    found in the cache instead of rendering them. With a stream, the workers send back
+    the pixels of their frames, which are added to it in order, and the cache isn't used.
+    """
+    number_of_images = read_image_info(filename).number_of_images
+    chunksize = max(1, number_of_images // (jobs * 4))
+    profile = profiler.active is not None
+    if stream is not None:
+        cache = None
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_start_worker, initargs=(filename, profile, depth_dtype, tile_size, threads, cache)) as pool:
+        if stream is not None:
+            with output.StreamWriter(stream) as writer:
+                # only a few frames wait for the writer at a time, however long the animation
+                frames = bounded_map(pool, _render_pixels, range(number_of_images), jobs * 2)
+                for frame, (pixels, frame_profile, setup) in enumerate(frames):
+                    if profile:
+                        profiler.active.frames[frame] = frame_profile
+                        profiler.active.setup.merge(setup)
+                        # writing the frame is timed as part of it
+                        profiler.active.current = frame_profile
+                    image = writer.get_framebuffer()
+                    image.color[...] = pixels
+                    writer.write(image, None)
+            return
+        frames = pool.map(_render_and_save, range(number_of_images), chunksize=chunksize)
+        for frame, (saved, reused, frame_profile, setup) in enumerate(frames):
+            print(f"{'reusing' if reused else 'saving'} file {saved}")
+            if profile:
+                profiler.active.frames[frame] = frame_profile
+                profiler.active.setup.merge(setup)
+    if cache is not None:
+        cache.trim()
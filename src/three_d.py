@@ -1,68 +1,227 @@
-import copy
-
+import math
 import numpy as np
-from PIL import Image
-from typing import Dict
-import src.lines as lines
+from typing import Dict, Optional
+from src.framebuffer import Framebuffer
+import src.raster as raster
 from src.objects import Object
+import src.profiler as profiler
 import src.utils as utils
 import src.vertex as vertex
 
+# the attributes rasterized for flat and gouraud shaded triangles, the others are left out
+FLAT_ATTRIBUTES = ("x", "y", "z")
+GOURAUD_ATTRIBUTES = ("x", "y", "z", "r", "g", "b")
+# gouraud triangles only interpolate alpha when a corner isn't opaque
+GOURAUD_ALPHA_ATTRIBUTES = GOURAUD_ATTRIBUTES + ("a",)
+# how far past a side of the clip volume every corner of a triangle has to be for it to
+# be culled, well above the rounding error of interpolating between the corners
+CULL_MARGIN = 1e-6
 
-def transform_vertex(point: vertex.Vertex, draw_data: utils.SceneData, objs: Dict[str, Object]) -> vertex.Vertex:
-    """Ideas for this were taken from http://www.songho.ca/opengl/gl_transform.html
+
+def view_projection(draw_data: utils.SceneData, objs: Dict[str, Object]) -> np.ndarray:
+    """The projection matrix premultiplied with the inverse of the camera's position matrix.
+    It is worked out once, then kept in draw_data until the projection or camera change.
+    """
+    if draw_data.view_projection is None:
+        if draw_data.camera is None:
+            draw_data.view_projection = draw_data.projection
+        else:
+            camera = objs[draw_data.camera].make_inverse_matrix(objs)
+            draw_data.view_projection = np.matmul(draw_data.projection, camera)
+    return draw_data.view_projection
+
+def object_transform(draw_data: utils.SceneData, objs: Dict[str, Object]) -> "tuple[np.ndarray, np.ndarray]":
+    """The position matrix of the current object and the view projection matrix. They are
+    kept apart because multiplying them first rounds differently than applying them one
+    after the other, which moves the edges of some triangles by a pixel.
+    """
+    current = objs[draw_data.curent_object]
+    if current.position_matrix is None:
+        current.make_position_matrix(objs)
+    return current.position_matrix, view_projection(draw_data, objs)
+
+def to_screen(points: np.ndarray, transform: "tuple[np.ndarray, np.ndarray]", draw_data: utils.SceneData) -> np.ndarray:
+    """Takes vertices as rows of an (N, 8) array and returns their screen coordinates.
+    Ideas for this were taken from http://www.songho.ca/opengl/gl_transform.html
 
     Args:
-        image (Image): The image we will add the pixel to
-        point (vertex.Vertex): The point to be added
-        draw_data (utils.DrawData): Data needed to draw the image
+        points (np.ndarray): rows of x, y, z, w, r, g, b, a
+        transform (tuple[np.ndarray, np.ndarray]): the position matrix taking the points
+            into world coordinates, and the view projection taking those into clip coordinates
+        draw_data (utils.SceneData): Data needed to draw the image
     """
-    copy_point = copy.deepcopy(point)
-    if objs[draw_data.curent_object].position_matrix is None:
-        objs[draw_data.curent_object].make_position_matrix(objs)
-    eye_coordinates: np.ndarray = np.matmul(objs[draw_data.curent_object].position_matrix, copy_point.position_data())
-    # Apply the projection matrix
-    clip_coordinates = np.matmul(draw_data.projection, eye_coordinates)
+    position_matrix, projection = transform
+    # each point is a column vector, like it was when vertices were transformed one at a
+    # time, which is what keeps the sums in the same order as that did. points @ M.T
+    # goes through a matrix product that sums them differently.
+    world = np.matmul(position_matrix, points[:, :4, None])
+    clip_coordinates = np.matmul(projection, world)[..., 0]
+    screen = points.astype(float)
     # divide each x, y, and z by w
-    copy_point.x = clip_coordinates[0] / clip_coordinates[3]
-    copy_point.y = clip_coordinates[1] / clip_coordinates[3]
-    copy_point.z = clip_coordinates[2] / clip_coordinates[3]
-    copy_point.w = clip_coordinates[3]
+    screen[:, :3] = clip_coordinates[:, :3] / clip_coordinates[:, 3:]
+    screen[:, 3] = clip_coordinates[:, 3]
     # apply a viewport transformation
-    copy_point.x = (copy_point.x + 1) * draw_data.width/2
-    copy_point.y = (copy_point.y + 1) * draw_data.height/2
-    return copy_point
+    screen[:, 0] = (screen[:, 0] + 1) * draw_data.width/2
+    screen[:, 1] = (screen[:, 1] + 1) * draw_data.height/2
+    return screen
+
+@profiler.timed("transform")
+def transform_vertices(draw_data: utils.SceneData, objs: Dict[str, Object]) -> np.ndarray:
+    """Screen coordinates of every vertex of the current object, as rows of an (N, 8) array
+    in the same order as draw_data.vertex_list. Vertices are transformed once, the results
+    are kept in draw_data.screen_vertices for every triangle that uses them.
+    """
+    done = draw_data.screen_vertices.shape[0]
+    if done < len(draw_data.vertex_list):
+        points = vertex.vertex_buffer(draw_data.vertex_list[done:])
+        screen = to_screen(points, object_transform(draw_data, objs), draw_data)
+        draw_data.screen_vertices = np.concatenate((draw_data.screen_vertices, screen))
+    return draw_data.screen_vertices
+
+@profiler.timed("transform")
+def transform_vertex(point: vertex.Vertex, draw_data: utils.SceneData, objs: Dict[str, Object]) -> vertex.Vertex:
+    """Transforms a single vertex into screen coordinates
+
+    Args:
+        point (vertex.Vertex): The point to be transformed
+        draw_data (utils.DrawData): Data needed to draw the image
+    """
+    screen = to_screen(point.as_ndarray()[None, :], object_transform(draw_data, objs), draw_data)
+    return vertex.ndarray_to_vertex(screen[0], is_rounded=False)
+
+def is_culled(draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> bool:
+    """Whether a triangle whose corners are in screen coordinates can be skipped before it
+    is rasterized. Its fragments are interpolated between its corners, so none of them are
+    drawn when every corner is past the same side of the screen, the near plane or the
+    far plane. With draw_data.cull set, triangles that are clockwise on the screen are
+    skipped as well.
+    """
+    (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = (p[:3].tolist() for p in (p1, p2, p3))
+    if max(x1, x2, x3) < -CULL_MARGIN or max(y1, y2, y3) < -CULL_MARGIN \
+            or max(z1, z2, z3) < draw_data.near - CULL_MARGIN \
+            or min(x1, x2, x3) > draw_data.width + CULL_MARGIN \
+            or min(y1, y2, y3) > draw_data.height + CULL_MARGIN \
+            or min(z1, z2, z3) > draw_data.far + CULL_MARGIN:
+        return True
+    if not draw_data.cull:
+        return False
+    # twice the signed area, rows go down the screen so clockwise is positive
+    return (x2 - x1) * (y3 - y1) - (x3 - x1) * (y2 - y1) > 0
 
-def draw_3d_triangle(image: Image, draw_data: utils.SceneData, objs: Dict[str, Object], i1: vertex.Vertex, i2: vertex.Vertex, i3: vertex.Vertex, gouraud: bool = False):
-    # First, transform the vertexes provided
-    p1 = transform_vertex(i1, draw_data, objs)
-    p2 = transform_vertex(i2, draw_data, objs)
-    p3 = transform_vertex(i3, draw_data, objs)
+def cull_triangle(draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> bool:
+    """is_culled, counting the triangles it culls while profiling
+    """
+    culled = is_culled(draw_data, p1, p2, p3)
+    if culled and profiler.active is not None:
+        profiler.active.count_triangle("culled")
+    return culled
 
+def is_occluded(draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> bool:
+    """Whether a triangle whose corners are in screen coordinates is behind what is already
+    in the depth buffer across its bounding box, so every one of its fragments would fail
+    the depth test. Counts the triangles it finds while profiling.
+    """
+    (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) = (p[:3].tolist() for p in (p1, p2, p3))
+    corners = (x1, x2, x3, y1, y2, y3)
+    if not all(map(math.isfinite, corners)):
+        return False
+    # a pixel or more of slack around the box covers rounding in the rasterizer
+    occluded = draw_data.occludes(
+        math.floor(min(x1, x2, x3)) - 1, math.floor(max(x1, x2, x3)) + 1,
+        math.floor(min(y1, y2, y3)) - 1, math.floor(max(y1, y2, y3)) + 1,
+        min(z1, z2, z3) - CULL_MARGIN)
+    if occluded and profiler.active is not None:
+        profiler.active.count_triangle("occluded")
+    return occluded
+
+def no_fragments() -> "tuple[np.ndarray, ...]":
+    """What shade_triangle returns for a triangle without fragments
+    """
+    return np.empty(0), np.empty(0), np.empty(0), np.empty((0, 4), dtype=np.uint8)
+
+def shade_triangle(draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, gouraud: bool = False,
+        color: Optional[utils.RGBFloat] = None) -> "tuple[np.ndarray, ...]":
+    """Rasterizes a triangle whose corners are already in screen coordinates, as returned
+    by transform_vertices, without drawing it. Flat triangles are drawn in `color`,
+    draw_data.color if it is None.
+
+    Returns:
+        the x, y, z and RGBA color of the fragments, as taken by Framebuffer.write_fragments
+    """
     # Rasterize the triangle into fragments, interpolating a z value 
-    # (and other values as extras require) for each pixel. 
-    verts: list[vertex.Vertex] = lines.triangle_fill(p1, p2, p3, width=draw_data.width, height=draw_data.height)
+    # (and the color for gouraud shading) for each pixel. 
+    translucent = gouraud and is_translucent(draw_data, p1, p2, p3, gouraud)
+    attributes = (GOURAUD_ALPHA_ATTRIBUTES if translucent else GOURAUD_ATTRIBUTES) if gouraud else FLAT_ATTRIBUTES
+    frags = raster.triangle_fragments(p1, p2, p3, width=draw_data.width, height=draw_data.height, attributes=attributes)
+    if gouraud:
+        channels = "rgba" if translucent else "rgb"
+        rgba = np.empty((len(frags), len(channels)))
+        for i, name in enumerate(channels):
+            np.multiply(frags[name], 255, out=rgba[:, i])
+        color = np.empty((len(frags), 4), dtype=np.uint8)
+        color[:, :len(channels)] = np.clip(np.round(rgba), 0, 255)
+        if not translucent:
+            color[:, 3] = 255
+    else:
+        # as_rgb already clamps to 0 to 255
+        flat_color = (draw_data.color if color is None else color).as_rgb(rounded=True)
+        color = np.asarray([flat_color.r, flat_color.g, flat_color.b, flat_color.a], dtype=np.uint8)
+    return frags["x"], frags["y"], frags["z"], color
+
+def is_translucent(draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, gouraud: bool) -> bool:
+    """Whether a triangle has to be blended with what is under it, see Framebuffer.blend_fragments
+    """
+    if not draw_data.blending:
+        return False
+    if gouraud:
+        return min(p1[7], p2[7], p3[7]) < 1
+    return draw_data.color.a < 1
+
+def fragment_bounds(fragments: "tuple[np.ndarray, ...]") -> "Optional[tuple[int, int, int, int, float]]":
+    """The columns and rows fragments cover and their closest z, as taken by
+    SceneData.occludes. None if there are no fragments.
+    """
+    x, y, z, _ = fragments
+    if len(z) == 0:
+        return None
+    return math.floor(x.min()), math.floor(x.max()), math.floor(y.min()), math.floor(y.max()), z.min()
+
+def draw_fragments(image: Framebuffer, draw_data: utils.SceneData, fragments: "tuple[np.ndarray, ...]",
+        bounds: "Optional[tuple[int, int, int, int, float]]" = None):
+    """Draws fragments as returned by shade_triangle. When their fragment_bounds are given,
+    the fragments are skipped if what is already drawn hides all of them.
+    """
+    if bounds is not None and draw_data.occludes(*bounds):
+        if profiler.active is not None:
+            profiler.active.count_triangle("occluded")
+        return
+    color = fragments[3]
+    if draw_data.blending and (color[3] if color.ndim == 1 else color[:, 3].min(initial=255)) < 255:
+        # translucent fragments are blended after everything drawn before them
+        flush(image, draw_data)
+        image.blend_fragments(draw_data.depth_buffer, draw_data.near, draw_data.far, *fragments)
+        return
+    if draw_data.tiler is not None:
+        draw_data.tiler.add_fragments(image, draw_data, fragments)
+        return
     # Only continue with those pixels that are on the screen and 
     # have z between 0 and 1. 
-    for vert in verts:
-        # check x
-        if not 0 <= vert.x < draw_data.width:
-            continue
-        # check y
-        if not 0 <= vert.y < draw_data.height:
-            continue
-        # check z bounds
-        if not draw_data.near <= vert.z <= draw_data.far:
-            continue
-        # check depth buffer
-        if draw_data.depth_buffer[(int(vert.y), int(vert.x))] < vert.z:
-            continue
-        # Set the pixel and depth buffer values
-        pixel = vert.as_pixel()
-        draw_data.depth_buffer[(pixel.y, pixel.x)] = vert.z
-        if gouraud:
-            color: utils.RGB = utils.RGB(pixel.r, pixel.g, pixel.b)
-        else:
-            color: utils.RGB = draw_data.color.as_rgb(rounded=True)
+    draw_data.mark_drawn(fragments[0], fragments[1])
+    image.write_fragments(draw_data.depth_buffer, draw_data.near, draw_data.far, *fragments)
+
+def draw_3d_triangle(image: Framebuffer, draw_data: utils.SceneData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, gouraud: bool = False):
+    """Draws a triangle whose corners are already in screen coordinates, as returned
+    by transform_vertices
+    """
+    if cull_triangle(draw_data, p1, p2, p3) or is_occluded(draw_data, p1, p2, p3):
+        return
+    if draw_data.tiler is not None and not is_translucent(draw_data, p1, p2, p3, gouraud):
+        draw_data.tiler.add_triangle(image, draw_data, p1, p2, p3, gouraud)
+        return
+    draw_fragments(image, draw_data, shade_triangle(draw_data, p1, p2, p3, gouraud))
 
-        image.im.putpixel((pixel.x, pixel.y), (color.r, color.g, color.b, color.a))
+def flush(image: Framebuffer, draw_data: utils.SceneData):
+    """Finishes drawing whatever draw_data.tiler has queued
+    """
+    if draw_data is not None and draw_data.tiler is not None:
+        draw_data.tiler.flush(image, draw_data)
@@ -0,0 +1,184 @@
+"""Deferred drawing of a frame's triangles, rasterized and depth tested on a thread pool.
+
+While a Tiler is set on SceneData.tiler, triangles are only transformed in script
+order. Their corners, and the state they are shaded with, are queued. flush then
+rasterizes the queued triangles in parallel, bins their fragments into square tiles of
+the screen and depth tests each tile on its own thread. The NumPy kernels doing the
+work release the GIL.
+
+The result is the same as drawing the triangles one at a time. A fragment passes the
+depth test when its z is no greater than the depth already at its pixel, and the depth
+becomes its z. So after any number of fragments, a pixel's depth is the smallest of
+the starting depth and every z, and its color comes from the last fragment in script
+order with that z. Each tile works that out with a stable sort of its fragments by
+pixel. This needs each fragment to be read and written at the same pixel, which
+triangle_fragments gives on its integer rows and columns. When it doesn't, the frame
+is drawn one triangle at a time. A float32 depth buffer, which rounds the z it
+stores, is also drawn one triangle at a time.
+"""
+import concurrent.futures
+
+import numpy as np
+
+from src.framebuffer import Framebuffer
+import src.profiler as profiler
+import src.three_d as three_d
+import src.utils as utils
+
+DEFAULT_TILE_SIZE = 64
+# about how many fragments can be queued before they are drawn, which bounds the memory
+# held by them
+MAX_PENDING_FRAGMENTS = 1 << 21
+
+
+class Tiler():
+    """Queues the drawing done during a frame, see the module docstring.
+    Set as SceneData.tiler to use it.
+    """
+    def __init__(self, threads: int, tile_size: int = DEFAULT_TILE_SIZE) -> None:
+        self.threads = threads
+        self.tile_size = tile_size
+        self._pool = concurrent.futures.ThreadPoolExecutor(threads)
+        # a triangle to shade, (p1, p2, p3, gouraud, color), or fragments ready to draw
+        self._pending: list = []
+        # at most how many fragments the pending triangles have
+        self._pending_fragments = 0
+
+    def add_triangle(self, image: Framebuffer, draw_data: utils.SceneData,
+            p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, gouraud: bool) -> None:
+        self._pending.append((p1, p2, p3, gouraud, draw_data.color))
+        # the part of the bounding box of the triangle on the screen
+        corners = np.stack((p1[:2], p2[:2], p3[:2]))
+        low = np.clip(corners.min(axis=0), 0, (draw_data.width, draw_data.height))
+        high = np.clip(corners.max(axis=0) + 1, 0, (draw_data.width, draw_data.height))
+        self._add_pending(image, draw_data, np.prod(high - low))
+
+    def add_fragments(self, image: Framebuffer, draw_data: utils.SceneData, fragments: "tuple[np.ndarray, ...]") -> None:
+        self._pending.append(fragments)
+        self._add_pending(image, draw_data, len(fragments[0]))
+
+    def _add_pending(self, image: Framebuffer, draw_data: utils.SceneData, fragments: int) -> None:
+        self._pending_fragments += fragments
+        if self._pending_fragments >= MAX_PENDING_FRAGMENTS:
+            self.flush(image, draw_data)
+
+    def flush(self, image: Framebuffer, draw_data: utils.SceneData) -> None:
+        """Draws everything queued since the last flush into image
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._pending_fragments = 0
+        def shade(item):
+            if len(item) == 4:
+                return item
+            p1, p2, p3, gouraud, color = item
+            x, y, z, color = three_d.shade_triangle(draw_data, p1, p2, p3, gouraud, color=color)
+            # copies, so the rest of the rasterized attributes can be freed
+            return x.copy(), y.copy(), z.copy(), color
+        batches = list(self._pool.map(shade, pending))
+        for x, y, _, _ in batches:
+            draw_data.mark_drawn(x, y)
+        if draw_data.depth_buffer.dtype != np.float64 or not all(_same_pixel(x, y) for x, y, _, _ in batches):
+            for batch in batches:
+                image.write_fragments(draw_data.depth_buffer, draw_data.near, draw_data.far, *batch)
+            return
+        self._resolve(image, draw_data, batches)
+
+    @profiler.timed("depth")
+    def _resolve(self, image: Framebuffer, draw_data: utils.SceneData, batches: list) -> None:
+        height, width = draw_data.depth_buffer.shape
+        pixels, depths, colors = [], [], []
+        fragments = off_screen = 0
+        for x, y, z, color in batches:
+            visible = (0 <= x) & (x < width) & (0 <= y) & (y < height) \
+                & (draw_data.near <= z) & (z <= draw_data.far)
+            fragments += len(x)
+            if not visible.all():
+                x, y, z = x[visible], y[visible], z[visible]
+                if color.ndim == 2:
+                    color = color[visible]
+                off_screen += len(visible) - len(z)
+            pixels.append(y.astype(np.int64) * width + x.astype(np.int64))
+            depths.append(z)
+            colors.append(color if color.ndim == 2 else np.broadcast_to(color, (len(z), 4)))
+        pixel = np.concatenate(pixels)
+        z = np.concatenate(depths)
+        color = np.concatenate(colors)
+        if color.dtype != np.uint8:
+            color = np.clip(color, 0, 255).astype(np.uint8)
+
+        # bin the fragments into tiles, keeping script order within each tile
+        size = self.tile_size
+        tiles_across = -(-width // size)
+        tile = (pixel // width // size) * tiles_across + (pixel % width) // size
+        order = np.argsort(tile, kind="stable")
+        tile = tile[order]
+        bounds = np.flatnonzero(np.diff(tile)) + 1
+        # hand out runs of whole tiles, a few for each thread
+        ranges = _chunk_ranges(bounds, len(tile), self.threads * 4)
+        depth = draw_data.depth_buffer.reshape(-1)
+        rgba = image.color.reshape(-1, 4)
+        def resolve(bounds: "tuple[int, int]") -> int:
+            start, stop = bounds
+            return _resolve_pixels(order[start:stop], pixel, z, color, depth, rgba)
+        rejected = sum(self._pool.map(resolve, ranges))
+        if profiler.active is not None:
+            profiler.active.count_fragments(fragments, off_screen, rejected)
+
+
+def _same_pixel(x: np.ndarray, y: np.ndarray) -> bool:
+    """Whether every fragment is read and written at the same pixel, see Framebuffer.write_fragments
+    """
+    return np.array_equal(np.round(x), np.trunc(x)) and np.array_equal(np.round(y), np.trunc(y))
+
+def _chunk_ranges(bounds: np.ndarray, total: int, chunks: int) -> "list[tuple[int, int]]":
+    """Splits [0, total) into at most `chunks` ranges, only at the tile boundaries in bounds
+    """
+    edges = np.concatenate(([0], bounds, [total]))
+    picked = np.unique(edges[np.linspace(0, len(edges) - 1, min(chunks, len(edges) - 1) + 1).astype(int)])
+    return list(zip(picked[:-1], picked[1:]))
+
+def _resolve_pixels(index: np.ndarray, pixel: np.ndarray, z: np.ndarray, color: np.ndarray,
+        depth: np.ndarray, rgba: np.ndarray) -> int:
+    """Depth tests the fragments at `index`, which are in script order and cover whole
+    tiles, and writes the result into the flattened depth and color buffers.
+    Returns the number of fragments that failed the depth test, when profiling.
+    """
+    if len(index) == 0:
+        return 0
+    index = index[np.argsort(pixel[index], kind="stable")]
+    pix = pixel[index]
+    zs = z[index]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(pix)) + 1))
+    group = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [len(pix)]))))
+    first_pixel = pix[starts]
+    initial = depth[first_pixel]
+    final = np.minimum(np.minimum.reduceat(zs, starts), initial)
+    # the last fragment of each pixel that ends up with the final depth wrote it
+    is_final = zs == final[group]
+    last = np.maximum.reduceat(np.where(is_final, np.arange(len(zs)), -1), starts)
+    written = last >= 0
+    depth[first_pixel[written]] = final[written]
+    rgba[first_pixel[written]] = color[index[last[written]]]
+    if profiler.active is None:
+        return 0
+    return len(zs) - _count_passed(zs, group, starts, initial)
+
+def _count_passed(zs: np.ndarray, group: np.ndarray, starts: np.ndarray, initial: np.ndarray) -> int:
+    """How many fragments were no further away than every fragment before them at
+    their pixel and the starting depth. The values are replaced by their ranks, so each
+    pixel can be offset below all the ones before it without losing precision, and one
+    running minimum covers every pixel.
+    """
+    groups = len(starts)
+    _, ranks = np.unique(np.concatenate((initial, zs)), return_inverse=True)
+    step = len(ranks) + 1
+    # each pixel's starting depth followed by its fragments
+    initial_at = starts + np.arange(groups)
+    fragment_at = np.arange(len(zs)) + group + 1
+    sequence = np.empty(len(ranks), dtype=np.int64)
+    sequence[initial_at] = ranks[:groups] - np.arange(groups) * step
+    sequence[fragment_at] = ranks[groups:] - group * step
+    running = np.minimum.accumulate(sequence)
+    return int(np.count_nonzero(sequence[fragment_at] <= running[fragment_at - 1]))
@@ -1,12 +1,15 @@
+import argparse
 import dataclasses
-import math
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 import enum
 
-from PIL import Image
 import numpy as np
 
 
+# the side of the squares of the depth buffer SceneData.max_depth is kept for
+HIZ_TILE_SIZE = 8
+
+
 @dataclasses.dataclass
 class ImageInfo():
     """This contains all the the metadata about the image file the program is processing
@@ -64,38 +67,196 @@ class IfState(enum.Enum):
     TIE = 4 # True and in else statement
     FIE = 5 # False and in else statement
 
+# shared by every SceneData that has no projection loaded, so it is read only
+IDENTITY = np.identity(4)
+IDENTITY.flags.writeable = False
+
 @dataclasses.dataclass
 class SceneData():
-    """contains information that will need to last for the lifecycle of the image
+    """contains information that will need to last for the lifecycle of the image.
+    The depth buffer is allocated once and reset in place by clear. With a tile_size,
+    only the tiles that fragments were drawn in since the last clear are reset.
+    max_depth is a coarse copy of the depth buffer that whole triangles are tested
+    against before they are rasterized, see occludes.
     """
     vertex_list: list
     height: int
     width: int
-    projection: np.ndarray = np.identity(4)
-    color: RGBFloat = RGBFloat(1.0, 1.0, 1.0)
+    projection: np.ndarray = dataclasses.field(default_factory=lambda: IDENTITY)
+    color: RGBFloat = dataclasses.field(default_factory=lambda: RGBFloat(1.0, 1.0, 1.0))
     near = 0
     far = 1
     if_state: IfState = IfState.NOI
     curent_object: Optional[str] = None
+    # set by the cull keyword, triangles that are clockwise on the screen are not drawn
+    cull: bool = False
+    # set when a color that isn't opaque is used, only then are triangles checked for
+    # whether they have to be blended
+    blending: bool = False
+    # the object the scene is seen from, None to look from the world origin
+    camera: Optional[str] = None
+    # a tiles.Tiler to queue triangles with, None to draw each one as soon as it is run
+    tiler: Optional[Any] = None
+    # the precision of the depth buffer, float32 halves its size
+    depth_dtype: type = np.float64
+    tile_size: Optional[int] = None
     depth_buffer: np.ndarray = dataclasses.field(init=False)
+    # for every tile_size square of the depth buffer, whether it was drawn in since the
+    # last clear. None without a tile_size
+    dirty_tiles: Optional[np.ndarray] = dataclasses.field(init=False, default=None)
+    # for every HIZ_TILE_SIZE square of the depth buffer, no less than the greatest depth in
+    # it. Squares drawn in since it was last brought up to date are set in stale_depth
+    max_depth: np.ndarray = dataclasses.field(init=False)
+    stale_depth: np.ndarray = dataclasses.field(init=False)
+    # screen coordinates of the first len(screen_vertices) entries of vertex_list
+    screen_vertices: np.ndarray = dataclasses.field(init=False)
+    # projection times the inverse of the camera matrix, None until the first triangle needs it
+    view_projection: Optional[np.ndarray] = dataclasses.field(init=False, default=None)
     def __post_init__(self):
-        self.depth_buffer = np.ones((self.height, self.width))
+        self.depth_buffer = np.ones((self.height, self.width), dtype=self.depth_dtype)
+        if self.tile_size:
+            self.dirty_tiles = np.zeros((-(-self.height // self.tile_size), -(-self.width // self.tile_size)), dtype=bool)
+        squares = (-(-self.height // HIZ_TILE_SIZE), -(-self.width // HIZ_TILE_SIZE))
+        self.max_depth = np.ones(squares)
+        self.stale_depth = np.zeros(squares, dtype=bool)
+        self.reset_screen_vertices()
+
+    def _tile_spans(self, tiles: np.ndarray) -> "Iterator[tuple[slice, slice]]":
+        """The depth buffer slices covered by the set tiles, one for each run of set
+        tiles in a row of tiles
+        """
+        size = self.tile_size
+        for row in np.flatnonzero(tiles.any(axis=1)):
+            # the columns where runs of set tiles start and end
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], tiles[row].view(np.int8), [0]))))
+            for start, stop in zip(edges[::2], edges[1::2]):
+                yield slice(row * size, (row + 1) * size), slice(start * size, stop * size)
+
+    def mark_drawn(self, x: np.ndarray, y: np.ndarray) -> None:
+        """Marks the tiles in the bounding box of fragments at x, y as drawn in
+        """
+        if len(x) == 0:
+            return
+        # truncating and adding one covers both the truncated and rounded positions
+        x0 = min(max(int(x.min()), 0), self.width - 1)
+        x1 = min(max(int(x.max()) + 1, 0), self.width - 1)
+        y0 = min(max(int(y.min()), 0), self.height - 1)
+        y1 = min(max(int(y.max()) + 1, 0), self.height - 1)
+        self.stale_depth[y0 // HIZ_TILE_SIZE:y1 // HIZ_TILE_SIZE + 1, x0 // HIZ_TILE_SIZE:x1 // HIZ_TILE_SIZE + 1] = True
+        if self.dirty_tiles is not None:
+            self.dirty_tiles[y0 // self.tile_size:y1 // self.tile_size + 1, x0 // self.tile_size:x1 // self.tile_size + 1] = True
+
+    def _update_max_depth(self, rows: slice, columns: slice) -> None:
+        """Brings max_depth up to date over the squares in rows and columns
+        """
+        size = HIZ_TILE_SIZE
+        depth = self.depth_buffer[rows.start * size:rows.stop * size, columns.start * size:columns.stop * size]
+        # squares on the bottom and right edges of the screen can be cut short
+        depth = np.maximum.reduceat(depth, np.arange(0, depth.shape[0], size), axis=0)
+        self.max_depth[rows, columns] = np.maximum.reduceat(depth, np.arange(0, depth.shape[1], size), axis=1)
+        self.stale_depth[rows, columns] = False
+
+    def occludes(self, x0: int, x1: int, y0: int, y1: int, z: float) -> bool:
+        """Whether the depth buffer is closer than z everywhere in columns x0 to x1 and rows
+        y0 to y1, inclusive. Fragments there that are no closer than z all fail the depth test.
+        """
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width - 1), min(y1, self.height - 1)
+        if x0 > x1 or y0 > y1:
+            return False
+        rows = slice(y0 // HIZ_TILE_SIZE, y1 // HIZ_TILE_SIZE + 1)
+        columns = slice(x0 // HIZ_TILE_SIZE, x1 // HIZ_TILE_SIZE + 1)
+        # depths only get closer, so stale squares are still no closer than what is in them
+        if self.max_depth[rows, columns].max() < z:
+            return True
+        stale = self.stale_depth[rows, columns]
+        if not stale.any() or (self.max_depth[rows, columns][~stale] >= z).any():
+            return False
+        self._update_max_depth(rows, columns)
+        return bool(self.max_depth[rows, columns].max() < z)
+
+    def clear_depth(self) -> None:
+        """Resets the depth buffer to 1 in place, only where it was drawn in if it has tiles
+        """
+        self.max_depth.fill(1)
+        self.stale_depth.fill(False)
+        if self.dirty_tiles is None:
+            self.depth_buffer.fill(1)
+            return
+        for rows, columns in self._tile_spans(self.dirty_tiles):
+            self.depth_buffer[rows, columns] = 1
+        self.dirty_tiles[...] = False
+
+    def save_depth(self) -> "tuple[np.ndarray, Optional[np.ndarray]]":
+        return self.depth_buffer.copy(), None if self.dirty_tiles is None else self.dirty_tiles.copy()
+
+    def restore_depth(self, saved: "tuple[np.ndarray, Optional[np.ndarray]]") -> None:
+        """Puts back a depth buffer returned by save_depth
+        """
+        depth, dirty = saved
+        # the saved depths can be further away than the ones in max_depth
+        self.max_depth.fill(1)
+        self.stale_depth.fill(True)
+        if self.dirty_tiles is None:
+            self.depth_buffer[...] = depth
+            return
+        # tiles that are clear in both are already the same
+        for rows, columns in self._tile_spans(dirty | self.dirty_tiles):
+            self.depth_buffer[rows, columns] = depth[rows, columns]
+        self.dirty_tiles[...] = dirty
+
+    def reset_screen_vertices(self):
+        """Used when the vertices, or the transform applied to them, change
+        """
+        self.screen_vertices = np.empty((0, 8))
 
     def clear(self):
         """Used to wipe info that will not cary over to the next image in the animation
         """
         self.vertex_list.clear()
-        self.projection = np.identity(4)
+        self.projection = IDENTITY
+        self.camera = None
+        self.view_projection = None
         self.color = RGBFloat(1.0, 1.0, 1.0)
-        self.depth_buffer = np.ones((self.height, self.width))
+        self.cull = False
+        self.blending = False
+        self.clear_depth()
+        self.reset_screen_vertices()
         self.if_state = IfState.NOI
 
 def over_operator(ca: int, cb: int, aa: int, ab, a0: int) -> int:
     return round((ca * aa + cb*ab*(1-aa))/a0)
 
+def over(top: np.ndarray, bottom: np.ndarray, premultiplied: bool = False) -> np.ndarray:
+    """The over operator, for arrays of RGBA colors from 0 to 255 with the channels on the
+    last axis, rounded. With premultiplied colors, whose red, green and blue are already
+    multiplied by their alpha, there is no divide by the combined alpha.
+
+    Args:
+        top (np.ndarray): the over colors
+        bottom (np.ndarray): the under colors
+
+    Returns:
+        np.ndarray: the new colors, as floats
+    """
+    top = np.asarray(top, dtype=float)
+    bottom = np.asarray(bottom, dtype=float)
+    aa = top[..., 3:] / 255
+    ab = bottom[..., 3:] / 255
+    a0 = aa + ab * (1-aa)
+    result = np.empty(np.broadcast(top, bottom).shape)
+    if premultiplied:
+        result[..., :3] = top[..., :3] + bottom[..., :3] * (1-aa)
+    else:
+        # nothing under nothing stays black
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[..., :3] = np.where(a0 > 0, (top[..., :3] * aa + bottom[..., :3] * ab * (1-aa)) / a0, 0)
+    result[..., 3:] = a0 * 255
+    return np.round(result)
+
 def add_pixel_colors(a: RGB, b: RGB) -> RGB:
     """Used to compute the new color of two pixels with alpha values. Uses the over
-    operator to acomplish this
+    operator to acomplish this, see over
 
     Args:
         a (RGB): the over color
@@ -104,16 +265,7 @@ def add_pixel_colors(a: RGB, b: RGB) -> RGB:
     Returns:
         RGB: the new pixel color
     """
-    aa = a.a/255
-    ab = b.a/255
-    a0 = aa + ab * (1-(aa))
-
-    r = over_operator(a.r, b.r, aa, ab, a0)
-    g = over_operator(a.g, b.g, aa, ab, a0)
-    b = over_operator(a.b, b.b, aa, ab, a0)
-
-    a0 = round(a0*255)
-    return RGB(r, g, b, a0)
+    return RGB(*(int(c) for c in over([a.r, a.g, a.b, a.a], [b.r, b.g, b.b, b.a])))
 
 def convert_hex_to_rgb(hex: str) -> RGB:
     # we will get the "hex" value in the form "#rrggbb"
@@ -136,6 +288,9 @@ def line_to_list(line: str) -> "list[str]":
     return line.split()
 
 def object_to_list(object) -> "list[Any]":
+    if not hasattr(object, "__dict__"):
+        # classes with __slots__, like vertex.Vertex, iterate over their fields
+        return list(object)
     vars_dict: dict = vars(object)
     output_list = []
     for key, val in vars_dict.items():
@@ -152,9 +307,51 @@ def object_to_list(object) -> "list[Any]":
 @dataclasses.dataclass
 class CmdLineArgs():
     file: str
+    jobs: int = 1
+    profile: bool = False
+    trace: Optional[str] = None
+    depth_dtype: type = np.float64
+    tile_size: Optional[int] = None
+    threads: Optional[int] = None
+    cache: Optional[str] = None
+    cache_size: int = 512
+    output: str = "png"
+    out: Optional[str] = None
+    fps: float = 24
 
 def parse_args(args: list) -> CmdLineArgs:
-    return CmdLineArgs(file = args[1])
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("file")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+        help="the number of processes rendering frames at once")
+    parser.add_argument("--profile", action="store_true",
+        help="time each stage of rendering and print a summary")
+    parser.add_argument("--trace", metavar="FILE",
+        help="write the profile of every frame to FILE, as JSON if it ends in .json and CSV otherwise")
+    parser.add_argument("--depth", choices=("float64", "float32"), default="float64",
+        help="the precision of the depth buffer")
+    parser.add_argument("--tile-size", type=int, default=0,
+        help="only reset the depth buffer in the tiles of this size that were drawn in, 0 resets all of it")
+    parser.add_argument("--threads", type=int, default=0,
+        help="draw the triangles of each frame on this many threads, one tile at a time")
+    parser.add_argument("--cache", metavar="DIR",
+        help="keep the frames rendered in DIR, and copy frames drawn from the same inputs from it instead of rendering them")
+    parser.add_argument("--cache-size", type=int, default=512, metavar="MB",
+        help="remove the frames used longest ago from the cache once it is bigger than this")
+    parser.add_argument("--output", choices=("png", "apng", "y4m", "raw"), default="png",
+        help="save a png per frame, or stream every frame into one animated png, YUV4MPEG2 video or raw RGBA video")
+    parser.add_argument("--out", metavar="FILE",
+        help="where the apng, y4m or raw output goes, - for stdout. apng defaults to the file's name with .png, the others to stdout")
+    parser.add_argument("--fps", type=float, default=24,
+        help="the frame rate of apng and y4m output")
+    parsed = parser.parse_args(args[1:])
+    if parsed.cache and parsed.output != "png":
+        parser.error("--cache only works with --output png")
+    return CmdLineArgs(file=parsed.file, jobs=parsed.jobs,
+        profile=parsed.profile or parsed.trace is not None, trace=parsed.trace,
+        depth_dtype=np.dtype(parsed.depth).type, tile_size=parsed.tile_size or None,
+        threads=parsed.threads or None, cache=parsed.cache, cache_size=parsed.cache_size,
+        output=parsed.output, out=parsed.out, fps=parsed.fps)
 
 def make_filename_list(image_info: ImageInfo) -> "list[str]":
     # List of names for image files
@@ -168,14 +365,6 @@ def make_filename_list(image_info: ImageInfo) -> "list[str]":
     return names_list
 
 
-### MAKING IMAGES ###
-def make_images(image_info: ImageInfo) -> list:
-    images = []
-    for _ in range(image_info.number_of_images):
-        image = Image.new("RGBA", (image_info.width, image_info.height), (0,0,0,0))
-        images.append(image)
-    return images
-
 ### ORIENTATION CLASSES ###
 @dataclasses.dataclass
 class Vec3():
@@ -197,28 +386,7 @@ class Quaternion():
         return np.asarray([self.w, self.x, self.y, self.z])
     
     def make_rotation(self) -> np.ndarray:
-        n = self.w**2 + self.x**2 + self.y**2 + self.z**2
-        s = 0 if n == 0 else 2/n
-        row_0 = [
-            1-s*(self.y**2 + self.z**2),
-            s*(self.x*self.y - self.z*self.w),
-            s*(self.x*self.z + self.y*self.w),
-            0
-        ]
-        row_1 = [
-            s*(self.x*self.y + self.z*self.w),
-            1-s*(self.x**2 + self.z**2),
-            s*(self.y*self.z - self.x*self.w),
-            0
-        ]
-        row_2 = [
-            s*(self.x*self.z - self.y*self.w),
-            s*(self.y*self.z + self.x*self.w),
-            1-s*(self.x**2 + self.y**2),
-            0
-        ]
-        row_3 = [0,0,0,1]
-        return np.asarray([row_0, row_1, row_2, row_3])
+        return quaternion_rotations(np.asarray([[self.w, self.x, self.y, self.z]], dtype=float))[0]
 
 @dataclasses.dataclass
 class Euler():
@@ -241,32 +409,48 @@ class Euler():
         return np.asarray([self.x, self.y, self.z])
     
     def make_rotation(self) -> np.ndarray:
-        rot = np.identity(4)
-        for i, val in enumerate([self.first, self.second, self.third]):
-            if self.order[i] == "x":
-                rot = np.matmul(rot, self._rot_x(val))
-            elif self.order[i] == "y":
-                rot = np.matmul(rot, self._rot_y(val))
-            elif self.order[i] == "z":
-                rot = np.matmul(rot, self._rot_z(val))
-        return rot
-    def _rot_x(self,theta):
-        theta = math.radians(theta)
-        return np.asarray([[ 1, 0              , 0              , 0],
-                           [ 0, math.cos(theta),-math.sin(theta), 0],
-                           [ 0, math.sin(theta), math.cos(theta), 0],
-                           [ 0, 0              ,0               , 1]])
-        
-    def _rot_y(self,theta):
-        theta = math.radians(theta)
-        return np.asarray([[ math.cos(theta), 0, math.sin(theta), 0],
-                           [ 0              , 1, 0              , 0],
-                           [-math.sin(theta), 0, math.cos(theta), 0],
-                           [ 0              , 0, 0              , 1]])
-        
-    def _rot_z(self,theta):
-        theta = math.radians(theta)
-        return np.asarray([[ math.cos(theta), -math.sin(theta), 0, 0 ],
-                           [ math.sin(theta), math.cos(theta) , 0, 0 ],
-                           [ 0              , 0               , 1, 0 ],
-                           [ 0              , 0               , 0, 1 ]])
\ No newline at end of file
+        return euler_rotations(self.order, np.asarray([[self.first, self.second, self.third]], dtype=float))[0]
+
+def quaternion_rotations(quaternions: np.ndarray) -> np.ndarray:
+    """The rotation matrices of an (F, 4) array of w, x, y, z quaternions, one for each
+    frame, as an (F, 4, 4) array. A zero quaternion gives the identity.
+    """
+    w, x, y, z = quaternions.T
+    # np.power calls pow like ** does on a float, squaring with ** on an array doesn't
+    w2, x2, y2, z2 = np.power(quaternions.T, 2.0)
+    n = w2 + x2 + y2 + z2
+    s = np.divide(2, n, out=np.zeros_like(n), where=n != 0)
+    rot = np.zeros((len(quaternions), 4, 4))
+    rot[:, 0, 0] = 1-s*(y2 + z2)
+    rot[:, 0, 1] = s*(x*y - z*w)
+    rot[:, 0, 2] = s*(x*z + y*w)
+    rot[:, 1, 0] = s*(x*y + z*w)
+    rot[:, 1, 1] = 1-s*(x2 + z2)
+    rot[:, 1, 2] = s*(y*z - x*w)
+    rot[:, 2, 0] = s*(x*z - y*w)
+    rot[:, 2, 1] = s*(y*z + x*w)
+    rot[:, 2, 2] = 1-s*(x2 + y2)
+    rot[:, 3, 3] = 1
+    return rot
+
+def euler_rotations(order: str, angles: np.ndarray) -> np.ndarray:
+    """The rotation matrices of an (F, 3) array of angles in degrees, rotating around the
+    axes in `order` like Euler, one for each frame, as an (F, 4, 4) array
+    """
+    # rotation matrix code from https://www.meccanismocomplesso.org/en/3d-rotations-and-euler-angles-in-python/
+    # the two axes each rotation mixes, the other one is left alone
+    planes = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}
+    rot = np.broadcast_to(np.identity(4), (len(angles), 4, 4))
+    for axis, theta in zip(order, np.radians(angles).T):
+        if axis not in planes:
+            continue
+        cos, sin = np.cos(theta), np.sin(theta)
+        a, b = planes[axis]
+        step = np.zeros((len(angles), 4, 4))
+        step[:, range(4), range(4)] = 1
+        step[:, a, a] = cos
+        step[:, a, b] = -sin
+        step[:, b, a] = sin
+        step[:, b, b] = cos
+        rot = np.matmul(rot, step)
+    return np.array(rot)
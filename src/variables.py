@@ -1,19 +1,48 @@
-import abc
-from typing import Dict, Union
+from typing import Dict, List, Optional, Set
 
 class Variables():
-    data: Dict[str, float] = {}
+    """The values of the variables in a file. Every variable, and every number literal
+    used in place of one, has a slot in `values` so compiled lines can read them by index.
+    Literal slots keep their value, variable slots are wiped at the start of every frame.
+    """
     def __init__(self, num_of_frames) -> None:
-        self.data["l"] = num_of_frames
-        self.data["f"] = 0
+        self.slots: Dict[str, int] = {}
+        self.values: List[Optional[float]] = []
+        self.literals: Dict[int, float] = {}
+        # slots of variables whose value is the same every frame
+        self.kept: Set[int] = set()
+        self.add_var("l", num_of_frames)
+        self.add_var("f", 0)
     def new_frame(self) -> None:
-        cur_frame = self.data["f"] + 1
-        num_of_frames = self.data["l"]
-        self.data.clear()
-        self.data["l"] = num_of_frames
-        self.data["f"] = cur_frame
+        self.set_frame(self.get_var("f") + 1)
+    def set_frame(self, frame: int) -> None:
+        """Wipes the variables and moves to any frame
+        """
+        num_of_frames = self.get_var("l")
+        for slot in range(len(self.values)):
+            if slot not in self.literals and slot not in self.kept:
+                self.values[slot] = None
+        self.add_var("l", num_of_frames)
+        self.add_var("f", frame)
+    def slot(self, name: str) -> int:
+        """The index in `values` of the variable `name`, or of the number it spells out
+        """
+        if name not in self.slots:
+            self.slots[name] = len(self.values)
+            try:
+                self.literals[self.slots[name]] = float(name)
+            except ValueError:
+                pass
+            self.values.append(self.literals.get(self.slots[name]))
+        return self.slots[name]
+    def keep(self, slot: int) -> None:
+        """Stops new_frame from wiping a slot, for variables that are the same every frame
+        """
+        self.kept.add(slot)
     def get_var(self, name: str) -> float:
-        return self.data[name]
+        val = self.values[self.slots[name]] if name in self.slots else None
+        if val is None:
+            raise KeyError(name)
+        return val
     def add_var(self, name: str, val: float):
-        self.data[name] = val
-    
\ No newline at end of file
+        self.values[self.slot(name)] = val
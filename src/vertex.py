@@ -1,34 +1,80 @@
-
-import dataclasses
-
 import numpy as np
 
-import src.utils as utils
+# the attributes of a vertex, in the order they are stored
+ATTRIBUTES = ("x", "y", "z", "w", "r", "g", "b", "a")
+# a vertex as a record, for buffers of many vertices. A float array with rows of the eight
+# attributes can be viewed as an array of these without copying, see as_records
+VERTEX_DTYPE = np.dtype([(name, np.float64) for name in ATTRIBUTES])
+
 
-@dataclasses.dataclass
 class Pixel():
-    x: int
-    y: int
-    r: int
-    g: int
-    b: int
-    a: int = 255
-
-@dataclasses.dataclass
+    __slots__ = ("x", "y", "r", "g", "b", "a")
+
+    def __init__(self, x: int, y: int, r: int, g: int, b: int, a: int = 255) -> None:
+        self.x = x
+        self.y = y
+        self.r = r
+        self.g = g
+        self.b = b
+        self.a = a
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.r, self.g, self.b, self.a))
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return "Pixel(" + ", ".join(f"{name}={val!r}" for name, val in zip(Pixel.__slots__, self)) + ")"
+
+
+def _attribute(index: int) -> property:
+    def get(self) -> float:
+        return self._data.item(index)
+    def set(self, val: float) -> None:
+        self._data[index] = val
+    return property(get, set)
+
 class Vertex():
-    x: float
-    y: float
-    z: float = 1
-    w: float = 1
-    r: float = 0
-    g: float = 0
-    b: float = 0
-    a: float = 255
+    """A point and its color. The eight attributes are kept in a single float64 array,
+    which may be a row of a larger vertex buffer, so as_ndarray, position_data and
+    ndarray_to_vertex hand out views of it rather than copies.
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, x: float, y: float, z: float = 1, w: float = 1,
+            r: float = 0, g: float = 0, b: float = 0, a: float = 255) -> None:
+        self._data = np.fromiter((x, y, z, w, r, g, b, a), np.float64, len(ATTRIBUTES))
+
+    @classmethod
+    def view(cls, data: np.ndarray) -> "Vertex":
+        """A vertex backed by `data`, eight float64 values, without copying it
+        """
+        v = cls.__new__(cls)
+        v._data = data
+        return v
+
+    x = _attribute(0)
+    y = _attribute(1)
+    z = _attribute(2)
+    w = _attribute(3)
+    r = _attribute(4)
+    g = _attribute(5)
+    b = _attribute(6)
+    a = _attribute(7)
 
     def __iter__(self):
-        return self
+        return iter(self._data.tolist())
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._data.tolist() == other._data.tolist()
+    def __repr__(self) -> str:
+        return "Vertex(" + ", ".join(f"{name}={val!r}" for name, val in zip(ATTRIBUTES, self)) + ")"
     def as_ndarray(self) -> np.ndarray:
-        return np.array(utils.object_to_list(self))
+        return self._data
     def as_pixel(self) -> Pixel:
         return Pixel(
             x=round(self.x),
@@ -39,13 +85,28 @@ class Vertex():
             a=round(255 * self.a),
         )
     def position_data(self) -> np.ndarray:
-        return np.array([self.x, self.y, self.z, self.w])
+        return self._data[:4]
 
 def ndarray_to_vertex(q: np.ndarray, is_rounded: bool = True) -> Vertex:
     if is_rounded:
-        return Vertex(
-                *(np.round(q.tolist()).astype(int))
-            )
-    return Vertex(
-        *(q.tolist())
-    )
\ No newline at end of file
+        q = np.round(q)
+    if q.shape == (len(ATTRIBUTES),) and q.dtype == np.float64:
+        return Vertex.view(q)
+    return Vertex(*(q.tolist()))
+
+def vertex_buffer(vertices: "list[Vertex]") -> np.ndarray:
+    """The vertices as rows of an (N, 8) float64 array
+    """
+    if not vertices:
+        return np.empty((0, len(ATTRIBUTES)))
+    return np.stack([v._data for v in vertices])
+
+def as_records(buffer: np.ndarray) -> np.ndarray:
+    """An (N, 8) float64 vertex buffer as an (N,) array of VERTEX_DTYPE, sharing its memory
+    """
+    return np.ascontiguousarray(buffer, dtype=np.float64).view(VERTEX_DTYPE).reshape(-1)
+
+def buffer_vertices(buffer: np.ndarray) -> "list[Vertex]":
+    """A Vertex for every row of an (N, 8) float64 buffer, each a view of its row
+    """
+    return [Vertex.view(row) for row in buffer]
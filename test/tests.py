@@ -1,7 +1,15 @@
+import concurrent.futures
+import json
+import math
+import os
+import struct
+import tempfile
+import time
 from math import pi
 import unittest
 
 import numpy as np
+from PIL import Image, ImageSequence
 import src.file_parse as file_parse
 import src.lines as lines
 import src.utils as utils
@@ -9,6 +17,17 @@ import src.vertex as vertex
 import src.curves as curves
 import src.variables as var
 import src.objects as obj
+import src.raster as raster
+import src.three_d as three_d
+import src.expressions as expressions
+import src.frame_cache as frame_cache
+import src.render as render
+import src.output as output
+import src.benchmark as benchmark
+import src.regression as regression
+import src.profiler as profiler
+import src.tiles as tiles
+from src.framebuffer import Framebuffer
 
 class TestVertex(unittest.TestCase):
     def test_convert_vertex_to_list(self):
@@ -26,6 +45,27 @@ class TestVertex(unittest.TestCase):
         ll = np.array(l)
         self.assertEqual(ll.all(), v.as_ndarray().all())
 
+    def test_views_share_memory(self):
+        v = vertex.Vertex(1, 2, 3)
+        self.assertTrue(np.shares_memory(v.as_ndarray(), v.position_data()))
+        v.position_data()[0] = 5
+        self.assertEqual(v.x, 5)
+        q = np.arange(8, dtype=float)
+        self.assertTrue(np.shares_memory(vertex.ndarray_to_vertex(q, is_rounded=False).as_ndarray(), q))
+        self.assertEqual(vertex.ndarray_to_vertex(np.array([1.4, 2.6])), vertex.Vertex(1, 3))
+
+    def test_vertex_buffer(self):
+        verts = [vertex.Vertex(1, 2, r=0.5), vertex.Vertex(3, 4, a=1)]
+        buffer = vertex.vertex_buffer(verts)
+        self.assertEqual(buffer.shape, (2, 8))
+        records = vertex.as_records(buffer)
+        self.assertEqual(records.dtype, vertex.VERTEX_DTYPE)
+        self.assertEqual(records["r"][0], 0.5)
+        self.assertEqual(records["y"][1], 4)
+        records["x"][1] = 7
+        self.assertEqual(vertex.buffer_vertices(buffer)[1].x, 7)
+        self.assertEqual(vertex.buffer_vertices(buffer)[0], verts[0])
+
 class TestUtils(unittest.TestCase):
     def test_convert_hex_to_rgb(self):
         hex_color = "#aaaaff"
@@ -79,6 +119,16 @@ class TestUtils(unittest.TestCase):
         for line in lines:
             out = utils.line_to_list(line)
             self.assertEqual(out, expected)
+    def test_parse_args(self):
+        args = utils.parse_args(["main.py", "scene.txt"])
+        self.assertEqual(args, utils.CmdLineArgs("scene.txt", 1))
+        args = utils.parse_args(["main.py", "--jobs", "8", "scene.txt"])
+        self.assertEqual(args, utils.CmdLineArgs("scene.txt", 8))
+        args = utils.parse_args(["main.py", "scene.txt", "--trace", "trace.csv"])
+        self.assertEqual(args, utils.CmdLineArgs("scene.txt", 1, profile=True, trace="trace.csv"))
+        args = utils.parse_args(["main.py", "scene.txt", "--output", "apng", "--fps", "12"])
+        self.assertEqual((args.output, args.out, args.fps), ("apng", None, 12))
+
     def test_add_add_pixl_colors(self):
         # The top pixel should take precidence when it has a full opacity
         c1 = utils.RGB(255, 255, 0, 255)
@@ -129,6 +179,54 @@ class TestUtils(unittest.TestCase):
         expected_db = np.ones((h, w))
         self.assertEqual(np.shape(dd.depth_buffer), np.shape(expected_db))
 
+    def test_draw_data_reuses_depth_buffer(self):
+        dd = utils.SceneData([], 20, 30, depth_dtype=np.float32)
+        depth = dd.depth_buffer
+        self.assertEqual(depth.dtype, np.float32)
+        depth[3, 4] = 0.5
+        dd.clear()
+        self.assertIs(dd.depth_buffer, depth)
+        self.assertTrue((depth == 1).all())
+
+    def test_depth_tiles(self):
+        dd = utils.SceneData([], 20, 30, tile_size=8)
+        self.assertEqual(dd.dirty_tiles.shape, (3, 4))
+        dd.mark_drawn(np.array([9.5, 17.2]), np.array([0.0, 3.0]))
+        self.assertEqual(np.argwhere(dd.dirty_tiles).tolist(), [[0, 1], [0, 2]])
+        dd.depth_buffer[0:3, 9:18] = 0.25
+        saved = dd.save_depth()
+        dd.clear()
+        self.assertTrue((dd.depth_buffer == 1).all())
+        self.assertFalse(dd.dirty_tiles.any())
+        # a tile that was never marked is not reset
+        dd.depth_buffer[19, 29] = 0.5
+        dd.clear()
+        self.assertEqual(dd.depth_buffer[19, 29], 0.5)
+        dd.depth_buffer[19, 29] = 1
+        dd.restore_depth(saved)
+        self.assertTrue(np.array_equal(dd.depth_buffer, saved[0]))
+        self.assertTrue(np.array_equal(dd.dirty_tiles, saved[1]))
+
+    def test_occludes(self):
+        dd = utils.SceneData([], 20, 30)
+        self.assertEqual(dd.max_depth.shape, (3, 4))
+        self.assertFalse(dd.occludes(0, 29, 0, 19, 0.5))
+        # squares that were drawn in are brought up to date when they are tested
+        dd.depth_buffer[0:16, 0:16] = 0.25
+        dd.mark_drawn(np.array([0.0, 15.0]), np.array([0.0, 15.0]))
+        self.assertTrue(dd.occludes(2, 14, 3, 15, 0.5))
+        self.assertFalse(dd.occludes(2, 14, 3, 15, 0.25))
+        self.assertFalse(dd.occludes(2, 16, 3, 15, 0.5))
+        # the squares on the edges are cut short
+        dd.depth_buffer[16:, 24:] = 0.1
+        dd.mark_drawn(np.array([24.0, 29.0]), np.array([16.0, 19.0]))
+        self.assertTrue(dd.occludes(25, 40, 17, 40, 0.2))
+        saved = dd.save_depth()
+        dd.clear()
+        self.assertFalse(dd.occludes(2, 14, 3, 15, 0.5))
+        dd.restore_depth(saved)
+        self.assertTrue(dd.occludes(2, 14, 3, 15, 0.5))
+
     def test_quaternion(self):
         q = utils.Quaternion()
         self.assertTrue(np.array_equal(np.asarray(q), np.asarray([1,0,0,0])))
@@ -245,6 +343,695 @@ class TestLines(unittest.TestCase):
         real = lines.lerp(p1, p2, t)
         self.assertEqual(expected.all(), real.all())
 
+class TestRaster(unittest.TestCase):
+    def assert_matches_triangle_fill(self, p1, p2, p3, height=math.inf):
+        expected = lines.triangle_fill(p1, p2, p3, height=height)
+        frags = raster.triangle_fragments(p1, p2, p3, height=height)
+        self.assertEqual(len(frags), len(expected))
+        for frag, vert in zip(frags, expected):
+            self.assertEqual(vertex.Vertex(*frag.tolist()), vert)
+
+    def test_triangle_fragments(self):
+        p1 = vertex.Vertex(1,1)
+        p2 = vertex.Vertex(1,3)
+        p3 = vertex.Vertex(3,1)
+        frags = raster.triangle_fragments(p1, p2, p3)
+        self.assertTrue(np.array_equal(frags["x"], [1, 2, 1]))
+        self.assertTrue(np.array_equal(frags["y"], [1, 1, 2]))
+        self.assertEqual(frags.dtype, raster.FRAGMENT_DTYPE)
+
+        p1 = vertex.Vertex(0,0)
+        frags = raster.triangle_fragments(p1, p1, p1)
+        self.assertEqual(len(frags), 0)
+
+    def test_matches_triangle_fill(self):
+        rng = np.random.default_rng(4810)
+        for _ in range(200):
+            verts = [vertex.Vertex(*rng.uniform(-10, 40, 2), *rng.uniform(0, 1, 6)) for _ in range(3)]
+            self.assert_matches_triangle_fill(*verts, height=30)
+        # flat top and flat bottom
+        self.assert_matches_triangle_fill(vertex.Vertex(0.5, 2.5), vertex.Vertex(9.2, 2.5), vertex.Vertex(4, 11.7))
+        self.assert_matches_triangle_fill(vertex.Vertex(0.5, 11.7), vertex.Vertex(9.2, 11.7), vertex.Vertex(4, 2.5))
+
+    def test_width_clips_fragments(self):
+        p1 = vertex.Vertex(-5.5, 0)
+        p2 = vertex.Vertex(30.2, 3)
+        p3 = vertex.Vertex(2, 20)
+        frags = raster.triangle_fragments(p1, p2, p3)
+        clipped = raster.triangle_fragments(p1, p2, p3, width=10)
+        on_screen = frags[(frags["x"] >= 0) & (frags["x"] < 10)]
+        self.assertTrue(np.array_equal(clipped, on_screen))
+
+    def test_far_left_spans_jump_to_the_screen(self):
+        p1 = vertex.Vertex(-1e4, 10, 0.5, r=1)
+        p2 = vertex.Vertex(100, 20, 0.3, g=1)
+        p3 = vertex.Vertex(100, 90, 0.7, b=1)
+        frags = raster.triangle_fragments(p1, p2, p3, height=120)
+        on_screen = frags[(frags["x"] >= 0) & (frags["x"] < 180)]
+        clipped = raster.triangle_fragments(p1, p2, p3, width=180, height=120)
+        # the same fragments, their attributes only rounded differently
+        self.assertTrue(np.array_equal(clipped[["x", "y"]], on_screen[["x", "y"]]))
+        for name in raster.FRAGMENT_DTYPE.names:
+            self.assertTrue(np.allclose(clipped[name], on_screen[name], rtol=0, atol=1e-9), name)
+        # without walking the columns left of the screen
+        p1.x = -1e9
+        start = time.perf_counter()
+        self.assertEqual(len(raster.triangle_fragments(p1, p2, p3, width=180, height=120)), len(clipped))
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_attributes(self):
+        rng = np.random.default_rng(17)
+        verts = [vertex.Vertex(*rng.uniform(-10, 40, 2), *rng.uniform(0, 1, 6)) for _ in range(3)]
+        frags = raster.triangle_fragments(*verts, width=30, height=30)
+        self.assertGreater(len(frags), 0)
+        # leaving attributes out doesn't change the ones that are kept
+        fewer = raster.triangle_fragments(*verts, width=30, height=30, attributes=("x", "y", "z", "g"))
+        self.assertEqual(fewer.dtype.names, ("x", "y", "z", "g"))
+        for name in fewer.dtype.names:
+            self.assertTrue(np.array_equal(fewer[name], frags[name]))
+        with self.assertRaises(Exception):
+            raster.triangle_fragments(*verts, attributes=("z", "x", "y"))
+
+    def test_height_clips_scanlines(self):
+        p1 = vertex.Vertex(3.2, -12.5)
+        p2 = vertex.Vertex(14, 2.4)
+        p3 = vertex.Vertex(-4, 9.9)
+        frags = raster.triangle_fragments(p1, p2, p3)
+        clipped = raster.triangle_fragments(p1, p2, p3, height=8)
+        on_screen = frags[(frags["y"] >= 0) & (frags["y"] < 8)]
+        self.assertTrue(np.array_equal(clipped, on_screen))
+
+class TestFramebuffer(unittest.TestCase):
+    def test_write_fragments(self):
+        fb = Framebuffer(4, 3)
+        depth = np.ones((3, 4))
+        x = np.asarray([0.0, 1.0, 5.0, 2.0])
+        y = np.asarray([0.0, 2.0, 1.0, 1.0])
+        z = np.asarray([0.5, 0.2, 0.1, 1.5])
+        fb.write_fragments(depth, 0, 1, x, y, z, np.asarray([255, 0, 0, 255]))
+        # off screen and past the far plane are dropped
+        self.assertEqual(np.count_nonzero(fb.color[:, :, 3]), 2)
+        self.assertEqual(fb.color[0, 0].tolist(), [255, 0, 0, 255])
+        self.assertEqual(depth[2, 1], 0.2)
+
+        # only the closer fragment replaces what is there
+        colors = np.asarray([[0, 255, 0, 255], [0, 0, 255, 255]])
+        fb.write_fragments(depth, 0, 1, x[:2], y[:2], np.asarray([0.7, 0.1]), colors)
+        self.assertEqual(fb.color[0, 0].tolist(), [255, 0, 0, 255])
+        self.assertEqual(fb.color[2, 1].tolist(), [0, 0, 255, 255])
+        self.assertEqual(depth[2, 1], 0.1)
+
+    def test_float32_redraw(self):
+        fb = Framebuffer(3, 1)
+        depth = np.ones((1, 3), dtype=np.float32)
+        x, y = np.asarray([0.0, 1.0, 2.0]), np.zeros(3)
+        # none of these are float32 values
+        z = np.asarray([0.1, 0.3, 0.7])
+        fb.write_fragments(depth, 0, 1, x, y, z, np.asarray([255, 0, 0, 255]))
+        # drawn again at the same depth, they pass like they do with float64
+        fb.write_fragments(depth, 0, 1, x, y, z, np.asarray([0, 0, 255, 255]))
+        self.assertEqual(fb.color[0, :, 2].tolist(), [255, 255, 255])
+        self.assertEqual(depth.dtype, np.float32)
+
+    def test_blend_fragments(self):
+        x = np.asarray([0.0, 1.0, 2.0])
+        y = np.asarray([0.0, 0.0, 0.0])
+        images = []
+        for premultiplied in (False, True):
+            fb = Framebuffer(3, 1, premultiplied=premultiplied)
+            depth = np.ones((1, 3))
+            fb.write_fragments(depth, 0, 1, x[:2], y[:2], np.asarray([0.5, 0.5]), np.asarray([200, 0, 0, 255], dtype=np.uint8))
+            # behind what is drawn at x = 1, and blended over nothing at x = 2
+            fb.blend_fragments(depth, 0, 1, x, y, np.asarray([0.2, 0.7, 0.2]), np.asarray([0, 0, 255, 102]))
+            self.assertEqual(depth.tolist(), [[0.5, 0.5, 1]])
+            images.append(np.asarray(fb.as_image()))
+        expected = [list(utils.over([0, 0, 255, 102], [200, 0, 0, 255])), [200, 0, 0, 255], [0, 0, 255, 102]]
+        self.assertEqual(images[0][0].tolist(), expected)
+        self.assertTrue(np.abs(images[1].astype(int) - images[0]).max() <= 1)
+
+    def test_as_image(self):
+        fb = Framebuffer(4, 3)
+        fb.color[1, 2] = [1, 2, 3, 4]
+        image = fb.as_image()
+        self.assertEqual(image.size, (4, 3))
+        self.assertEqual(image.getpixel((2, 1)), (1, 2, 3, 4))
+
+class TestThreeD(unittest.TestCase):
+    def make_scene(self):
+        draw_data = utils.SceneData([], 120, 180)
+        draw_data.projection = np.asarray([
+            0.6666666666666, 0, 0, 0, 0, 1, 0, 0, 0, 0, -1.02020202020202, -0.20202020202020202, 0, 0, -1, 0
+        ]).reshape(4, 4)
+        o = obj.Object()
+        o.position = utils.Vec3(0, 0, -5)
+        o.orient = utils.Quaternion(1, 0.3, 0.5, 0)
+        draw_data.curent_object = "box"
+        return draw_data, {"box": o}
+
+    def test_transform_vertices(self):
+        draw_data, objects = self.make_scene()
+        draw_data.vertex_list += [vertex.Vertex(-2, -2, -2), vertex.Vertex(2, -2, 2, r=0.5)]
+        screen = three_d.transform_vertices(draw_data, objects)
+        self.assertEqual(screen.shape, (2, 8))
+        for row, vert in zip(screen, draw_data.vertex_list):
+            expected = three_d.transform_vertex(vert, draw_data, objects)
+            self.assertTrue(np.allclose(row, expected.as_ndarray()))
+        self.assertEqual(screen[1, 4], 0.5)
+
+        # only the new vertices are transformed, the rest come from the cache
+        draw_data.screen_vertices[0, 0] = -1
+        draw_data.vertex_list.append(vertex.Vertex(2, 2, 2))
+        screen = three_d.transform_vertices(draw_data, objects)
+        self.assertEqual(screen.shape, (3, 8))
+        self.assertEqual(screen[0, 0], -1)
+
+        draw_data.reset_screen_vertices()
+        screen = three_d.transform_vertices(draw_data, objects)
+        self.assertNotEqual(screen[0, 0], -1)
+
+    def test_transform_matches_one_vertex_at_a_time(self):
+        draw_data, objects = self.make_scene()
+        rng = np.random.default_rng(3)
+        draw_data.vertex_list += [vertex.Vertex(*xyz) for xyz in rng.uniform(-3, 3, (200, 3))]
+        screen = three_d.transform_vertices(draw_data, objects)
+        position_matrix = objects["box"].position_matrix
+        for row, vert in zip(screen, draw_data.vertex_list):
+            # the object matrix and then the projection, applied to a single column vector
+            clip = np.matmul(draw_data.projection, np.matmul(position_matrix, vert.position_data()))
+            self.assertEqual(row[0], (clip[0] / clip[3] + 1) * draw_data.width / 2)
+            self.assertEqual(row[1], (clip[1] / clip[3] + 1) * draw_data.height / 2)
+            self.assertEqual(row[2], clip[2] / clip[3])
+
+    def test_is_culled(self):
+        draw_data = utils.SceneData([], 20, 30)
+        def corners(*points):
+            return [np.asarray([x, y, z, 1, 0, 0, 0, 1], dtype=float) for x, y, z in points]
+        # partly on the screen, then past the left side, the bottom and the far plane
+        self.assertFalse(three_d.is_culled(draw_data, *corners((-5, 2, 0.5), (4, 2, 0.5), (0, 8, 0.5))))
+        self.assertTrue(three_d.is_culled(draw_data, *corners((-5, 2, 0.5), (-1, 2, 0.5), (-3, 8, 0.5))))
+        self.assertTrue(three_d.is_culled(draw_data, *corners((5, 21, 0.5), (9, 25, 0.5), (7, 30, 0.5))))
+        self.assertTrue(three_d.is_culled(draw_data, *corners((5, 2, 1.5), (9, 2, 1.2), (7, 8, 2))))
+        # a corner exactly on the edge of the screen can still be drawn
+        self.assertFalse(three_d.is_culled(draw_data, *corners((-5, 2, 0.5), (0, 2, 0.5), (-3, 8, 0.5))))
+
+        # clockwise on the screen, where rows go down
+        clockwise = corners((2, 2, 0.5), (8, 2, 0.5), (2, 8, 0.5))
+        self.assertFalse(three_d.is_culled(draw_data, *clockwise))
+        draw_data.cull = True
+        self.assertTrue(three_d.is_culled(draw_data, *clockwise))
+        self.assertFalse(three_d.is_culled(draw_data, *clockwise[::-1]))
+        draw_data.clear()
+        self.assertFalse(draw_data.cull)
+
+    def test_is_occluded(self):
+        draw_data = utils.SceneData([], 20, 30)
+        image = Framebuffer(30, 20)
+        def corners(z, *points):
+            return [np.asarray([x, y, z, 1, 0, 0, 0, 1], dtype=float) for x, y in points]
+        # covers the whole screen
+        three_d.draw_3d_triangle(image, draw_data, *corners(0.4, (-10, -10), (60, -10), (-10, 60)))
+        small = ((5, 5), (10, 5), (5, 10))
+        self.assertTrue(three_d.is_occluded(draw_data, *corners(0.6, *small)))
+        self.assertFalse(three_d.is_occluded(draw_data, *corners(0.2, *small)))
+        before = image.color.copy()
+        three_d.draw_3d_triangle(image, draw_data, *corners(0.6, *small))
+        self.assertTrue(np.array_equal(image.color, before))
+
+class TestDependency(unittest.TestCase):
+    script = [
+        "div t f l",
+        "mul s t 2",
+        "add k 1 2",
+        "loadp 1 0 0 0  0 1 0 0  0 0 -1.02 -0.202  0 0 -1 0",
+        "object still world",
+        "position 0 0 -5",
+        "xyz -2 -2 0",
+        "xyz 2 -2 0",
+        "xyz 0 k 0",
+        "color 0 0.5 0.5",
+        "trif 1 2 3",
+        "object child still",
+        "xyz -1 -1 1",
+        "xyz 1 -1 1",
+        "xyz 0 1 1",
+        "trig 1 2 3",
+        "object moving still",
+        "position s 0 0",
+        "xyz -1 -1 0.5",
+        "xyz 1 -1 0.5",
+        "xyz 0 1 0.5",
+        "color 0.2 0.2 1",
+        "trif 1 2 3",
+        "iflt t 0.5",
+        "color 1 0 0",
+        "fi",
+        "object last world",
+        "position 2 2 -4",
+        "xyz -1 -1 0",
+        "xyz 1 -1 0",
+        "xyz 0 1 0",
+        "trif 1 2 3",
+    ]
+
+    def test_analyze(self):
+        v = var.Variables(4)
+        program = file_parse.compile_lines([line.split() for line in self.script], v)
+        deps = program.dependencies
+        self.assertEqual(deps.varying_slots, {v.slot("f"), v.slot("t"), v.slot("s")})
+        self.assertEqual(deps.varying_objects, {"moving"})
+        # the last triangle is drawn in a color set in a varying branch
+        self.assertEqual(deps.static_triangles, [10, 15])
+        self.assertEqual(deps.static_layer, 15)
+        self.assertEqual(deps.skippable, [6, 7, 8, 12, 13, 14])
+        self.assertIn(v.slot("k"), v.kept)
+
+    def test_hoisted_frames_match(self):
+        frames = 4
+        v = var.Variables(frames)
+        program = file_parse.compile_lines([line.split() for line in self.script], v)
+        draw_data = utils.SceneData([], 30, 40)
+        for frame in range(frames):
+            image = Framebuffer(40, 30)
+            file_parse.run_frame(program, image, draw_data, {})
+            # the same frame with nothing reused
+            expected = Framebuffer(40, 30)
+            fresh_vars = var.Variables(frames)
+            fresh_vars.add_var("f", frame)
+            fresh = file_parse.compile_lines([line.split() for line in self.script], fresh_vars)
+            file_parse.run_frame(fresh, expected, utils.SceneData([], 30, 40), {})
+            self.assertTrue(np.array_equal(image.color, expected.color), frame)
+            v.new_frame()
+            draw_data.clear()
+
+    def test_first_frame_rerun(self):
+        # benchmark.py starts over from the first frame by resetting frames_run
+        v = var.Variables(4)
+        program = file_parse.compile_lines([line.split() for line in self.script], v)
+        draw_data = utils.SceneData([], 30, 40)
+        stale = Framebuffer(40, 30)
+        stale.color[...] = 7
+        file_parse.run_frame(program, stale, draw_data, {})
+        program.frames_run = 0
+        draw_data.clear()
+        file_parse.run_frame(program, Framebuffer(40, 30), draw_data, {})
+        v.new_frame()
+        draw_data.clear()
+        image = Framebuffer(40, 30)
+        file_parse.run_frame(program, image, draw_data, {})
+        expected = Framebuffer(40, 30)
+        fresh_vars = var.Variables(4)
+        fresh_vars.add_var("f", 1)
+        fresh = file_parse.compile_lines([line.split() for line in self.script], fresh_vars)
+        file_parse.run_frame(fresh, expected, utils.SceneData([], 30, 40), {})
+        # the later frames copy back the layer saved by the first frame run last
+        self.assertTrue(np.array_equal(image.color, expected.color))
+
+    def test_redefined_variable(self):
+        script = ["add a f 0", "add a 0.5 0", "mul b a 1", "add c 0.5 0", "add c f 0", "mul d c 1"]
+        # with enough frames for the lines to be tabulated too
+        for frames in (4, expressions.MIN_FRAMES):
+            v = var.Variables(frames)
+            program = file_parse.compile_lines([line.split() for line in script], v)
+            # only slots that no varying line writes are kept
+            self.assertNotIn(v.slot("a"), v.kept)
+            self.assertNotIn(v.slot("c"), v.kept)
+            draw_data = utils.SceneData([], 30, 40)
+            for frame in range(frames):
+                file_parse.run_frame(program, Framebuffer(40, 30), draw_data, {})
+                self.assertEqual((v.get_var("b"), v.get_var("d")), (0.5, frame), frame)
+                v.new_frame()
+                draw_data.clear()
+
+    def test_moving_camera(self):
+        script = [
+            "object still world",
+            "position 0 0 -5",
+            "xyz -1 -1 0",
+            "xyz 1 -1 0",
+            "xyz 0 1 0",
+            "trif 1 2 3",
+            "camera eye world",
+            "position f 0 0",
+            "object other world",
+            "xyz -1 -1 -5",
+            "xyz 1 -1 -5",
+            "xyz 0 1 -5",
+            "trif 1 2 3",
+        ]
+        v = var.Variables(4)
+        deps = file_parse.compile_lines([line.split() for line in script], v).dependencies
+        self.assertEqual(deps.varying_objects, {"eye"})
+        # only the triangle drawn after the camera moves with it
+        self.assertEqual(deps.static_triangles, [5])
+        self.assertEqual(deps.static_layer, 5)
+
+    def test_varying_cull(self):
+        script = [
+            "object still world",
+            "iflt f 2",
+            "cull",
+            "fi",
+            "xyz -1 -1 0",
+            "xyz 1 -1 0",
+            "xyz 0 1 0",
+            "trif 1 2 3",
+        ]
+        v = var.Variables(4)
+        deps = file_parse.compile_lines([line.split() for line in script], v).dependencies
+        # whether the triangle is culled depends on the frame
+        self.assertEqual(deps.static_triangles, [])
+
+    def test_camera_view(self):
+        # moving the camera right draws the same image as moving the scene left
+        def draw(lines):
+            image = Framebuffer(40, 30)
+            program = file_parse.compile_lines([line.split() for line in lines], var.Variables(1))
+            file_parse.run_frame(program, image, utils.SceneData([], 30, 40), {})
+            return image.color
+        loadp = "loadp 1 0 0 0  0 1 0 0  0 0 -1.02 -0.202  0 0 -1 0"
+        triangle = ["xyz -1 -1 0", "xyz 1 -1 0", "xyz 0 1 0", "trif 1 2 3"]
+        seen = draw([loadp, "camera eye world", "position 0.5 0 0", "euler zyx 0 0 0",
+            "object tri world", "position 0 0 -5"] + triangle)
+        moved = draw([loadp, "object tri world", "position -0.5 0 -5"] + triangle)
+        self.assertTrue(seen.any())
+        self.assertTrue(np.array_equal(seen, moved))
+
+class TestRender(unittest.TestCase):
+    def test_render_frame_in_any_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "scene.txt")
+            with open(path, "w") as file:
+                file.write("pngs 40 30 scene- 4\n")
+                file.write("\n".join(TestDependency.script))
+            renderer = render.load(path)
+            in_order = []
+            for frame in range(4):
+                image = Framebuffer(40, 30)
+                render.render_frame(renderer, frame, image)
+                in_order.append(image)
+            renderer = render.load(path)
+            for frame in (2, 0, 3, 1):
+                image = Framebuffer(40, 30)
+                render.render_frame(renderer, frame, image)
+                self.assertTrue(np.array_equal(image.color, in_order[frame].color), frame)
+
+class TestTiles(unittest.TestCase):
+    def render(self, tiler, frames=3, script=TestDependency.script):
+        v = var.Variables(frames)
+        program = file_parse.compile_lines([line.split() for line in script], v)
+        draw_data = utils.SceneData([], 30, 40, tiler=tiler)
+        images = []
+        for frame in range(frames):
+            v.set_frame(frame)
+            image = Framebuffer(40, 30)
+            file_parse.run_frame(program, image, draw_data, {})
+            images.append((image.color, draw_data.depth_buffer.copy()))
+            draw_data.clear()
+        return images
+
+    def test_matches_serial(self):
+        serial = self.render(None)
+        for tiler in (tiles.Tiler(3, tile_size=8), tiles.Tiler(1, tile_size=64)):
+            for (color, depth), (expected_color, expected_depth) in zip(self.render(tiler), serial):
+                self.assertTrue(np.array_equal(color, expected_color))
+                self.assertTrue(np.array_equal(depth, expected_depth))
+
+    def test_translucent_in_order(self):
+        glass = ["object glass world", "position 0 0 -3", "color 1 1 0 0.5",
+            "xyz -2 -2 0", "xyz 2 -2 0", "xyz 0 2 0", "trif 1 2 3"]
+        serial = self.render(None, script=TestDependency.script + glass)
+        opaque = self.render(None)
+        for (color, depth), (opaque_color, opaque_depth) in zip(serial, opaque):
+            # blended over what was drawn before it, without changing the depth buffer
+            self.assertTrue(np.array_equal(depth, opaque_depth))
+            covered = (color != opaque_color).any(axis=-1)
+            self.assertTrue(covered.any())
+            self.assertTrue(np.array_equal(color[covered], utils.over([255, 255, 0, 128], opaque_color[covered])))
+        for (color, depth), (expected_color, expected_depth) in zip(self.render(tiles.Tiler(3, tile_size=8), script=TestDependency.script + glass), serial):
+            self.assertTrue(np.array_equal(color, expected_color))
+
+    def test_overlapping_fragments(self):
+        # fragments at fractional positions are drawn one batch at a time
+        rng = np.random.default_rng(3)
+        batches = []
+        for fractional in (False, True):
+            for _ in range(6):
+                # no pixel twice in a batch, and rounded positions stay on the screen
+                pixels = rng.choice(90, 50, replace=False)
+                x = pixels % 9 + (0.6 if fractional else 0.0)
+                y = pixels // 9 * 1.0
+                z = rng.choice([0.25, 0.5, 0.75], len(x))
+                batches.append((x, y, z, rng.integers(0, 255, (len(x), 4)).astype(float)))
+            expected = Framebuffer(10, 10)
+            depth = np.ones((10, 10))
+            tiler = tiles.Tiler(2, tile_size=4)
+            image = Framebuffer(10, 10)
+            draw_data = utils.SceneData([], 10, 10)
+            for batch in batches:
+                expected.write_fragments(depth, 0, 1, *batch)
+                tiler.add_fragments(image, draw_data, batch)
+            tiler.flush(image, draw_data)
+            self.assertTrue(np.array_equal(image.color, expected.color), fractional)
+            self.assertTrue(np.array_equal(draw_data.depth_buffer, depth), fractional)
+
+class TestProfiler(unittest.TestCase):
+    def test_profile_frames(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "scene.txt")
+            with open(path, "w") as file:
+                file.write("pngs 40 30 scene- 2\n")
+                file.write("\n".join(TestDependency.script))
+            profiler.active = profiler.Profiler()
+            try:
+                renderer = render.load(path)
+                for frame in range(2):
+                    image = Framebuffer(40, 30)
+                    render.render_frame(renderer, frame, image)
+            finally:
+                prof, profiler.active = profiler.active, None
+            self.assertEqual(prof.setup.calls, {"parse": 1})
+            self.assertEqual(sorted(prof.frames), [0, 1])
+            first = prof.frames[0]
+            self.assertEqual(first.calls["frame"], 1)
+            # four triangles, all rasterized on the first frame
+            self.assertEqual(first.calls["raster"], 4)
+            self.assertEqual(first.calls["depth"], 4)
+            self.assertGreater(first.fragments, first.off_screen + first.depth_rejected)
+            # numpy integers can't be written to json
+            self.assertEqual({type(first.fragments), type(first.off_screen), type(first.depth_rejected)}, {int})
+            self.assertIn("fragments", prof.summary())
+
+            trace = os.path.join(directory, "trace.csv")
+            prof.write_trace(trace)
+            with open(trace) as file:
+                self.assertEqual(len(file.readlines()), 3)
+            prof.write_trace(trace + ".json")
+            with open(trace + ".json") as file:
+                self.assertEqual([row["frame"] for row in json.load(file)["frames"]], [0, 1])
+
+    def test_inactive(self):
+        self.assertIsNone(profiler.active)
+        @profiler.timed("raster")
+        def work(x):
+            return x + 1
+        self.assertEqual(work(1), 2)
+
+class TestOutput(unittest.TestCase):
+    def test_png_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            names = [os.path.join(directory, f"frame{i}.png") for i in range(5)]
+            seen = set()
+            with output.PngWriter(4, 3, buffers=2) as writer:
+                for i, name in enumerate(names):
+                    image = writer.get_framebuffer()
+                    seen.add(id(image))
+                    # buffers come back cleared
+                    self.assertFalse(image.color.any())
+                    image.color[0, 0] = [i, 0, 0, 255]
+                    writer.write(image, name)
+            self.assertEqual(len(seen), 2)
+            for i, name in enumerate(names):
+                self.assertEqual(Image.open(name).getpixel((0, 0)), (i, 0, 0, 255))
+
+    def test_png_writer_error(self):
+        writer = output.PngWriter(4, 3)
+        writer.write(writer.get_framebuffer(), os.path.join("no", "such", "directory.png"))
+        self.assertRaises(FileNotFoundError, writer.close)
+
+    def test_apng_stream(self):
+        frames = np.zeros((3, 6, 8, 4), dtype=np.uint8)
+        frames[:, :, :, 3] = 255
+        frames[1, 2:4, 3:5] = [255, 0, 0, 255]
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, "anim.png")
+            with output.StreamWriter(output.ApngStream(name, 8, 6, 3, fps=10)) as writer:
+                for pixels in frames:
+                    image = writer.get_framebuffer()
+                    image.color[...] = pixels
+                    writer.write(image, None)
+            with open(name, "rb") as file:
+                data = file.read()
+            # the second frame only stores what changed, the third one undoes it
+            sizes = [struct.unpack(">II", data[i + 12:i + 20]) for i in range(len(data)) if data[i + 4:i + 8] == b"fcTL"]
+            self.assertEqual(sizes, [(8, 6), (2, 2), (2, 2)])
+            with Image.open(name) as image:
+                self.assertEqual(image.n_frames, 3)
+                self.assertEqual(image.info["duration"], 100)
+                for i, frame in enumerate(ImageSequence.Iterator(image)):
+                    self.assertTrue(np.array_equal(np.asarray(frame.convert("RGBA")), frames[i]))
+
+    def test_stream_writer_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stream = output.ApngStream(os.path.join(directory, "anim.png"), 8, 6, 3, fps=10)
+            # the error that stopped the frames isn't hidden by the ones missing
+            with self.assertRaises(RuntimeError):
+                with output.StreamWriter(stream) as writer:
+                    writer.write(writer.get_framebuffer(), None)
+                    raise RuntimeError("render failed")
+            self.assertTrue(stream.file.closed)
+            stream = output.ApngStream(os.path.join(directory, "anim.png"), 8, 6, 3, fps=10)
+            # without an error, the missing frames are
+            with self.assertRaises(ValueError):
+                with output.StreamWriter(stream) as writer:
+                    writer.write(writer.get_framebuffer(), None)
+
+    def test_bounded_map(self):
+        consumed = []
+        def items():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            results = render.bounded_map(pool, lambda i: i * i, items(), 3)
+            self.assertEqual(next(results), 0)
+            # only the window, and the one read, have been taken
+            self.assertEqual(len(consumed), 4)
+            self.assertEqual(list(results), [i * i for i in range(1, 10)])
+
+    def test_raw_and_y4m_streams(self):
+        pixels = np.zeros((2, 3, 4), dtype=np.uint8)
+        pixels[0, 0] = [255, 255, 255, 255]
+        pixels[1, 2] = [255, 0, 0, 128]
+        with tempfile.TemporaryDirectory() as directory:
+            raw, y4m = os.path.join(directory, "frames.rgba"), os.path.join(directory, "frames.y4m")
+            for stream in (output.open_stream("raw", raw, 3, 2, 2, 24), output.open_stream("y4m", y4m, 3, 2, 2, 24)):
+                stream.write_frame(pixels)
+                stream.write_frame(pixels)
+                stream.close()
+            self.assertTrue(np.array_equal(np.fromfile(raw, dtype=np.uint8).reshape(2, 2, 3, 4), [pixels, pixels]))
+            with open(y4m, "rb") as file:
+                header = file.readline()
+                self.assertEqual(header, b"YUV4MPEG2 W3 H2 F24:1 Ip A1:1 C444alpha\n")
+                self.assertEqual(file.readline(), b"FRAME\n")
+                y, cb, cr, a = np.frombuffer(file.read(4 * 6), dtype=np.uint8).reshape(4, 2, 3)
+            self.assertEqual((y[0, 0], cb[0, 0], cr[0, 0]), (235, 128, 128))
+            self.assertEqual((y[1, 0], cb[1, 0], cr[1, 0]), (16, 128, 128))
+            self.assertEqual((y[1, 2], cr[1, 2]), (81, 240))
+            self.assertEqual(a.tolist(), [[255, 0, 0], [0, 0, 128]])
+
+class TestFrameCache(unittest.TestCase):
+    def load(self, directory, script):
+        path = os.path.join(directory, "scene.txt")
+        with open(path, "w") as file:
+            file.write("pngs 40 30 scene- 4\n")
+            file.write("\n".join(script))
+        renderer = render.load(path)
+        renderer.filenames = [os.path.join(directory, name) for name in renderer.filenames]
+        return renderer
+
+    def test_only_changed_frames_rendered(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = frame_cache.FrameCache(os.path.join(directory, "cache"))
+            renderer = self.load(directory, TestDependency.script)
+            render.render_all(renderer, cache)
+            self.assertEqual(len(os.listdir(cache.directory)), 4)
+            # only frames 0 and 1 take the branch whose color changes
+            script = [line.replace("color 1 0 0", "color 0 1 0") for line in TestDependency.script]
+            changed = self.load(directory, script)
+            keys = [render.frame_key(renderer, frame) for frame in range(4)]
+            changed_keys = [render.frame_key(changed, frame) for frame in range(4)]
+            self.assertEqual([a == b for a, b in zip(keys, changed_keys)], [False, False, True, True])
+            render.render_all(changed, cache)
+            self.assertEqual(len(os.listdir(cache.directory)), 6)
+            reused = [np.asarray(Image.open(name)) for name in changed.filenames]
+            render.render_all(self.load(directory, script))
+            for image, name in zip(reused, changed.filenames):
+                self.assertTrue(np.array_equal(image, np.asarray(Image.open(name))))
+
+    def test_trim(self):
+        with tempfile.TemporaryDirectory() as directory:
+            frame = os.path.join(directory, "frame.png")
+            with open(frame, "wb") as file:
+                file.write(bytes(100))
+            cache = frame_cache.FrameCache(os.path.join(directory, "cache"), max_bytes=250)
+            for i, key in enumerate("abc"):
+                cache.store(key, frame)
+                os.utime(cache.path(key), (i, i))
+            # using a frame makes it the last to go
+            self.assertTrue(cache.fetch("a", frame))
+            self.assertFalse(cache.fetch("d", frame))
+            cache.trim()
+            self.assertEqual(sorted(os.listdir(cache.directory)), ["a.png", "c.png"])
+
+class TestRegression(unittest.TestCase):
+    def test_differing_pixels(self):
+        reference = np.zeros((1, 3, 4))
+        pixels = np.asarray([[[0, 0, 0, 0], [10, 0, 0, 0], [20, 0, 0, 0]]], dtype=np.uint8)
+        # 2% of 255 is 5.1, and the difference of one channel is halved over four
+        self.assertEqual(regression.differing_pixels(pixels, reference, 2).tolist(), [[False, False, True]])
+        self.assertFalse(regression.differing_pixels(pixels, reference, 4).any())
+
+    def test_check_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "scene.txt")
+            with open(path, "w") as file:
+                file.write("pngs 40 30 scene- 3\n")
+                file.write("\n".join(TestDependency.script))
+            reference = os.path.join(directory, "reference")
+            diffs = os.path.join(directory, "diffs")
+            self.assertIsNone(regression.check_file(path, reference, save_reference=True).error)
+            self.assertEqual(sorted(os.listdir(reference)), ["scene-000.png", "scene-001.png", "scene-002.png"])
+            result = regression.check_file(path, reference, diff_directory=diffs)
+            self.assertTrue(result.passed)
+            self.assertEqual(result.ae, [0, 0, 0])
+            self.assertFalse(os.path.exists(diffs))
+            # the frames can also come from one animated png named after the file
+            frames = [Image.open(os.path.join(reference, f"scene-00{i}.png")) for i in range(3)]
+            frames[0].save(os.path.join(reference, "scene.png"), save_all=True, append_images=frames[1:])
+            os.remove(os.path.join(reference, "scene-002.png"))
+            changed = np.asarray(frames[0]).copy()
+            changed[0:2, 0:3] = [255, 255, 255, 255]
+            Image.fromarray(changed).save(os.path.join(reference, "scene-000.png"))
+            result = regression.check_file(path, reference, diff_directory=diffs)
+            self.assertEqual((result.ae, result.failed), ([6, 0, 0], [0]))
+            self.assertEqual(result.diffs, [os.path.join(diffs, "diff-scene-000.png")])
+            self.assertEqual(Image.open(result.diffs[0]).size, (200, 30))
+            self.assertTrue(regression.check_file(path, reference, max_ae=6).passed)
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark_scene(self):
+        scene = benchmark.small_triangles(1, 24, 18, "trig")
+        result = benchmark.benchmark_scene(scene, repeat=1)
+        self.assertEqual(result["triangles"], 2 * 12 * 12)
+        self.assertEqual(result["vertices"], 13 * 13)
+        self.assertEqual(set(result["seconds"]), {"parse", "position_matrix", "transform_vertex",
+            "transform_vertices", "triangle_fill", "dda", "triangle_fragments", "frames", "save"})
+
+    def test_vertex_colors(self):
+        # the gouraud scenes are only worth timing if their vertices differ in color
+        for scene in (benchmark.small_triangles(1, 24, 18, "trig"), benchmark.huge_triangles(1, 24, 18, "trig"),
+                benchmark.many_frames(1, 24, 18)):
+            meshes, *_ = benchmark._trace_first_frame(benchmark._load(scene))
+            for name, vertices in meshes:
+                colors = {(v.r, v.g, v.b) for v in vertices}
+                self.assertGreaterEqual(len(colors), 3, (scene.name, name))
+
+    def test_compare(self):
+        baseline = {"scenes": {"a": {"seconds": {"parse": 0.1, "save": 0.1}}}}
+        results = {"scenes": {"a": {"seconds": {"parse": 0.2, "save": 0.11, "new": 1.0}},
+            "b": {"seconds": {"parse": 1.0}}}}
+        self.assertEqual(benchmark.compare(results, baseline), ["a parse: 0.1000s -> 0.2000s"])
+
 class TestCurves(unittest.TestCase):
     def test_draw_bezier_point(self):
         p1 = vertex.Vertex(0,0)
@@ -256,6 +1043,41 @@ class TestCurves(unittest.TestCase):
         expected = vertex.Vertex(3.0, 2.25)
         self.assertEqual(result,expected)
 
+    def test_polyline_pixels(self):
+        points = np.array([[0.3, 0.2, 0, 1, 0, 0, 0, 0], [17.6, 5.1, 0, 1, 1, 0, 0, 0], [12, 30.5, 0, 1, 0, 1, 0, 0]])
+        expected = lines.dda(points[0], points[1]) + lines.dda(points[1], points[2])
+        self.assertTrue(np.allclose(curves.polyline_pixels(points), expected))
+
+    def test_draw_bezier_curve(self):
+        # a straight line is one segment
+        line = [vertex.Vertex(0, 0), vertex.Vertex(4.5, 1.5), vertex.Vertex(9, 3)]
+        self.assertEqual(curves.bezier_segments(vertex.vertex_buffer(line)), 1)
+        self.assertEqual(len(curves.draw_bezier_curve(line)), 9)
+        control = [vertex.Vertex(10, 10), vertex.Vertex(60, 150), vertex.Vertex(140, -20), vertex.Vertex(180, 90)]
+        curve = vertex.vertex_buffer(curves.draw_bezier_curve(control))
+        # every pixel is close to the curve
+        dense = curves.bernstein_basis(3, 5000) @ vertex.vertex_buffer(control)
+        distance = np.hypot(curve[:, None, 0] - dense[:, 0], curve[:, None, 1] - dense[:, 1]).min(axis=1)
+        self.assertLess(distance.max(), curves.FLATNESS + 0.01)
+        self.assertIs(curves.bernstein_basis(3, 5000), curves.bernstein_basis(3, 5000))
+
+    def test_circle(self):
+        color = utils.RGB(10, 20, 30)
+        circle = curves.draw_circle(4, 6, 5, color)
+        self.assertEqual(circle[0], vertex.Vertex(-1, 6, r=10, g=20, b=30, a=255))
+        outline = curves.circle_offsets(5)
+        self.assertEqual({(v.x - 4, v.y - 6) for v in circle}, set(map(tuple, outline.tolist())))
+        self.assertIs(curves.circle_offsets(5), outline)
+        filled = curves.circle_offsets(5, filled=True)
+        self.assertEqual(len(filled), len(set(map(tuple, filled.tolist()))))
+        self.assertTrue(set(map(tuple, outline.tolist())) < set(map(tuple, filled.tolist())))
+        self.assertEqual(np.count_nonzero(filled[:, 1] == 0), 11)
+        # pixels off the screen are dropped
+        image = Framebuffer(8, 8)
+        curves.write_circle(image, 0, 0, 5, color, filled=True)
+        self.assertEqual(np.count_nonzero(image.color[..., 3]), np.count_nonzero((filled >= 0).all(axis=1)))
+        self.assertEqual(tuple(image.color[0, 0]), (10, 20, 30, 255))
+
 class TestFileParse(unittest.TestCase):
     def test_add(self):
         lines = [
@@ -273,6 +1095,52 @@ class TestFileParse(unittest.TestCase):
             exp += 2
             v.new_frame()
     
+    def test_compile_lines(self):
+        lines = [
+            ["add", "a", "f", "0"],
+            ["fps", "12"],
+            ["add", "b", "f", "1"],
+            ["add", "c", "b", "a"],
+        ]
+        frames = 5
+        v = var.Variables(frames)
+        program = file_parse.compile_lines(lines, v)
+        self.assertEqual(len(program.instructions), 3)
+        self.assertEqual(program.instructions[2].reads, (v.slot("b"), v.slot("a")))
+        self.assertEqual(program.instructions[2].writes, v.slot("c"))
+        exp = 1
+        for _ in range(frames):
+            file_parse.run_frame(program, None, None, None)
+            self.assertEqual(v.get_var("c"), exp)
+            exp += 2
+            v.new_frame()
+        self.assertRaises(KeyError, v.get_var, "c")
+
+    def test_compiled_branches(self):
+        # each list is run by the compiled program and line by line through if_state
+        scripts = [
+            ["iflt f 2", "add a 0 1", "else", "add a 0 2", "fi", "add b a 0"],
+            ["iflt f 2", "add a 0 1", "fi", "add b 0 3"],
+            ["iflt f 2", "add a 0 1", "else", "add a 0 2", "else", "add b 0 3", "fi"],
+            ["iflt f 2", "add a 0 1", "iflt 3 f", "add b 0 3", "else", "add b 0 4", "fi"],
+            ["else", "add a 0 5", "fi", "iflt f 1", "add b 0 6"],
+        ]
+        for script in scripts:
+            lines = [line.split() for line in script]
+            for frame in range(4):
+                compiled = var.Variables(4)
+                compiled.add_var("f", frame)
+                program = file_parse.compile_lines(lines, compiled)
+                file_parse.run_frame(program, None, None, None)
+                interpreted = var.Variables(4)
+                interpreted.add_var("f", frame)
+                draw_data = utils.SceneData([], 1, 1)
+                for line in lines:
+                    file_parse.parse_line(line, None, draw_data, interpreted, None)
+                for name in ("a", "b"):
+                    self.assertEqual(compiled.values[compiled.slot(name)],
+                        interpreted.values[interpreted.slot(name)], (script, frame, name))
+
     def test_var_val(self):
         v = var.Variables(10)
         v.add_var("a", 4)
@@ -301,6 +1169,44 @@ class TestFileParse(unittest.TestCase):
         self.assertEqual(val, float(d))
 
 
+class TestExpressions(unittest.TestCase):
+    script = [
+        "div t f l", "mul s t 360", "sin y s", "cos x s", "pow p t 1.5",
+        "iflt y 0", "sub z 0 y", "else", "add z y 0", "fi", "add w z x",
+    ]
+
+    def test_tabulate(self):
+        lines = [line.split() for line in self.script]
+        frames = expressions.MIN_FRAMES
+        v = var.Variables(frames)
+        program = file_parse.compile_lines(lines, v)
+        targets = file_parse._branch_targets([line[0] for line in lines])
+        tables = expressions.tabulate(program.instructions, targets, v)
+        self.assertEqual(set(tables.branches), {5})
+        self.assertEqual(len(tables.values[10]), frames)
+        # the table lookups give exactly what running the lines one by one does
+        for frame in range(frames):
+            file_parse.run_frame(program, None, None, None)
+            interpreted = var.Variables(frames)
+            interpreted.add_var("f", frame)
+            draw_data = utils.SceneData([], 1, 1)
+            for line in lines:
+                file_parse.parse_line(line, None, draw_data, interpreted, None)
+            for name in "tsyxpzw":
+                self.assertEqual(v.get_var(name), interpreted.get_var(name), (frame, name))
+            v.new_frame()
+
+    def test_falls_back(self):
+        lines = [["div", "q", "1", "f"]]
+        v = var.Variables(expressions.MIN_FRAMES)
+        program = file_parse.compile_lines(lines, v)
+        self.assertIsNone(expressions.tabulate(program.instructions, [None], v))
+        # the first frame fails the way it did before
+        self.assertRaises(ZeroDivisionError, file_parse.run_frame, program, None, None, None)
+        # a negative number to a fractional power is complex
+        program = file_parse.compile_lines([["sub", "q", "0", "f"], ["pow", "r", "q", "0.5"]], v)
+        self.assertIsNone(expressions.tabulate(program.instructions, [None, None], v))
+
 class TestObject(unittest.TestCase):
     def test_make_position_matrix(self):
         objects = {}
@@ -320,6 +1226,92 @@ class TestObject(unittest.TestCase):
         expected = np.asarray([[3,0,0,-2],[0,2,0,-2],[0,0,1,0],[0,0,0,1]])
         self.assertTrue(np.array_equiv(o2.position_matrix, expected))
     
+    def test_local_matrix_closed_form(self):
+        o = obj.Object()
+        o.origin = utils.Vec3(1, -2, 0.5)
+        o.scale = utils.Vec3(2, 0.5, 3)
+        o.position = utils.Vec3(-4, 1, 7)
+        o.orient = utils.Quaternion(0.9, 0.2, -0.4, 0.1)
+        # the product of the matrices described in the assignment
+        def translation(v):
+            m = np.identity(4)
+            m[:3, 3] = v
+            return m
+        scaling = np.diag([2, 0.5, 3, 1])
+        expected = translation([1, -2, 0.5]) @ translation([-4, 1, 7]) @ o.orient.make_rotation() \
+            @ scaling @ translation([-1, 2, -0.5])
+        self.assertTrue(np.allclose(o.make_local_matrix(), expected))
+
+    def test_matrices_kept_between_frames(self):
+        parent = obj.Object()
+        child = obj.Object("parent")
+        objects = {"parent": parent, "child": child}
+        parent.position = utils.Vec3(0, 0, -5)
+        child.position = utils.Vec3(1, 0, 0)
+        child.make_position_matrix(objects)
+        local = child.local_matrix
+        world = child.position_matrix
+        self.assertTrue(np.allclose(world[:3, 3], [1, 0, -5]))
+
+        # a new frame with the same inputs rebuilds nothing
+        parent.reset()
+        child.reset("parent")
+        parent.position = utils.Vec3(0, 0, -5)
+        child.position = utils.Vec3(1, 0, 0)
+        child.make_position_matrix(objects)
+        self.assertIs(child.local_matrix, local)
+        self.assertIs(child.position_matrix, world)
+
+        # moving the parent rebuilds the child's world matrix but not its local one
+        parent.reset()
+        child.reset("parent")
+        parent.position = utils.Vec3(0, 0, -6)
+        child.position = utils.Vec3(1, 0, 0)
+        child.make_position_matrix(objects)
+        self.assertIs(child.local_matrix, local)
+        self.assertTrue(np.allclose(child.position_matrix[:3, 3], [1, 0, -6]))
+
+    def test_inverse_matrix(self):
+        parent = obj.Object()
+        parent.position = utils.Vec3(3, -1, 2)
+        parent.orient = utils.Euler("xyz", 30, -45, 10)
+        parent.scale = utils.Vec3(2, 2, 0.5)
+        child = obj.Object("parent")
+        child.origin = utils.Vec3(1, 0, -1)
+        child.orient = utils.Quaternion(0.5, -0.3, 0.2, 0.7)
+        child.scale = utils.Vec3(0.25, 4, 1)
+        objects = {"parent": parent, "child": child}
+        inverse = child.make_inverse_matrix(objects)
+        self.assertTrue(np.allclose(inverse, np.linalg.inv(child.position_matrix)))
+        self.assertIs(child.make_inverse_matrix(objects), inverse)
+
+    def test_matrices_for_every_frame(self):
+        frames = 6
+        t = np.arange(frames, dtype=float)
+        positions = np.column_stack([t, -2 * t, np.full(frames, 3.0)])
+        angles = np.column_stack([15 * t, 40 - t, 7 * t])
+        quaternions = np.column_stack([np.cos(t), np.sin(t), 0.5 * t, np.ones(frames)])
+        local = {
+            "parent": obj.local_matrices(np.zeros((frames, 3)), np.ones((frames, 3)), positions,
+                utils.euler_rotations("zxy", angles)),
+            "child": obj.local_matrices(positions, np.full((frames, 3), 2.0), np.zeros((frames, 3)),
+                utils.quaternion_rotations(quaternions)),
+        }
+        self.assertEqual(local["child"].shape, (frames, 4, 4))
+        # the same, to the bit, as building them one frame at a time, and the parent
+        # chain is still applied a frame at a time
+        for f in range(frames):
+            parent = obj.Object()
+            parent.position = utils.Vec3(*positions[f])
+            parent.orient = utils.Euler("zxy", *angles[f])
+            child = obj.Object("parent")
+            child.origin = utils.Vec3(*positions[f])
+            child.scale = utils.Vec3(2, 2, 2)
+            child.orient = utils.Quaternion(*quaternions[f])
+            child.make_position_matrix({"parent": parent, "child": child})
+            self.assertTrue(np.array_equal(local["parent"][f], parent.position_matrix))
+            self.assertTrue(np.array_equal(np.matmul(local["parent"][f], local["child"][f]), child.position_matrix))
+
     def test_transform_vertex(self):
         objects = {}
         o = obj.Object()